@@ -1,6 +1,15 @@
+import pandas as pd
 import streamlit as st
 
+from core import telemetry
+from core.ui import history_panel, page_style, preload_modules, telemetry_panel
+
+# Copy-on-write lets dataset versions share unchanged columns (always on from pandas 3.0)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
 st.set_page_config(page_title='Datalyze', page_icon='images/logo.png')
+page_style()
 
 # st.sidebar.image('images/logo.png', use_container_width=True)
 
@@ -30,4 +39,13 @@ pg = st.navigation(
     }
 )
 
-pg.run()
+# Every rerun is traced when the session turned on the performance panel
+with telemetry.rerun(pg.title):
+    with st.sidebar:
+        history_panel()
+        telemetry_panel()
+
+    pg.run()
+
+# Libraries of the later pages load in the background once the first page is on screen
+preload_modules()
@@ -0,0 +1,371 @@
+'''Headless benchmarks of the dataset operations behind the pages.
+
+Every operation runs through the same code as its page (ingestion, profiling, the pipeline step
+builders and pipeline.apply_step, the model split) on the bundled datasets and on synthetic
+scale-ups whose rows are resampled from one of them. For each dataset and operation the result
+keeps the best wall time over the repeats, the growth of the resident set size while it ran,
+and from one extra run under tracemalloc the peak traced allocation and the number of Python
+memory blocks still allocated by its result.
+
+    python -m core.benchmark --output baseline.json
+    python -m core.benchmark --scales --baseline baseline.json --output benchmark.json
+
+The second form runs the bundled datasets only and exits with status 1 when an operation got
+slower or uses more memory than in the baseline.
+'''
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from core import ingest, modeling, pipeline
+from core.optimize import format_bytes, is_boolean, is_number, rss_bytes
+from core.profile import DataProfile
+
+BENCHMARK_FORMAT = 'datalyze-benchmark'
+BENCHMARK_VERSION = 1
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset')
+
+# Bundled datasets and the target used to split them, smallest first
+DATASETS = {
+    'heart.csv': 'HeartDisease',
+    'dataset.csv': 'Risk',
+    'diamonds.csv': 'price',
+    'diabetes_prediction_dataset.csv': 'diabetes',
+}
+SCALES = {'1M': 1000000, '10M': 10000000}
+SCALE_SOURCE = 'diabetes_prediction_dataset.csv'
+
+REPEAT = 3
+LARGE_ROWS = 1000000 # Frames of at least this many rows are measured once
+NULL_FRACTION = 0.05 # Share of the values removed from every column for the imputation operations
+ONE_HOT_MAX_UNIQUE = 50
+RSS_INTERVAL = 0.005
+
+# A result is a regression when it exceeds the baseline by the tolerance and by the minimum
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+MIN_SECONDS = 0.05
+MIN_BYTES = 16 * 1024 * 1024
+
+
+# Memory measurement
+def peak_rss(function):
+    '''Run `function` while a thread samples the resident set size, returns its result and the peak in bytes.'''
+    peak, done = [rss_bytes()], threading.Event()
+
+    def sample():
+        while not done.wait(RSS_INTERVAL):
+            peak[0] = max(peak[0], rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = function()
+    finally:
+        done.set()
+        sampler.join()
+    return result, max(peak[0], rss_bytes())
+
+
+def measure(function, repeat=REPEAT):
+    '''Best wall time and largest RSS growth over `repeat` runs, then allocations of one traced run.'''
+    times, rss_increase = [], 0
+    for _ in range(repeat):
+        gc.collect()
+        before = rss_bytes()
+        start = time.perf_counter()
+        result, peak = peak_rss(function)
+        times.append(time.perf_counter() - start)
+        rss_increase = max(rss_increase, peak - before)
+        del result
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        result = function()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    allocated_blocks = sys.getallocatedblocks() - blocks
+    del result
+    return {
+        'wall_seconds': min(times),
+        'rss_increase_bytes': int(rss_increase),
+        'traced_peak_bytes': int(traced_peak),
+        'allocated_blocks': int(allocated_blocks),
+        'repeat': repeat,
+    }
+
+
+# Datasets
+def with_nulls(df, target, fraction=NULL_FRACTION, random_state=0):
+    '''Copy of `df` with a `fraction` of the values of every feature (booleans excepted) set to null.'''
+    rng = np.random.default_rng(random_state)
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if column != target and not is_boolean(df[column]):
+            df[column] = df[column].mask(rng.random(len(df)) < fraction)
+    return df
+
+
+def prepare(name, path, df, target):
+    features = [column for column in df.columns if column != target]
+    return {
+        'name': name,
+        'path': path,
+        'df': df,
+        'nulls': with_nulls(df, target),
+        'target': target,
+        'numeric': [column for column in features if is_number(df[column])],
+        'categorical': [column for column in features if not is_number(df[column]) and not is_boolean(df[column])
+                        and df[column].nunique() <= ONE_HOT_MAX_UNIQUE],
+    }
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return ingest.ingest_file(f)[0]
+
+
+def scale_up(df, rows, random_state=0):
+    '''`rows` rows drawn with replacement from `df`, keeping its dtypes.'''
+    return df.sample(n=rows, replace=True, random_state=random_state, ignore_index=True)
+
+
+def datasets(names, scales, directory):
+    '''Yield the prepared bundled datasets, then the synthetic ones written as CSV to `directory`.'''
+    for name in names:
+        path = os.path.join(DATASET_DIR, name)
+        yield prepare(name, path, load(path), DATASETS[name])
+    if scales:
+        source = load(os.path.join(DATASET_DIR, SCALE_SOURCE))
+        for scale in scales:
+            df = scale_up(source, SCALES[scale])
+            path = os.path.join(directory, f'synthetic_{scale}.csv')
+            df.to_csv(path, index=False)
+            yield prepare(f'synthetic_{scale}', path, df, DATASETS[SCALE_SOURCE])
+            del df
+            os.remove(path)
+
+
+# Operations, each runs one page action on its own shallow copy of the data
+def _ingest(data):
+    return load(data['path'])
+
+
+def _profile(data):
+    df = data['df']
+    return DataProfile(df, {column: column for column in df.columns})
+
+
+def _change_type(data):
+    df = data['df']
+    return pipeline.apply_step(df.copy(deep=False), pipeline.astype_step(df, data['numeric'][:1], 'float64'))
+
+
+def _remove_duplicates(data):
+    return pipeline.apply_step(data['df'].copy(deep=False), {'op': 'drop_duplicates'})
+
+
+def _fill(strategy, kind=None):
+    def run(data):
+        df = data['nulls']
+        return pipeline.apply_step(df.copy(deep=False), pipeline.fillna_step(df, strategy, kind))
+    return run
+
+
+def _fill_group(data):
+    df = data['nulls']
+    by = (data['categorical'] or [data['target']])[0]
+    return pipeline.apply_step(df.copy(deep=False), pipeline.fillna_group_step(df, by, 'mean'))
+
+
+def _impute(method):
+    def run(data):
+        df = data['nulls']
+        return pipeline.apply_step(df.copy(deep=False), pipeline.impute_step(df, method))
+    return run
+
+
+def _add_feature(data):
+    left, right = data['numeric'][:2]
+    step = {'op': 'arithmetic', 'name': f'{left}_plus_{right}', 'left': left, 'right': right, 'operation': 'Addition'}
+    return pipeline.apply_step(data['df'].copy(deep=False), step)
+
+
+def _one_hot(data):
+    df = data['df']
+    return pipeline.apply_step(df.copy(deep=False), pipeline.encode_step(df, 'one_hot', data['categorical']))
+
+
+def _drop(data):
+    return pipeline.apply_step(data['df'].copy(deep=False), {'op': 'drop', 'columns': data['numeric'][:1]})
+
+
+def _rename(data):
+    column = data['numeric'][0]
+    return pipeline.apply_step(data['df'].copy(deep=False), {'op': 'rename', 'columns': {column: f'{column}_renamed'}})
+
+
+def _scale(method):
+    def run(data):
+        df = data['df']
+        return pipeline.apply_step(df.copy(deep=False), pipeline.scale_step(df, method, data['numeric']))
+    return run
+
+
+def _split(data):
+    df = data['df']
+    train_index, test_index = modeling.split_positions(len(df), 0.8, 42)
+    X = modeling.to_model_input(df[data['numeric']])
+    y = df[data['target']].to_numpy()
+    return X[train_index], X[test_index], y[train_index], y[test_index]
+
+
+# Name: (function, the prepared lists it needs at least one element of, in how many)
+OPERATIONS = {
+    'ingest': (_ingest, None, 0),
+    'profile': (_profile, None, 0),
+    'change_type': (_change_type, 'numeric', 1),
+    'remove_duplicates': (_remove_duplicates, None, 0),
+    'impute_mean': (_fill('mean'), None, 0),
+    'impute_median': (_fill('median'), None, 0),
+    'impute_mode': (_fill('mode', 'All of above'), None, 0),
+    'impute_group_mean': (_fill_group, None, 0),
+    'impute_knn': (_impute('knn'), 'numeric', 1),
+    'impute_iterative': (_impute('iterative'), 'numeric', 1),
+    'add_feature': (_add_feature, 'numeric', 2),
+    'one_hot': (_one_hot, 'categorical', 1),
+    'drop': (_drop, 'numeric', 1),
+    'rename': (_rename, 'numeric', 1),
+    'scale_minmax': (_scale('minmax'), 'numeric', 1),
+    'scale_standard': (_scale('standard'), 'numeric', 1),
+    'scale_robust': (_scale('robust'), 'numeric', 1),
+    'train_test_split': (_split, 'numeric', 1),
+}
+
+
+def select_operations(patterns=None):
+    if not patterns:
+        return list(OPERATIONS)
+    return [name for name in OPERATIONS if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+
+
+def run(names=tuple(DATASETS), scales=tuple(SCALES), operations=None, repeat=REPEAT, on_result=None):
+    '''Benchmark `operations` (fnmatch patterns, all by default) on the bundled and synthetic datasets.'''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for data in datasets(names, scales, directory):
+            rows, columns = data['df'].shape
+            for operation in select_operations(operations):
+                function, requires, count = OPERATIONS[operation]
+                if requires is not None and len(data[requires]) < count:
+                    continue
+                result = {'dataset': data['name'], 'rows': rows, 'columns': columns, 'operation': operation}
+                result.update(measure(lambda: function(data), repeat if rows < LARGE_ROWS else 1))
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    return results
+
+
+def environment():
+    import sklearn
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scikit-learn': sklearn.__version__,
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    '''Results slower or using more memory than the same dataset and operation in the `baseline` results.'''
+    previous = {(result['dataset'], result['operation']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['dataset'], result['operation']))
+        if before is None:
+            continue
+        for metric, tolerance, minimum in [('wall_seconds', time_tolerance, MIN_SECONDS), ('rss_increase_bytes', memory_tolerance, MIN_BYTES)]:
+            old, new = before[metric], result[metric]
+            if new - old > max(old * tolerance, minimum):
+                regressions.append({'dataset': result['dataset'], 'operation': result['operation'], 'metric': metric,
+                                    'baseline': old, 'current': new, 'change': (new - old) / old if old else None})
+    return regressions
+
+
+def dumps(results, regressions=()):
+    return json.dumps({'format': BENCHMARK_FORMAT, 'version': BENCHMARK_VERSION, 'environment': environment(),
+                       'results': list(results), 'regressions': list(regressions)}, indent=2)
+
+
+def loads(text):
+    benchmark = json.loads(text)
+    if benchmark.get('format') != BENCHMARK_FORMAT:
+        raise ValueError('Not a Datalyze benchmark file.')
+    return benchmark['results']
+
+
+def format_result(result):
+    return (f"{result['dataset']:<32} {result['operation']:<18} {result['wall_seconds']:>9.3f}s "
+            f"{format_bytes(result['rss_increase_bytes']):>10} RSS {format_bytes(result['traced_peak_bytes']):>10} traced "
+            f"{result['allocated_blocks']:>9} blocks")
+
+
+def format_regression(regression):
+    if regression['metric'] == 'wall_seconds':
+        old, new = f"{regression['baseline']:.3f}s", f"{regression['current']:.3f}s"
+    else:
+        old, new = format_bytes(regression['baseline']), format_bytes(regression['current'])
+    change = f" ({regression['change']:+.0%})" if regression['change'] is not None else ''
+    return f"{regression['dataset']} {regression['operation']}: {regression['metric']} {old} -> {new}{change}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Datalyze dataset operations.')
+    parser.add_argument('--datasets', nargs='*', choices=list(DATASETS), default=list(DATASETS), help='bundled datasets to run')
+    parser.add_argument('--scales', nargs='*', choices=list(SCALES), default=list(SCALES),
+                        help=f'synthetic row counts resampled from {SCALE_SOURCE}, none when given without values')
+    parser.add_argument('--operations', nargs='*', metavar='PATTERN', help=f"operations to run, e.g. 'impute_*' (from {', '.join(OPERATIONS)})")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help=f'runs per operation below {LARGE_ROWS} rows, the best time is kept')
+    parser.add_argument('--output', default='benchmark.json', help='results JSON file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to flag regressions against')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE, help='allowed slowdown over the baseline')
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE, help='allowed RSS growth over the baseline')
+    args = parser.parse_args(argv)
+    if int(pd.__version__.split('.')[0]) < 3: # Same sharing of unchanged columns as the app
+        pd.set_option('mode.copy_on_write', True)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = loads(f.read())
+    results = run(args.datasets, args.scales, args.operations, args.repeat, on_result=lambda result: print(format_result(result), flush=True))
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance) if baseline is not None else []
+    with open(args.output, 'w') as f:
+        f.write(dumps(results, regressions))
+    print(f'Done, {len(results)} results written to {args.output}')
+    if regressions:
+        print(f'{len(regressions)} regressions against {args.baseline}:')
+        for regression in regressions:
+            print(f'  {format_regression(regression)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+'''Duplicate detection behind the Remove Duplicate Data tab and the drop_duplicates step.
+
+Exact duplicates are found from 64-bit row hashes: every key column is hashed in chunks spread
+over a thread pool and the column hashes are combined row by row, so only one uint64 array per
+column is held instead of the rows themselves. Rows a hash marks as duplicates are compared with
+the first row of their hash group, and the rare collision falls back to pandas. The page gets
+counts and a preview of a few sampled groups, never the full set of duplicate rows.
+
+Near-duplicates of text are found with MinHash signatures of character shingles and
+locality-sensitive hashing (LSH): texts whose signatures agree on a whole band become candidates,
+and candidates with an estimated Jaccard similarity above the threshold end up in one group.
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+CHUNK_ROWS = 1000000
+HASH_MULTIPLIER = np.uint64(1000003)
+KEEP = {'first': 'first', 'last': 'last', 'none': False} # Step value -> pandas `keep`
+KEEP_OPTIONS = {
+    'First copy': 'first',
+    'Last copy': 'last',
+    'No copy': 'none',
+}
+PREVIEW_GROUPS = 20
+
+# Near-duplicate detection
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+NEAR_THRESHOLD = 0.8
+
+
+def combine(hashes, num_rows):
+    '''Row hashes from per-column hashes, in the column order given.'''
+    fingerprints = np.zeros(num_rows, dtype=np.uint64)
+    for column_hashes in hashes:
+        fingerprints = fingerprints * HASH_MULTIPLIER ^ column_hashes
+    return fingerprints
+
+
+def column_hashes(series, executor, chunk_rows=CHUNK_ROWS):
+    chunks = [series.iloc[start:start + chunk_rows] for start in range(0, len(series), chunk_rows)]
+    hashed = list(executor.map(lambda chunk: pd.util.hash_pandas_object(chunk, index=False).to_numpy(), chunks))
+    return np.concatenate(hashed) if hashed else np.empty(0, dtype=np.uint64)
+
+
+def row_hashes(df, columns=None, hashes=None, max_workers=MAX_WORKERS):
+    '''64-bit hash per row of `df` on `columns` (default all), reusing the precomputed column `hashes` given.'''
+    columns = list(df.columns if columns is None else columns)
+    hashes = dict(hashes or {})
+    missing = [column for column in columns if column not in hashes]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for column in missing:
+                hashes[column] = column_hashes(df[column], executor)
+    return combine([hashes[column] for column in columns], len(df))
+
+
+def _same_rows(df, left, right):
+    '''Whether the rows at positions `left` and `right` are equal column by column, nulls included.'''
+    for column in df.columns:
+        values = df[column]
+        a, b = values.iloc[left].reset_index(drop=True), values.iloc[right].reset_index(drop=True)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            a, b = a.cat.codes, b.cat.codes
+        equal = (a == b).fillna(False).to_numpy(dtype=bool) | (a.isna() & b.isna()).to_numpy()
+        if not equal.all():
+            return False
+    return True
+
+
+def duplicated(df, subset=None, keep='first', hashes=None, fingerprints=None):
+    '''Boolean mask of the rows of `df` that are duplicates on `subset`, as DataFrame.duplicated with `keep` in KEEP.
+
+    `fingerprints` are the row hashes on `subset` when already computed.
+    '''
+    columns = list(subset or df.columns)
+    fingerprints = pd.Series(row_hashes(df, columns, hashes) if fingerprints is None else fingerprints)
+    mask = fingerprints.duplicated(keep=KEEP[keep]).to_numpy()
+    flagged = np.flatnonzero(mask)
+    if len(flagged):
+        firsts = fingerprints.drop_duplicates()
+        first_position = pd.Series(firsts.index.to_numpy(), index=firsts.to_numpy())
+        representatives = first_position.reindex(fingerprints.to_numpy()[flagged]).to_numpy()
+        if not _same_rows(df[columns], flagged, representatives): # A hash collision, let pandas decide
+            return df.duplicated(subset=columns, keep=KEEP[keep]).to_numpy()
+    return mask
+
+
+def _preview(df, groups, flagged, max_groups, random_state=0):
+    '''Rows of up to `max_groups` randomly chosen groups with more than one row, with their group and whether they are removed.'''
+    groups = pd.Series(groups)
+    sizes = groups.map(groups.value_counts())
+    candidates = groups[sizes.to_numpy() > 1].unique()
+    if len(candidates) == 0:
+        return df.iloc[:0].assign(Group=pd.Series(dtype='int64'), Removed=pd.Series(dtype='bool'))
+    chosen = np.random.default_rng(random_state).choice(candidates, min(max_groups, len(candidates)), replace=False)
+    positions = np.flatnonzero(groups.isin(chosen).to_numpy())
+    order = np.lexsort((positions, pd.factorize(groups.to_numpy()[positions])[0]))
+    positions = positions[order]
+    preview = df.iloc[positions].copy()
+    preview.insert(0, 'Removed', flagged[positions], allow_duplicates=True)
+    preview.insert(0, 'Group', pd.factorize(groups.to_numpy()[positions])[0] + 1, allow_duplicates=True)
+    return preview
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def report(version_id, _df, subset=None, keep='first', _hashes=None, max_groups=PREVIEW_GROUPS):
+    '''Counts and a sampled preview of the exact duplicates of a dataset version on `subset`.'''
+    columns = list(subset or _df.columns)
+    fingerprints = row_hashes(_df, columns, _hashes)
+    flagged = duplicated(_df, columns, keep, fingerprints=fingerprints)
+    counts = pd.Series(fingerprints).value_counts()
+    return {
+        'num_duplicates': int(flagged.sum()),
+        'num_groups': int((counts > 1).sum()),
+        'preview': _preview(_df, fingerprints, flagged, max_groups),
+    }
+
+
+# Near-duplicates
+def _mix(values):
+    '''splitmix64 finalizer, a fast bijective scrambling of 64-bit values.'''
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    '''Character `size`-grams of the lowercased text with runs of whitespace collapsed.'''
+    text = ' '.join(text.lower().split())
+    return {text[start:start + size] for start in range(max(len(text) - size + 1, 1))}
+
+
+def minhash(texts, num_permutations=NUM_PERMUTATIONS, random_state=0):
+    '''MinHash signature of every text, an array of shape (len(texts), num_permutations).'''
+    if not len(texts):
+        return np.empty((0, num_permutations), dtype=np.uint64)
+    sets = [shingles(text) for text in texts]
+    lengths = np.fromiter((len(values) for values in sets), dtype=np.int64, count=len(sets))
+    hashed = pd.util.hash_array(np.fromiter((value for values in sets for value in values), dtype=object, count=int(lengths.sum())))
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    seeds = np.random.default_rng(random_state).integers(0, 2 ** 63, num_permutations, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_permutations), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for permutation, seed in enumerate(seeds):
+            signatures[:, permutation] = np.minimum.reduceat(_mix(hashed ^ seed), offsets)
+    return signatures
+
+
+def bands(threshold, num_permutations=NUM_PERMUTATIONS):
+    '''(bands, rows per band) whose LSH threshold, about (1 / bands) ** (1 / rows), is the highest one below `threshold`.'''
+    options = [(num_permutations // rows, rows) for rows in range(1, num_permutations + 1) if num_permutations % rows == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= threshold]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1])) if below else options[0]
+
+
+def _components(num_items, left, right):
+    '''Label of the connected component of every item, given the edges (left, right).'''
+    labels = np.arange(num_items)
+    while True:
+        smallest = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smallest)
+        np.minimum.at(updated, right, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def near_groups(texts, threshold=NEAR_THRESHOLD, num_permutations=NUM_PERMUTATIONS):
+    '''Group label of every text, texts with an estimated Jaccard similarity of at least `threshold` share one.'''
+    signatures = minhash(texts, num_permutations)
+    num_bands, rows = bands(threshold, num_permutations)
+    positions = np.arange(len(texts))
+    left, right = [], []
+    with np.errstate(over='ignore'):
+        for band in range(num_bands):
+            keys = combine(signatures[:, band * rows:(band + 1) * rows].T, len(texts))
+            codes = pd.factorize(keys)[0]
+            first = np.full(codes.max() + 1 if len(codes) else 0, len(texts))
+            np.minimum.at(first, codes, positions)
+            members = first[codes] != positions # Every bucket is linked to its first text
+            left.append(positions[members])
+            right.append(first[codes][members])
+    left, right = np.concatenate(left), np.concatenate(right)
+    if len(left):
+        pairs = np.unique(np.stack([left, right], axis=1), axis=0)
+        left, right = pairs[:, 0], pairs[:, 1]
+        similar = (signatures[left] == signatures[right]).mean(axis=1) >= threshold
+        left, right = left[similar], right[similar]
+    return _components(len(texts), left, right)
+
+
+def row_texts(df, columns):
+    '''The values of `columns` joined into one string per row, nulls as empty strings.'''
+    texts = None
+    for column in columns:
+        values = df[column].astype('string').fillna('')
+        texts = values if texts is None else texts + ' ' + values
+    return texts
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def near_report(version_id, _df, columns, threshold=NEAR_THRESHOLD, max_groups=PREVIEW_GROUPS):
+    '''Counts and a sampled preview of the groups of rows whose text in `columns` is nearly the same.
+
+    Signatures are computed once per distinct text, so exact copies cost nothing extra. Every group
+    keeps its first row, the others are reported as removable.
+    '''
+    codes, uniques = pd.factorize(row_texts(_df, columns).to_numpy(), use_na_sentinel=False)
+    groups = near_groups(list(uniques), threshold)[codes]
+    flagged = pd.Series(groups).duplicated().to_numpy()
+    sizes = np.bincount(groups)
+    return {
+        'num_duplicates': int(flagged.sum()),
+        'num_groups': int((sizes > 1).sum()),
+        'preview': _preview(_df, groups, flagged, max_groups),
+    }
@@ -0,0 +1,206 @@
+'''Column profiling engine behind the EDA Automation page.
+
+Column summaries run in a thread pool (pandas/numpy release the GIL for the heavy parts) and
+are yielded as they finish. Large columns use mergeable sketches fed chunk by chunk:
+HyperLogLog for distinct counts and a merging t-digest for quantiles.
+'''
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.optimize import is_number
+
+APPROX_MIN_ROWS = 1000000 # In 'auto' mode, columns with at least this many rows use sketches
+SKETCH_CHUNK_ROWS = 1000000
+SAMPLE_ROWS = 200000 # Rows used for approximate top-k values and correlations
+HISTOGRAM_BINS = 30
+TOP_K = 10
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+
+class HyperLogLog:
+    '''Distinct count estimate from 2**p registers, about 1.04 / sqrt(2**p) relative error.'''
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def update(self, series):
+        hashes = pd.util.hash_pandas_object(series.dropna(), index=False).to_numpy()
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        remaining = hashes << np.uint64(self.p)
+        # Leading zeros of the remaining bits, split in 32-bit halves so float log2 stays exact
+        high = (remaining >> np.uint64(32)).astype(np.float64)
+        low = (remaining & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        with np.errstate(divide='ignore'):
+            zeros = np.where(high > 0, 31 - np.floor(np.log2(high)), 63 - np.floor(np.log2(np.maximum(low, 1))))
+        rank = np.minimum(zeros + 1, 64 - self.p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and empty: # Linear counting for small cardinalities
+            estimate = m * math.log(m / empty)
+        return int(round(estimate))
+
+
+class TDigest:
+    '''Merging t-digest: sorted centroids compressed with the k1 scale function.'''
+
+    def __init__(self, compression=500):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min, self.max = np.inf, -np.inf
+
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+        means = np.concatenate([self.means, values])
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        # k1 scale: small centroids near the tails, large ones around the median
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        buckets, starts = np.unique(k, return_index=True)
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, qs):
+        if not len(self.means):
+            return [np.nan for _ in qs]
+        cumulative = np.cumsum(self.weights) - self.weights / 2
+        positions = np.asarray(qs) * self.weights.sum()
+        xp = np.concatenate([[0], cumulative, [self.weights.sum()]])
+        fp = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(positions, xp, fp).tolist()
+
+
+def _use_sketches(num_rows, mode):
+    return mode == 'approximate' or (mode == 'auto' and num_rows >= APPROX_MIN_ROWS)
+
+
+def _top_values(series, approximate):
+    if approximate and len(series) > SAMPLE_ROWS:
+        counts = series.sample(SAMPLE_ROWS, random_state=0).value_counts().head(TOP_K)
+        counts = (counts * len(series) / SAMPLE_ROWS).round().astype('int64')
+    else:
+        counts = series.value_counts().head(TOP_K)
+    return [(value, int(count)) for value, count in counts.items()]
+
+
+def summarize_column(series, mode='auto'):
+    '''Summary statistics, histogram / top values of one column. `mode` is 'auto', 'exact' or 'approximate'.'''
+    approximate = _use_sketches(len(series), mode)
+    summary = {
+        'dtype': str(series.dtype),
+        'count': int(series.notna().sum()),
+        'missing': int(series.isna().sum()),
+        'approximate': approximate,
+    }
+    if approximate:
+        hll = HyperLogLog()
+        for start in range(0, len(series), SKETCH_CHUNK_ROWS):
+            hll.update(series.iloc[start:start + SKETCH_CHUNK_ROWS])
+        summary['distinct'] = hll.count()
+    else:
+        summary['distinct'] = int(series.nunique())
+    if is_number(series):
+        values = series.to_numpy(dtype='float64', na_value=np.nan)
+        finite = values[np.isfinite(values)]
+        summary.update({
+            'mean': float(finite.mean()) if len(finite) else np.nan,
+            'std': float(finite.std(ddof=1)) if len(finite) > 1 else np.nan,
+            'min': float(finite.min()) if len(finite) else np.nan,
+            'max': float(finite.max()) if len(finite) else np.nan,
+        })
+        if approximate:
+            digest = TDigest()
+            for start in range(0, len(finite), SKETCH_CHUNK_ROWS):
+                digest.update(finite[start:start + SKETCH_CHUNK_ROWS])
+            summary['quantiles'] = dict(zip(QUANTILES, digest.quantile(QUANTILES)))
+        else:
+            summary['quantiles'] = dict(zip(QUANTILES, np.quantile(finite, QUANTILES).tolist() if len(finite) else [np.nan] * len(QUANTILES)))
+        summary['histogram'] = np.histogram(finite, bins=HISTOGRAM_BINS) if len(finite) else None
+    else:
+        summary['top_values'] = _top_values(series, approximate)
+    return summary
+
+
+def correlation_matrix(df, mode='auto'):
+    numeric = df[[column for column in df.columns if is_number(df[column])]]
+    if _use_sketches(len(df), mode) and len(numeric) > SAMPLE_ROWS:
+        numeric = numeric.sample(SAMPLE_ROWS, random_state=0)
+    return numeric.astype('float64').corr()
+
+
+def profile_columns(df, mode='auto', skip=()):
+    '''Yield (column, summary) pairs as the thread pool finishes them.'''
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(summarize_column, df[column], mode): column for column in df.columns if column not in skip}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+class EdaCache:
+    '''Results per (dataset version, mode), filled column by column so interrupted runs resume.'''
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version_id, mode):
+        with self._lock:
+            key = (version_id, mode)
+            if key not in self._entries:
+                self._entries[key] = {'columns': {}, 'correlation': None}
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+
+@st.cache_resource
+def get_eda_cache():
+    return EdaCache()
+
+
+def summary_table(summaries, columns):
+    '''One row per finished column, in dataset column order.'''
+    rows = {}
+    for column in columns:
+        if column not in summaries:
+            continue
+        summary = summaries[column]
+        quantiles = summary.get('quantiles', {})
+        rows[column] = {
+            'Data Type': summary['dtype'],
+            'Count': summary['count'],
+            'Missing': summary['missing'],
+            'Distinct': summary['distinct'],
+            'Mean': summary.get('mean'),
+            'Std': summary.get('std'),
+            'Min': summary.get('min'),
+            '25%': quantiles.get(0.25),
+            '50%': quantiles.get(0.5),
+            '75%': quantiles.get(0.75),
+            'Max': summary.get('max'),
+            'Top Value': summary['top_values'][0][0] if summary.get('top_values') else None,
+            'Approximate': summary['approximate'],
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
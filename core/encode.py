@@ -0,0 +1,101 @@
+'''Encodings of categorical features used by the encoding steps of the pipeline.
+
+One-hot encoding can produce sparse columns (Sparse[uint8]) that store only the ones, and the
+Machine Learning Lab hands those to scikit-learn as a CSR matrix without densifying them. For
+high-cardinality features, ordinal codes, target encoding and feature hashing keep one column
+(or a fixed number of columns) per feature.
+'''
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.optimize import is_boolean, is_number
+
+ENCODINGS = {
+    'One-Hot (dense)': 'one_hot',
+    'One-Hot (sparse)': 'one_hot_sparse',
+    'Ordinal (category codes)': 'ordinal',
+    'Target Encoding': 'target',
+    'Feature Hashing': 'hash',
+}
+HASH_BUCKETS = 32
+SMOOTHING = 10 # Weight of the global mean in target encoding, in rows
+SAMPLE_ROWS = 100000 # Rows encoded to estimate memory and time of every encoding
+MAX_DENSE_CELLS = 20000000 # Larger dense one-hot samples are only estimated, not built
+
+
+def is_sparse(series):
+    return isinstance(series.dtype, pd.SparseDtype)
+
+
+def densify(df):
+    '''Dense copy of the sparse columns, for Arrow (display, Parquet) which does not support them.'''
+    sparse = [column for column in df.columns if is_sparse(df[column])]
+    if not sparse:
+        return df
+    return df.assign(**{column: df[column].sparse.to_dense() for column in sparse})
+
+
+def codes(series, categories):
+    '''Position of every value in `categories`, -1 for nulls and unseen values.'''
+    return pd.Categorical(series, categories=categories).codes
+
+
+def sparse_indicators(positions, n_columns, columns, index):
+    '''Sparse[uint8] indicator columns with a one at `positions` (-1 for none) in every row.'''
+    from scipy import sparse
+    rows = np.flatnonzero(positions >= 0)
+    matrix = sparse.csc_matrix((np.ones(len(rows), dtype='uint8'), (rows, positions[rows])), shape=(len(positions), n_columns))
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=columns)
+
+
+def target_means(series, target, smoothing=SMOOTHING):
+    '''Mean of `target` per category shrunk towards the global mean, which is also returned for unseen categories.'''
+    y = target.astype('float64')
+    prior = y.mean()
+    stats = y.groupby(series, observed=True).agg(['sum', 'count'])
+    return (stats['sum'] + smoothing * prior) / (stats['count'] + smoothing), prior
+
+
+def hash_values(series):
+    '''Stable 64-bit hash per value, numbers hashed as float64 so 1 and 1.0 fall in the same bucket.'''
+    values = series.astype('float64') if is_number(series) else series.astype(str)
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def candidate_columns(df, nunique, max_numeric_unique=50):
+    '''Features that can be encoded: every text/category feature, and numbers with few distinct values.'''
+    return [column for column in df.columns if nunique[column] > 1 and not is_boolean(df[column]) and not is_sparse(df[column])
+            and (not is_number(df[column]) or nunique[column] <= max_numeric_unique)]
+
+
+def _memory(df):
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def compare_encodings(version_id, _df, columns, target=None, n_buckets=HASH_BUCKETS, drop_first=True):
+    '''Estimated output columns, memory and time of every encoding of `columns`, measured on a sample.'''
+    from core import pipeline
+    df = _df[list(columns) + ([target] if target else [])]
+    sample = df.sample(n=SAMPLE_ROWS, random_state=42) if len(df) > SAMPLE_ROWS else df
+    scale = len(df) / max(len(sample), 1)
+    rows = [{'Encoding': 'Current', 'Columns': len(columns), 'Memory (bytes)': _memory(df[list(columns)]), 'Time (s)': 0.0}]
+    for label, encoding in ENCODINGS.items():
+        if encoding == 'target' and not target:
+            continue
+        start = time.perf_counter()
+        step = pipeline.encode_step(sample, encoding, columns, target, n_buckets, drop_first)
+        if encoding == 'one_hot':
+            # Dense dummies take a byte per row and category, estimated before they get too large to build
+            n_columns = sum(len(categories) - drop_first for categories in step['categories'].values())
+            if len(sample) * n_columns > MAX_DENSE_CELLS:
+                rows.append({'Encoding': label, 'Columns': n_columns, 'Memory (bytes)': len(df) * n_columns, 'Time (s)': np.nan})
+                continue
+        encoded = pipeline.apply_step(sample.copy(), step)
+        elapsed = time.perf_counter() - start
+        output = [column for column in encoded.columns if column not in sample.columns or column in columns]
+        rows.append({'Encoding': label, 'Columns': len(output), 'Memory (bytes)': int(_memory(encoded[output]) * scale), 'Time (s)': elapsed * scale})
+    return pd.DataFrame(rows)
@@ -0,0 +1,378 @@
+'''Lazy execution of pipeline steps on stored dataset versions, with pluggable compute backends.
+
+A plan is a scan of a stored version followed by pipeline steps (see core.pipeline). It only runs
+when a page or the Machine Learning Lab asks for data. Before it runs, the plan is optimized:
+columns that are dropped or not asked for are pruned from the scan, so they are never read from the
+column store, steps that only compute pruned columns are skipped, and row filters (dropna and
+drop_duplicates) move towards the scan so the steps after them see fewer rows.
+
+Backends run the steps they support natively and multi-threaded, Polars or DuckDB when installed,
+and hand the other steps to the pandas implementation in core.pipeline. pandas is the reference and
+is always available. Native backends only compute the surviving row positions and the columns the
+steps write, every other column is carried over from pandas, so results match across backends.
+'''
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+from core import expressions, pipeline
+
+FILTERS = ('dropna', 'drop_duplicates')
+_IN_PLACE = { # Columns an operation rewrites without adding them
+    'astype': lambda step: step['columns'],
+    'fillna': lambda step: list(step['values']),
+    'fillna_group': lambda step: list(step['values']),
+    'impute': lambda step: step['columns'],
+    'ordinal': lambda step: step['columns'],
+    'target_encode': lambda step: step['columns'],
+    'scale': lambda step: list(step['statistics']),
+    'arithmetic': lambda step: [step['name']],
+    'power': lambda step: [step['name']],
+    'expression': lambda step: [name for name, _ in step['features']],
+}
+_ROW = '__row__'
+
+
+def empty_like(df):
+    '''Zero-row copy of `df`, enough to replay steps for their output columns and dtypes.'''
+    return df.iloc[:0].copy()
+
+
+def check_columns(columns, op=None):
+    '''Reject a column list with repeated names, which no backend (nor the column store) can hold.'''
+    columns = pd.Index(columns)
+    duplicates = columns[columns.duplicated()].unique()
+    if len(duplicates):
+        names = ', '.join(repr(column) for column in duplicates)
+        raise ValueError(f"Step '{op}' would create more than one feature named {names}." if op else f'The dataset has more than one feature named {names}.')
+
+
+def schemas(schema, steps):
+    '''Column lists before every step and after the last one, found by replaying `steps` on the empty `schema`.'''
+    columns, frame = [list(schema.columns)], schema
+    for step in steps:
+        frame = pipeline.apply_step(frame.copy(deep=False), step)
+        check_columns(frame.columns, step['op'])
+        columns.append(list(frame.columns))
+    return columns, frame
+
+
+def reads(step, columns):
+    '''Columns a step reads when applied to a frame with `columns`.'''
+    op = step['op']
+    if op in FILTERS:
+        return list(step.get('subset') or columns)
+    if op == 'fillna_group':
+        return list(step['values']) + [step['by']]
+    if op == 'arithmetic':
+        return [step['left'], step['right']]
+    if op == 'power':
+        return [step['column']]
+    if op == 'expression':
+        return expressions.referenced(step['features'], columns)
+    if op in ('one_hot', 'hash'):
+        return list(step['columns'])
+    return list(_IN_PLACE[op](step)) if op in _IN_PLACE else []
+
+
+def writes(step, before, after):
+    '''Columns a step adds or rewrites, given the columns before and after it.'''
+    written = [column for column in after if column not in before]
+    if step['op'] in _IN_PLACE:
+        written += [column for column in _IN_PLACE[step['op']](step) if column in before and column in after]
+    return written
+
+
+def _swap(step, condition, before, after):
+    '''`condition` (a filter after `step`) rewritten to run before it, or None when that changes the result.'''
+    if step['op'] in FILTERS:
+        return None
+    subset = condition['subset']
+    if step['op'] == 'rename':
+        inverse = {new: old for old, new in step['columns'].items()}
+        return dict(condition, subset=[inverse.get(column, column) for column in subset])
+    written = writes(step, before, after)
+    if not set(written) & set(subset):
+        return condition
+    # Rows equal on a feature's inputs are equal on the feature, so duplicates can be found before it is added
+    added_only = set(before) <= set(after) and not set(written) & set(before)
+    if condition['op'] == 'drop_duplicates' and added_only and set(reads(step, before)) <= set(subset):
+        return dict(condition, subset=[column for column in subset if column not in written])
+    return None
+
+
+def optimize(schema, steps, columns=None):
+    '''Return (scan columns, steps, output columns) computing `columns` (default all) of `steps` on a frame like `schema`.'''
+    steps = [dict(step) for step in steps]
+    columns_at, _ = schemas(schema, steps)
+    for position, step in enumerate(steps): # Filters get explicit subsets so they can move past other steps
+        if step['op'] in FILTERS and not step.get('subset'):
+            step['subset'] = columns_at[position]
+
+    # Filter pushdown
+    moved = True
+    while moved:
+        moved = False
+        for position in range(1, len(steps)):
+            if steps[position]['op'] in FILTERS:
+                condition = _swap(steps[position - 1], steps[position], columns_at[position - 1], columns_at[position])
+                if condition is not None:
+                    steps[position - 1:position + 1] = [condition, steps[position - 1]]
+                    columns_at, _ = schemas(schema, steps)
+                    moved = True
+
+    # Projection pushdown, walking back from the requested columns
+    output = columns_at[-1] if columns is None else list(columns)
+    needed = set(output)
+    kept = []
+    for position in reversed(range(len(steps))):
+        step, before, after = steps[position], columns_at[position], columns_at[position + 1]
+        if step['op'] == 'rename':
+            needed = {dict((new, old) for old, new in step['columns'].items()).get(column, column) for column in needed}
+        elif step['op'] in FILTERS:
+            needed |= set(step['subset'])
+        else:
+            written = writes(step, before, after)
+            if step['op'] == 'drop' or not needed & set(written):
+                continue # Dropped columns are left out of the scan, and nobody asks for what the step computes
+            needed = needed - (set(after) - set(before)) | set(reads(step, before))
+        kept.append(step)
+    return [column for column in schema.columns if column in needed], kept[::-1], output
+
+
+def explain(schema, steps, columns=None):
+    '''Readable optimized plan, one line per operation.'''
+    scan, steps, _ = optimize(schema, steps, columns)
+    lines = [f'scan {len(scan)} of {len(schema.columns)} columns: {", ".join(map(str, scan))}']
+    for step in steps:
+        details = ', '.join(f'{key}={value}' for key, value in step.items() if key in ('subset', 'columns', 'name'))
+        lines.append(f'{step["op"]}({details})')
+    return lines
+
+
+class PandasBackend:
+    '''Reference backend, every step runs through core.pipeline.'''
+
+    name = 'pandas'
+
+    def supports(self, step):
+        return False
+
+
+class NativeBackend:
+    '''Runs drops, renames, filters, arithmetic, powers and scaling outside pandas.
+
+    Only the input columns the steps read are handed over. The engine returns the positions of the
+    surviving rows and the columns the steps computed, cast to the dtypes pandas would have given them.
+    '''
+
+    OPERATIONS = ('drop', 'rename', 'dropna', 'drop_duplicates', 'arithmetic', 'power', 'scale')
+    module = None
+
+    def available(self):
+        return importlib.util.find_spec(self.module) is not None
+
+    def supports(self, step):
+        return step['op'] in self.OPERATIONS
+
+    def run(self, df, steps):
+        if _ROW in df.columns:
+            raise NotImplementedError(f'Column {_ROW} is reserved.')
+        _, expected = schemas(empty_like(df), steps)
+        origin = {column: column for column in df.columns} # Current name -> input column, None once computed
+        inputs, filtered, native = [], False, []
+        for step in steps:
+            if step['op'] in FILTERS and not step.get('subset'):
+                step = dict(step, subset=list(origin))
+            native.append(step)
+            if step['op'] == 'drop':
+                origin = {column: source for column, source in origin.items() if column not in step['columns']}
+            elif step['op'] == 'rename':
+                origin = {step['columns'].get(column, column): source for column, source in origin.items()}
+            else:
+                for column in reads(step, list(origin)):
+                    if origin[column] is not None and origin[column] not in inputs:
+                        inputs.append(origin[column])
+                filtered = filtered or step['op'] in FILTERS
+                for column in _IN_PLACE.get(step['op'], lambda step: [])(step):
+                    origin[column] = None
+        computed = [column for column in expected.columns if origin[column] is None]
+        rows, values = self.compute(df[inputs], native, computed)
+        index = pd.RangeIndex(len(rows)) if filtered else df.index
+        result = {}
+        for column in expected.columns:
+            if origin[column] is None:
+                result[column] = pd.Series(values[column]).astype(expected[column].dtype).array
+            else:
+                series = df[origin[column]]
+                result[column] = (series.iloc[rows] if filtered else series).array
+        return pd.DataFrame(result, index=index, copy=False)
+
+    def compute(self, df, steps, computed):
+        '''Return (surviving row positions, {computed column: values}) of `steps` on `df`.'''
+        raise NotImplementedError
+
+
+class PolarsBackend(NativeBackend):
+    name = 'polars'
+    module = 'polars'
+    # Polars divides by a constant through its reciprocal, which can differ from pandas in the last bit
+    OPERATIONS = ('drop', 'rename', 'dropna', 'drop_duplicates', 'arithmetic', 'power')
+
+    def compute(self, df, steps, computed):
+        import polars as pl
+        frame = pl.from_pandas(df, nan_to_null=True).lazy().with_row_index(_ROW)
+        for step in steps:
+            frame = self._step(pl, frame, step)
+        result = frame.select([_ROW] + computed).collect()
+        return result[_ROW].to_numpy(), {column: result[column].to_numpy() for column in computed}
+
+    @staticmethod
+    def _upcast(pl, schema, column, integer_only=False):
+        dtype = schema[column]
+        if dtype.is_integer():
+            return pl.col(column).cast(pl.Int64)
+        if dtype.is_float() and not integer_only:
+            return pl.col(column).cast(pl.Float64)
+        raise NotImplementedError(f'{column} is not handled natively.')
+
+    def _step(self, pl, frame, step):
+        schema = frame.collect_schema()
+        op = step['op']
+        if op == 'drop':
+            return frame.drop([column for column in step['columns'] if column in schema])
+        if op == 'rename':
+            return frame.rename({old: new for old, new in step['columns'].items() if old in schema})
+        if op == 'dropna':
+            return frame.drop_nulls(subset=step['subset'])
+        if op == 'drop_duplicates':
+            keep = {'first': 'first', 'last': 'last', 'none': 'none'}[step.get('keep', 'first')]
+            return frame.unique(subset=step['subset'], keep=keep, maintain_order=True)
+        if op == 'arithmetic':
+            left, right = self._upcast(pl, schema, step['left']), self._upcast(pl, schema, step['right'])
+            operation = {'Addition': left + right, 'Subtraction': left - right, 'Multiplication': left * right, 'Division': left / right}
+            expressions = {step['name']: operation[step['operation']]}
+        else: # power, floating point powers are left to pandas as libm and Polars round differently
+            expressions = {step['name']: self._upcast(pl, schema, step['column'], integer_only=True).pow(step['degree'])}
+        frame = frame.with_columns(**expressions)
+        schema = frame.collect_schema()
+        # NaN from 0/0 counts as missing for the filters, like in pandas
+        return frame.with_columns(**{name: pl.col(name).fill_nan(None) for name in expressions if schema[name].is_float()})
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class DuckDBBackend(NativeBackend):
+    name = 'duckdb'
+    module = 'duckdb'
+
+    def compute(self, df, steps, computed):
+        import duckdb
+        kinds = {column: 'float32' if df[column].dtype == 'float32' else 'float' if pd.api.types.is_float_dtype(df[column])
+                 else 'int' if pd.api.types.is_integer_dtype(df[column]) else 'other' for column in df.columns}
+        query = f'SELECT * FROM source'
+        for step in steps:
+            query = self._step(step, query, kinds)
+        connection = duckdb.connect()
+        try:
+            connection.register('source', df.assign(**{_ROW: np.arange(len(df))}))
+            columns = ', '.join(_quote(column) for column in [_ROW] + computed)
+            result = connection.execute(f'SELECT {columns} FROM ({query}) ORDER BY {_ROW}').df()
+        finally:
+            connection.close()
+        return result[_ROW].to_numpy(), {column: result[column] for column in computed}
+
+    @staticmethod
+    def _upcast(kinds, column):
+        if kinds[column] == 'int':
+            return f'CAST({_quote(column)} AS BIGINT)'
+        if kinds[column] in ('float', 'float32'):
+            return f'CAST({_quote(column)} AS DOUBLE)'
+        raise NotImplementedError(f'{column} is not numeric.')
+
+    def _step(self, step, query, kinds):
+        op = step['op']
+        if op == 'drop':
+            for column in step['columns']:
+                kinds.pop(column, None)
+            return f'SELECT {", ".join([_ROW] + [_quote(column) for column in kinds])} FROM ({query})'
+        if op == 'rename':
+            mapping = step['columns']
+            selected = ', '.join(f'{_quote(column)} AS {_quote(mapping.get(column, column))}' for column in kinds)
+            kinds_renamed = {mapping.get(column, column): kind for column, kind in kinds.items()}
+            kinds.clear()
+            kinds.update(kinds_renamed)
+            return f'SELECT {_ROW}, {selected} FROM ({query})'
+        if op == 'dropna':
+            return f'SELECT * FROM ({query}) WHERE {" AND ".join(f"{_quote(column)} IS NOT NULL" for column in step["subset"])}'
+        if op == 'drop_duplicates':
+            partition = ', '.join(_quote(column) for column in step['subset'])
+            keep = step.get('keep', 'first')
+            if keep == 'none':
+                return f'SELECT * FROM ({query}) QUALIFY count(*) OVER (PARTITION BY {partition}) = 1'
+            order = 'DESC' if keep == 'last' else 'ASC'
+            return f'SELECT * FROM ({query}) QUALIFY row_number() OVER (PARTITION BY {partition} ORDER BY {_ROW} {order}) = 1'
+        if op == 'arithmetic':
+            left, right = self._upcast(kinds, step['left']), self._upcast(kinds, step['right'])
+            if step['operation'] == 'Division':
+                values, kind = f'CAST({left} AS DOUBLE) / CAST({right} AS DOUBLE)', 'float'
+            else:
+                sign = {'Addition': '+', 'Subtraction': '-', 'Multiplication': '*'}[step['operation']]
+                kind = 'int' if kinds[step['left']] == kinds[step['right']] == 'int' else 'float'
+                values = f'{left} {sign} {right}'
+            expressions = {step['name']: (values, kind)}
+        elif op == 'power':
+            degree, base = step['degree'], self._upcast(kinds, step['column'])
+            if kinds[step['column']] != 'int' or not isinstance(degree, int) or not 0 < degree <= 16:
+                raise NotImplementedError('Floating point powers are left to pandas, libm and DuckDB round differently.')
+            expressions = {step['name']: (' * '.join([base] * degree), 'int')}
+        else: # scale, float32 columns stay float32
+            expressions = {}
+            for column, (center, scale) in step['statistics'].items():
+                kind = 'float32' if kinds[column] == 'float32' else 'float'
+                sql_type = 'FLOAT' if kind == 'float32' else 'DOUBLE'
+                expressions[column] = (f"(CAST({_quote(column)} AS {sql_type}) - CAST('{center!r}' AS {sql_type})) "
+                                       f"/ CAST('{scale!r}' AS {sql_type})", kind)
+        selected = []
+        for name, (values, kind) in expressions.items():
+            if kind != 'int': # NaN from 0/0 counts as missing for the filters, like in pandas
+                values = f"NULLIF({values}, CAST('NaN' AS {'FLOAT' if kind == 'float32' else 'DOUBLE'}))"
+            selected.append(f'{values} AS {_quote(name)}')
+            kinds.pop(name, None)
+            kinds[name] = kind
+        kept = ', '.join([_ROW] + [_quote(column) for column in kinds if column not in expressions])
+        return f'SELECT {kept}, {", ".join(selected)} FROM ({query})'
+
+
+BACKENDS = {backend.name: backend for backend in [PolarsBackend(), DuckDBBackend()] if backend.available()}
+BACKENDS['pandas'] = PandasBackend()
+DEFAULT_BACKEND = next(iter(BACKENDS))
+
+
+def execute(df, steps, backend=DEFAULT_BACKEND):
+    '''Apply `steps` to `df`, running consecutive steps the backend supports in one native pass.'''
+    engine = BACKENDS.get(backend, BACKENDS['pandas'])
+    segment = []
+    for step in list(steps) + [None]:
+        if step is not None and engine.supports(step):
+            segment.append(step)
+            continue
+        if segment:
+            try:
+                df = engine.run(df, segment)
+            except Exception: # Types or values the engine cannot handle (e.g. mixed-type text), pandas decides
+                df = pipeline.replay(segment, df.copy(deep=False))
+            segment = []
+        if step is not None:
+            df = pipeline.apply_step(df, step)
+    return df
+
+
+def collect(version, steps, columns=None, backend=DEFAULT_BACKEND):
+    '''Run `steps` on a stored version, reading only the columns the optimized plan needs.'''
+    scan, steps, output = optimize(version.schema, steps, columns)
+    df = execute(version.select(scan).copy(deep=False), steps, backend)
+    return df if list(df.columns) == output else df[output]
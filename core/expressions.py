@@ -0,0 +1,116 @@
+'''Formula features such as `volume = x * y * z`, evaluated in one pass per formula.
+
+Formulas are validated on their syntax tree before anything runs, so only arithmetic, numeric
+constants, the math functions of pandas.eval and numerical features can appear. Every formula is
+evaluated with pandas.eval on float64 arrays, through numexpr (fused and multi-threaded) when it is
+installed. Later formulas of a batch can use the features defined before them.
+'''
+import ast
+import re
+
+import numpy as np
+import pandas as pd
+
+from core.optimize import is_boolean, is_number
+
+try:
+    import numexpr # noqa: F401
+    ENGINE = 'numexpr'
+except ImportError:
+    ENGINE = 'python'
+
+FUNCTIONS = ('sin', 'cos', 'tan', 'exp', 'log', 'expm1', 'log1p', 'log10', 'sqrt', 'sinh', 'cosh', 'tanh',
+             'arcsin', 'arccos', 'arctan', 'arccosh', 'arcsinh', 'arctanh', 'abs', 'floor', 'ceil', 'arctan2')
+ZERO_DIVISION = {
+    'Missing value': 'nan',
+    'Zero': 'zero',
+}
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub)
+_QUOTED = re.compile(r'`([^`]+)`')
+
+
+def parse(text):
+    '''Split `name = expression` lines into (name, expression) pairs, skipping blank lines and # comments.'''
+    formulas = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name, equals, expression = line.partition('=')
+        if not equals or not name.strip() or not expression.strip():
+            raise ValueError(f'Line {number}: write the feature as `name = expression`.')
+        formulas.append([name.strip().strip('`'), expression.strip()])
+    return formulas
+
+
+def _compile(expression, known):
+    '''Rewrite `expression` on placeholder names (`__feature0`, ...) and return it with the features they stand for.'''
+    names = {}
+
+    def placeholder(name):
+        if name not in known:
+            raise ValueError(f'Unknown feature \'{name}\' in `{expression}`. Quote names with spaces in backticks.')
+        return names.setdefault(name, f'__feature{len(names)}')
+
+    # Backtick-quoted names first, then plain identifiers that are not functions
+    compiled = _QUOTED.sub(lambda match: placeholder(match.group(1)), expression)
+    try:
+        tree = ast.parse(compiled, mode='eval')
+    except SyntaxError:
+        raise ValueError(f'Invalid formula `{expression}`.')
+    replacements = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise ValueError(f'Only these functions can be used: {", ".join(FUNCTIONS)}.')
+        elif isinstance(node, ast.Name):
+            if node.id not in FUNCTIONS and node.id not in names.values():
+                replacements[node.id] = placeholder(node.id)
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ValueError(f'Only numbers can be used as constants in `{expression}`.')
+        elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load) + _OPERATORS):
+            raise ValueError(f'`{expression}` may only use arithmetic (+ - * / // % **), numbers, features and functions.')
+    if replacements:
+        compiled = re.sub(r'\b[A-Za-z_]\w*\b', lambda match: replacements.get(match.group(0), match.group(0)), compiled)
+    return compiled, {placeholder_name: name for name, placeholder_name in names.items()}
+
+
+def referenced(formulas, columns):
+    '''Columns among `columns` that the formulas read.'''
+    known, names = set(columns) | {name for name, _ in formulas}, set()
+    for _, expression in formulas:
+        names.update(_compile(expression, known)[1].values())
+    return [column for column in columns if column in names]
+
+
+def validate(df, formulas):
+    '''Raise ValueError for formulas that cannot be evaluated on `df`, before any of them runs.'''
+    known = {column for column in df.columns if is_number(df[column]) or is_boolean(df[column])}
+    seen = set()
+    for name, expression in formulas:
+        if name in df.columns or name in seen:
+            raise ValueError(f'Feature \'{name}\' already exists.')
+        _compile(expression, known)
+        known.add(name)
+        seen.add(name)
+
+
+def evaluate(df, formulas, on_zero_division='nan'):
+    '''Evaluate the formulas and return {name: float64 array}. Infinite results become NaN, or 0 with `on_zero_division='zero'`.'''
+    known = {column for column in df.columns if is_number(df[column]) or is_boolean(df[column])}
+    results = {}
+    for name, expression in formulas:
+        compiled, arguments = _compile(expression, known | set(results))
+        arrays = {placeholder: results[column] if column in results else df[column].to_numpy(dtype='float64', na_value=np.nan)
+                  for placeholder, column in arguments.items()}
+        with np.errstate(all='ignore'):
+            values = pd.eval(compiled, engine=ENGINE, local_dict=arrays) if arrays else float(pd.eval(compiled, engine='python'))
+        values = np.broadcast_to(np.asarray(values, dtype='float64'), (len(df),)).copy()
+        invalid = ~np.isfinite(values)
+        if arrays: # Missing inputs stay missing, whatever the option
+            missing = np.logical_or.reduce([np.isnan(array) for array in arrays.values()])
+            invalid &= ~missing
+        values[invalid] = 0.0 if on_zero_division == 'zero' else np.nan
+        results[name] = values
+    return results
@@ -0,0 +1,272 @@
+import time
+import uuid
+
+import streamlit as st
+
+from core import engine, sampling, telemetry
+from core.optimize import optimize_session_dataset
+from core.profile import DataProfile
+from core.store import get_store
+
+HISTORY_MAX_BYTES = 2 * 1024 * 1024 * 1024 # Disk budget for the versions kept per session
+HISTORY_MAX_VERSIONS = 30
+DRY_RUN_ROWS = 100 # Rows a recorded step is tried on, so failures that depend on the values show before it is kept
+
+
+def compute_backend():
+    return st.session_state.get('compute_backend', engine.DEFAULT_BACKEND)
+
+
+class Version:
+    '''Handle of a dataset version in the column store, the frame itself is loaded on access.
+
+    A version recorded from `pending` steps alone is a plan (see core.engine) on its stored parent,
+    `base`, and only runs when its data is first needed.
+    '''
+
+    def __init__(self, df, label, steps=(), session='default', parent=None, pending=()):
+        self.id = uuid.uuid4().hex
+        self.session = session
+        self.label = label
+        self.steps = steps # Pipeline steps that lead from the uploaded dataset to this version
+        self.profile = None
+        self.created = time.time()
+        self.base, self.pending = None, ()
+        if pending:
+            parent.materialize() # Each version is dtype-optimized on its own, as if the steps ran eagerly
+            self.base, self.pending = parent, tuple(pending)
+            self.buffers = self.index = None
+            try: # Fail early on steps that cannot apply
+                self.schema = engine.schemas(self.base.schema, self.pending)[1]
+                engine.execute(self.base.df.head(DRY_RUN_ROWS), self.pending, compute_backend())
+            except ValueError:
+                raise
+            except Exception as e:
+                raise ValueError(f'The step cannot be applied to the dataset: {e}') from e
+        else:
+            engine.check_columns(df.columns)
+            self._store(df, parent)
+
+    def _store(self, df, parent):
+        with telemetry.span('store.write', rows=len(df), columns=len(df.columns)) as attributes:
+            # Content keys of the columns, shared with the parent for the columns a step left untouched
+            self.buffers, self.index = get_store().write(self.session, self.id, df, parent.id if parent is not None else None)
+            if telemetry.active():
+                shared = set(parent.buffers.values()) if parent is not None else set()
+                written = [column for column, key in self.buffers.items() if key not in shared]
+                attributes['written_columns'] = len(written)
+                attributes['written_bytes'] = int(df[written].memory_usage(index=False).sum())
+                telemetry.count('dataframe.written_columns', len(written))
+                telemetry.count('dataframe.written_bytes', attributes['written_bytes'])
+        self.schema = engine.empty_like(df)
+
+    def materialize(self):
+        if self.base is not None:
+            with telemetry.span('materialize', label=self.label, steps=len(self.pending), backend=compute_backend()):
+                df = optimize_session_dataset(engine.collect(self.base, self.pending, backend=compute_backend()))
+                self._store(df, self.base)
+            self.base, self.pending = None, ()
+
+    @property
+    def df(self):
+        self.materialize()
+        with telemetry.span('store.read', version=self.label):
+            return get_store().read(self.session, self.id, self.buffers, self.index)
+
+    def select(self, columns):
+        '''Only `columns` of the version, without reading or computing the others.'''
+        with telemetry.span('select', version=self.label, columns=len(columns)):
+            if self.base is not None:
+                return optimize_session_dataset(engine.collect(self.base, self.pending, columns, compute_backend()))
+            return get_store().read(self.session, self.id, self.buffers, self.index, list(columns))
+
+    def keys(self):
+        if self.base is not None:
+            return self.base.keys()
+        return list(self.buffers.values()) + ([self.index[1]] if self.index[0] == 'column' else [])
+
+
+class DatasetHistory:
+    '''Linear list of dataset versions with undo/redo, bounded by a disk budget.
+
+    Versions live in the column store (see core.store) and only their handles are kept here.
+    A step that only touches a few columns shares every other column file with the previous version.
+    In sampling mode `df` is a sample of `full`, which is kept to replay the steps on it later.
+    '''
+
+    def __init__(self, df, label='Upload dataset', session='default', max_bytes=HISTORY_MAX_BYTES, max_versions=HISTORY_MAX_VERSIONS,
+                 full=None, sampling=None):
+        self.session = session
+        self.max_bytes = max_bytes
+        self.max_versions = max_versions
+        self.full = Version(full, 'Full dataset', session=session) if full is not None else None
+        self.sampling = sampling # Settings of core.sampling.sample that gave `df`
+        self.versions = [Version(df, label, session=session)]
+        self.original = self.versions[0] # Kept even when evicted from the undo list
+        self.position = 0
+        self.dropped = 0 # Versions evicted from the start of the history to respect the budget
+
+    @property
+    def current(self):
+        return self.versions[self.position]
+
+    @property
+    def uploaded(self):
+        '''The uploaded dataset, the full one in sampling mode.'''
+        return self.full if self.full is not None else self.original
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.versions) - 1
+
+    def commit(self, df, label, steps=()):
+        return self._append(Version(df, label, self.current.steps + tuple(steps), self.session, self.current))
+
+    def record(self, label, steps):
+        '''Add a version defined by `steps` on the current one, computed when its data is first needed.'''
+        return self._append(Version(None, label, self.current.steps + tuple(steps), self.session, self.current, steps))
+
+    def _append(self, version):
+        del self.versions[self.position + 1:] # A new step discards the redo branch
+        self.versions.append(version)
+        self.position = len(self.versions) - 1
+        self._enforce_budget()
+        get_store().retain(self.session, self.keys())
+        return self.current
+
+    def profile(self):
+        '''Data-quality profile of the current version, derived incrementally from its parent when possible.'''
+        version = self.current
+        if version.profile is None:
+            parent = self.versions[self.position - 1] if self.position > 0 else None
+            previous = parent.profile if parent is not None and parent.profile is not None and parent.profile.column_hashes else None
+            df = version.df
+            with telemetry.span('profile', version=version.label, incremental=previous is not None):
+                version.profile = DataProfile(df, version.buffers, previous)
+            if previous is not None:
+                previous.release_hashes()
+        return version.profile
+
+    def undo(self):
+        if self.can_undo():
+            self.position -= 1
+        return self.current
+
+    def redo(self):
+        if self.can_redo():
+            self.position += 1
+        return self.current
+
+    def keys(self):
+        '''Column files referenced by the kept versions and the original upload.'''
+        versions = self.versions + [self.original] + ([self.full] if self.full is not None else [])
+        return {key for version in versions for key in version.keys()}
+
+    def disk_usage(self):
+        '''Bytes on disk of all versions, counting shared columns once.'''
+        return get_store().size(self.keys())
+
+    def _enforce_budget(self):
+        while len(self.versions) > 1 and self.position > 0 and (
+            len(self.versions) > self.max_versions or self.disk_usage() > self.max_bytes
+        ):
+            del self.versions[0]
+            self.position -= 1
+            self.dropped += 1
+
+
+def session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else 'default'
+
+
+# Session helpers, `dataset` and `dataset_final` hold the ids of the original and current versions
+def start(df, label='Upload dataset', sampling_settings=None):
+    '''Start a new history from `df`, or from a sample of it given the keyword arguments of core.sampling.sample.'''
+    clear()
+    if sampling_settings:
+        sample = sampling.sample(df, **sampling_settings)
+        dataset_history = DatasetHistory(sample, f'{label} ({sampling.describe(sampling_settings)})', session_id(),
+                                         full=df, sampling=sampling_settings)
+    else:
+        dataset_history = DatasetHistory(df, label, session_id())
+    st.session_state['history'] = dataset_history
+    st.session_state['dataset'] = dataset_history.original.id
+    st.session_state['dataset_final'] = dataset_history.current.id
+
+
+def clear():
+    dataset_history = st.session_state.get('history')
+    if dataset_history is not None:
+        get_store().release(dataset_history.session)
+    for key in ['dataset', 'dataset_final', 'history']:
+        st.session_state.pop(key, None)
+
+
+def get_history():
+    '''History of the session, or None when there is none or the store evicted it after a long idle time.'''
+    dataset_history = st.session_state.get('history')
+    if dataset_history is not None and not get_store().touch(dataset_history.session):
+        for key in ['dataset', 'dataset_final', 'history']:
+            st.session_state.pop(key, None)
+        st.session_state['dataset_expired'] = True
+        return None
+    return dataset_history
+
+
+def checkout():
+    '''Current dataset as a new frame object sharing all data, safe to modify in place.'''
+    telemetry.count('dataframe.shallow_copies')
+    return get_history().current.df.copy(deep=False)
+
+
+def commit(df, label, steps=()):
+    '''Store `df` as a new dtype-optimized version and make it the current dataset.
+
+    `steps` are the pipeline steps (see core.pipeline) that turned the current dataset into `df`.
+    '''
+    with telemetry.span('commit', label=label):
+        version = get_history().commit(optimize_session_dataset(df), label, steps)
+    st.session_state['dataset_final'] = version.id
+    return version
+
+
+def record(label, steps):
+    '''Make `steps` on the current dataset the new current version, run by the compute backend when its data is needed.'''
+    with telemetry.span('record', label=label, steps=len(steps)):
+        version = get_history().record(label, steps)
+    st.session_state['dataset_final'] = version.id
+    return version
+
+
+def apply_to_full(df, steps, label='Upload dataset'):
+    '''Leave sampling mode with `df`, the full dataset after `steps` replayed on it.
+
+    Steps recorded on the sample after `steps` were sent to be replayed are recorded on top. Returns False
+    when the history of the sample no longer starts with `steps`, e.g. after an undo, and nothing changed.
+    '''
+    dataset_history = get_history()
+    current = dataset_history.current.steps
+    if tuple(current[:len(steps)]) != tuple(steps):
+        return False
+    full = dataset_history.full.df
+    start(full, label)
+    commit(df, f'Apply {len(steps)} steps to the full dataset', steps)
+    if len(current) > len(steps):
+        record('Steps recorded while the full dataset was processed', current[len(steps):])
+    return True
+
+
+def profile():
+    return get_history().profile()
+
+
+def undo():
+    st.session_state['dataset_final'] = get_history().undo().id
+
+
+def redo():
+    st.session_state['dataset_final'] = get_history().redo().id
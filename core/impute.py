@@ -0,0 +1,153 @@
+'''Missing value imputation used by the fill steps of the pipeline.
+
+Statistics are computed in one vectorized pass over the columns that contain nulls, and only
+those columns are written back, so the rest of the frame is shared with the previous version.
+KNN and iterative imputers are fitted on a sample and only transform the rows with nulls, in
+chunks spread over a thread pool. The threads share WORKING_MEMORY, the scratch space scikit-learn
+may use for the distance matrices of the KNN imputer, instead of each taking its default.
+'''
+import base64
+import io
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.optimize import is_boolean, is_number
+
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+FIT_ROWS = 50000 # Rows sampled to fit the iterative imputer
+KNN_FIT_ROWS = 10000 # Reference rows of the KNN imputer, every imputed row is compared with all of them
+CHUNK_ROWS = 10000
+WORKING_MEMORY = 1024 # MiB of distance matrices held at once by all the transform threads together
+
+COLUMN_KINDS = {
+    'Integer & Float': is_number,
+    'Boolean': is_boolean,
+    'Categorical & Text': lambda x: not is_number(x) and not is_boolean(x),
+    'All of above': lambda x: True,
+}
+MODEL_METHODS = ['knn', 'iterative']
+
+
+def columns_with_nulls(df, kind='All of above'):
+    '''Columns of `df` holding at least one null (and one value) that match a COLUMN_KINDS entry.'''
+    counts = df.isna().sum()
+    selected = COLUMN_KINDS[kind]
+    return [column for column in df.columns[(counts > 0) & (counts < len(df))] if selected(df[column])]
+
+
+def fill_values(df, strategy, columns):
+    '''Mean, median or mode of every column in `columns`, computed in one pass.'''
+    if not columns:
+        return {}
+    if strategy == 'mode':
+        values = df[columns].mode().iloc[0]
+    else:
+        values = getattr(df[columns], strategy)()
+    return {column: value for column, value in values.items() if not pd.isna(value)}
+
+
+def group_fill_values(df, by, strategy, columns):
+    '''Statistic of each column per group of `by`, with the overall statistic as default for unseen groups.'''
+    defaults = fill_values(df, strategy, columns)
+    values = {}
+    for column in defaults:
+        if strategy == 'mode':
+            counts = df[[by, column]].value_counts(sort=True) # Most frequent pair first
+            groups = counts.reset_index().drop_duplicates(by).set_index(by)[column]
+        else:
+            groups = df.groupby(by, observed=True)[column].agg(strategy).dropna()
+        values[column] = {'groups': list(groups.items()), 'default': defaults[column]}
+    return values
+
+
+def _is_integral(value):
+    values = value.dropna().to_numpy() if isinstance(value, pd.Series) else np.array([value])
+    try:
+        return bool(np.all(np.mod(values.astype('float64'), 1) == 0))
+    except (TypeError, ValueError):
+        return False
+
+
+def fill_series(series, value):
+    '''`series.fillna(value)` that widens the dtype when the value does not fit it, `value` may be a Series.'''
+    if pd.api.types.is_integer_dtype(series) and not _is_integral(value): # e.g. the mean of a nullable Int64 column
+        series = series.astype('float64')
+    elif isinstance(series.dtype, pd.CategoricalDtype):
+        missing = pd.unique(value.dropna()) if isinstance(value, pd.Series) else [value]
+        new_categories = [category for category in missing if category not in series.cat.categories]
+        if new_categories:
+            series = series.cat.add_categories(new_categories)
+    return series.fillna(value)
+
+
+def fill(df, values):
+    for column, value in values.items():
+        df[column] = fill_series(df[column], value)
+    return df
+
+
+def fill_groups(df, by, values):
+    keys = pd.Series(df[by].to_numpy(dtype=object), index=df.index)
+    for column, fill_value in values.items():
+        series = df[column]
+        if series.isna().any():
+            series = fill_series(series, keys.map(dict((group, value) for group, value in fill_value['groups'])))
+            df[column] = fill_series(series, fill_value['default'])
+    return df
+
+
+def fit_model(df, method, columns, random_state=42):
+    '''Fit a KNN or iterative imputer on a sample of the numeric `columns`.'''
+    if method == 'knn':
+        from sklearn.impute import KNNImputer
+        imputer, max_rows = KNNImputer(n_neighbors=5), KNN_FIT_ROWS
+    elif method == 'iterative':
+        from sklearn.experimental import enable_iterative_imputer # noqa: F401
+        from sklearn.impute import IterativeImputer
+        imputer, max_rows = IterativeImputer(max_iter=10, random_state=random_state), FIT_ROWS
+    else:
+        raise ValueError(f'Unknown imputation method \'{method}\'.')
+    sample = df[columns].sample(n=max_rows, random_state=random_state) if len(df) > max_rows else df[columns]
+    return imputer.fit(sample.to_numpy(dtype='float64', na_value=np.nan))
+
+
+def encode_model(model):
+    '''Serialize a fitted imputer to text so it can be stored in a JSON pipeline step.'''
+    import joblib
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer, compress=3)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def decode_model(text):
+    import joblib
+    return joblib.load(io.BytesIO(base64.b64decode(text)))
+
+
+def _transform_chunk(model, working_memory, chunk):
+    from sklearn import config_context
+    with config_context(working_memory=working_memory): # Thread-local, so set in the thread that transforms
+        return model.transform(chunk)
+
+
+def transform_model(df, columns, model, chunk_rows=CHUNK_ROWS, max_workers=MAX_WORKERS):
+    '''Impute the rows of `df` with nulls in `columns`, in parallel chunks, writing back only the columns with nulls.'''
+    nulls = df[columns].isna()
+    rows = np.flatnonzero(nulls.any(axis=1).to_numpy())
+    if len(rows) == 0:
+        return df
+    X = df[columns].iloc[rows].to_numpy(dtype='float64', na_value=np.nan)
+    chunks = [X[start:start + chunk_rows] for start in range(0, len(X), chunk_rows)]
+    transform = functools.partial(_transform_chunk, model, max(1, WORKING_MEMORY // max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        imputed = np.concatenate(list(executor.map(transform, chunks)))
+    for position, column in enumerate(columns):
+        if nulls[column].any():
+            values = df[column].to_numpy(dtype='float64', na_value=np.nan, copy=True)
+            values[rows] = imputed[:, position]
+            df[column] = values
+    return df
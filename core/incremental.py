@@ -0,0 +1,231 @@
+'''Out-of-core regression: estimators trained with `partial_fit` on batches streamed from disk.
+
+The data is never held in memory as a whole. A first pass over the file fits the feature and target
+scalers incrementally, then every epoch streams the batches again, replaying the dataset pipeline on
+each one. Rows are assigned to the holdout set by a seeded random draw per batch, so every pass (and
+the in-memory baseline) sees the same split without storing it.
+
+Besides the selected dataset, the page can train on a file placed in DATA_DIR on the server. Only
+files inside that directory are ever read, and the steps are checked on the first rows of the file
+before any job is queued.
+'''
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from core import encode, pipeline
+from core.optimize import is_number
+
+SPILL_DIR = os.path.join('.datalyze', 'spill')
+DATA_DIR = os.path.join('.datalyze', 'data') # Server files the page may train on, nothing outside it is read
+DATA_EXTENSIONS = ('.csv', '.parquet')
+CHECK_ROWS = 100
+BATCH_ROWS = 10000
+
+REGRESSORS = {
+    'SGD Regressor': {'loss': ['squared_error', 'huber', 'epsilon_insensitive'], 'penalty': ['l2', 'l1', 'elasticnet'],
+                      'alpha': [0.00001, 0.0001, 0.001, 0.01], 'learning_rate': ['constant', 'invscaling'], 'average': [False, True]},
+    'MLP Regressor': {'hidden_layer_sizes': [(32,), (64,), (64, 32), (128, 64)], 'alpha': [0.00001, 0.0001, 0.001],
+                      'learning_rate_init': [0.0003, 0.001, 0.003]},
+}
+
+
+def make_regressor(name, params, random_state=42, epochs=None):
+    '''Build a regressor supporting `partial_fit`. `epochs` sets the passes of a full `fit` for the in-memory baseline.'''
+    if name == 'SGD Regressor':
+        from sklearn.linear_model import SGDRegressor
+        return SGDRegressor(random_state=random_state, max_iter=epochs or 1000, tol=None if epochs else 0.001, **params)
+    if name == 'MLP Regressor':
+        from sklearn.neural_network import MLPRegressor
+        return MLPRegressor(random_state=random_state, max_iter=epochs or 200, **params)
+    raise ValueError(f'Unknown regressor \'{name}\'.')
+
+
+def spill(version, copies=1):
+    '''Write a dataset version to a temporary Parquet file per job, so jobs stream it instead of receiving it pickled.
+
+    The copies are hard links to one file. Pass each to the job reading it as `cleanup` (see
+    core.jobs), so the data leaves the disk with the last of these jobs, however it ends.
+    '''
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f'{version.id}-', suffix='.parquet', dir=SPILL_DIR)
+    os.close(fd)
+    stem = path[:-len('.parquet')]
+    paths = [path] + [f'{stem}-{index}.parquet' for index in range(1, copies)]
+    try:
+        encode.densify(version.df).to_parquet(path, index=False)
+        for link in paths[1:]:
+            try:
+                os.link(path, link)
+            except OSError: # No hard links on this file system
+                shutil.copyfile(path, link)
+    except BaseException:
+        for spilled in paths:
+            if os.path.exists(spilled):
+                os.remove(spilled)
+        raise
+    return paths
+
+
+def data_files(root=DATA_DIR):
+    '''CSV and Parquet files under `root`, as sorted paths relative to it.'''
+    files = []
+    for directory, _, names in os.walk(root):
+        files += [os.path.relpath(os.path.join(directory, name), root) for name in names if name.endswith(DATA_EXTENSIONS)]
+    return sorted(files)
+
+
+def data_path(name, root=DATA_DIR):
+    '''Real path of the data file `name`, refusing anything that resolves outside `root` (e.g. through .. or a link).'''
+    base = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(base, name))
+    if os.path.commonpath([base, path]) != base or not path.endswith(DATA_EXTENSIONS) or not os.path.isfile(path):
+        raise ValueError(f"'{name}' is not a CSV or Parquet file in {root}.")
+    return path
+
+
+def check_source(path, steps, features, target):
+    '''Replay `steps` on the first rows of `path`, raise ValueError unless they yield numerical `features` and `target`.'''
+    sample = next(pipeline.read_batches(path, CHECK_ROWS), None)
+    if sample is None or sample.empty:
+        raise ValueError(f'{os.path.basename(path)} has no rows.')
+    try:
+        sample = pipeline.replay(steps, sample, {})
+    except Exception as e:
+        raise ValueError(f'The steps of the selected dataset cannot be replayed on {os.path.basename(path)}: {e}') from e
+    missing = [column for column in features + [target] if column not in sample.columns]
+    if missing:
+        raise ValueError(f"{os.path.basename(path)} does not provide the features {', '.join(map(str, missing))} of the selected dataset.")
+    text = [column for column in features + [target] if not is_number(sample[column])]
+    if text:
+        raise ValueError(f"The features {', '.join(map(str, text))} of {os.path.basename(path)} are not numerical.")
+
+
+def split_batches(source, steps, features, target, train_size, random_state, chunksize=BATCH_ROWS):
+    '''Yield (X_train, y_train, X_test, y_test) per batch of `source` after replaying `steps`.'''
+    rng = np.random.default_rng(random_state)
+    state = {}
+    for batch in pipeline.read_batches(source, chunksize):
+        batch = pipeline.replay(steps, batch, state)
+        X = batch[features].to_numpy(dtype='float64', na_value=np.nan)
+        y = batch[target].to_numpy(dtype='float64', na_value=np.nan)
+        draw = rng.random(len(y))
+        train = np.flatnonzero(draw < train_size)
+        train = train[np.argsort(draw[train])] # Shuffled within the batch, files are often sorted
+        test = draw >= train_size
+        yield X[train], y[train], X[test], y[test]
+
+
+class RegressionMetrics:
+    '''RMSE, MAE and R² accumulated batch by batch.'''
+
+    def __init__(self):
+        self.n = 0
+        self.squared_error = self.absolute_error = self.y_sum = self.y_squared_sum = 0.0
+
+    def update(self, y, prediction):
+        error = y - prediction
+        self.n += len(y)
+        self.squared_error += float(error @ error)
+        self.absolute_error += float(np.abs(error).sum())
+        self.y_sum += float(y.sum())
+        self.y_squared_sum += float(y @ y)
+
+    def result(self):
+        if self.n == 0:
+            return {'RMSE': np.nan, 'MAE': np.nan, 'R2': np.nan}
+        total = self.y_squared_sum - self.y_sum ** 2 / self.n
+        return {
+            'RMSE': (self.squared_error / self.n) ** 0.5,
+            'MAE': self.absolute_error / self.n,
+            'R2': 1 - self.squared_error / total if total > 0 else np.nan,
+        }
+
+
+def predict(model, X):
+    '''Predictions of a trained (x_scaler, y_scaler, estimator) model in the units of the target.'''
+    x_scaler, y_scaler, estimator = model
+    return y_scaler.inverse_transform(estimator.predict(x_scaler.transform(X)).reshape(-1, 1)).ravel()
+
+
+def train_streaming(job, source, steps, features, target, model, params, train_size, random_state=42, epochs=5, chunksize=BATCH_ROWS):
+    '''Background job: fit scalers in one pass, then `partial_fit` the estimator for `epochs` passes.
+
+    Per epoch it reports the progressive training and holdout errors, each batch being scored before
+    the model learns from it. The final metrics come from one more pass over the holdout rows with
+    the finished model.
+    '''
+    from sklearn.preprocessing import StandardScaler
+    tracemalloc.start()
+    start = time.perf_counter()
+    batches = lambda: split_batches(source, steps, features, target, train_size, random_state, chunksize)
+
+    job.progress(0.0, 'Scanning the data for scaling statistics')
+    x_scaler, y_scaler, rows = StandardScaler(), StandardScaler(), 0
+    for X_train, y_train, X_test, _ in batches():
+        if len(y_train):
+            x_scaler.partial_fit(X_train)
+            y_scaler.partial_fit(y_train.reshape(-1, 1))
+        rows += len(y_train) + len(X_test)
+    estimator = make_regressor(model, params, random_state)
+    trained = (x_scaler, y_scaler, estimator)
+
+    history, fitted = [], False
+    for epoch in range(epochs):
+        train_metrics, test_metrics, done = RegressionMetrics(), RegressionMetrics(), 0
+        for X_train, y_train, X_test, y_test in batches():
+            if fitted: # Score the batch before learning from it
+                if len(y_train):
+                    train_metrics.update(y_train, predict(trained, X_train))
+                if len(y_test):
+                    test_metrics.update(y_test, predict(trained, X_test))
+            if len(y_train):
+                estimator.partial_fit(x_scaler.transform(X_train), y_scaler.transform(y_train.reshape(-1, 1)).ravel())
+                fitted = True
+            done += len(y_train) + len(y_test)
+            job.progress((epoch + done / max(rows, 1)) / (epochs + 1), f'Epoch {epoch + 1}/{epochs}', epochs=history)
+        train, test = train_metrics.result(), test_metrics.result()
+        history.append({'Epoch': epoch + 1, 'Train RMSE': train['RMSE'], 'Holdout RMSE': test['RMSE'], 'Holdout R2': test['R2']})
+        job.progress((epoch + 1) / (epochs + 1), f'Epoch {epoch + 1}/{epochs}', epochs=history)
+
+    job.progress(epochs / (epochs + 1), 'Evaluating on the holdout set', epochs=history)
+    metrics = RegressionMetrics()
+    for _, _, X_test, y_test in batches():
+        if len(y_test):
+            metrics.update(y_test, predict(trained, X_test))
+    fit_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    job.save_artifact('model', trained)
+    return {'mode': 'Streaming', 'model': model, 'params': params, 'rows': rows, 'epochs': history,
+            'metrics': metrics.result(), 'fit_time': fit_time, 'peak_memory': peak_memory}
+
+
+def train_in_memory(job, source, steps, features, target, model, params, train_size, random_state=42, epochs=5, chunksize=BATCH_ROWS):
+    '''Background job: the baseline for `train_streaming`, loading the same split fully into memory and calling `fit`.'''
+    from sklearn.preprocessing import StandardScaler
+    tracemalloc.start()
+    start = time.perf_counter()
+    job.progress(0.0, 'Loading the data into memory')
+    parts = ([], [], [], [])
+    for batch in split_batches(source, steps, features, target, train_size, random_state, chunksize):
+        for part, array in zip(parts, batch):
+            part.append(array)
+    X_train, y_train, X_test, y_test = [np.concatenate(part) for part in parts]
+    del parts
+    job.progress(0.3, f'Fitting on {len(y_train)} rows')
+    x_scaler, y_scaler = StandardScaler().fit(X_train), StandardScaler().fit(y_train.reshape(-1, 1))
+    estimator = make_regressor(model, params, random_state, epochs)
+    estimator.fit(x_scaler.transform(X_train), y_scaler.transform(y_train.reshape(-1, 1)).ravel())
+    trained = (x_scaler, y_scaler, estimator)
+    metrics = RegressionMetrics()
+    metrics.update(y_test, predict(trained, X_test))
+    fit_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'mode': 'In-memory', 'model': model, 'params': params, 'rows': len(y_train) + len(y_test), 'epochs': [],
+            'metrics': metrics.result(), 'fit_time': fit_time, 'peak_memory': peak_memory}
@@ -0,0 +1,237 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+from core.optimize import memory_report, optimize_dtypes
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError: # Fall back to the chunked pandas C parser
+    pa = None
+
+# Upper bound for all parsed datasets kept in memory, shared by every session
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Streaming CSV ingestion settings
+SAMPLE_ROWS = 10000
+BLOCK_BYTES = 16 * 1024 * 1024
+CHUNK_ROWS = 200000
+CATEGORY_MAX_RATIO = 0.5 # Max unique/non-null ratio in the sample for a text column to become a category
+IN_MEMORY_RATIO = 0.1 # Files up to this fraction of the available memory are parsed at once by all cores
+
+
+class DatasetCache:
+    '''LRU cache of parsed datasets keyed by the hash of the uploaded bytes and bounded by memory size.'''
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes: # Too big to cache, the caller still gets the value
+                return
+            while self._entries and self.total_bytes + nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+            self._entries[key] = (value, nbytes)
+            self.total_bytes += nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@st.cache_resource
+def get_dataset_cache():
+    return DatasetCache()
+
+
+def upload_digest(file):
+    '''Content hash of an uploaded file, memoized per upload so the bytes are hashed only once.'''
+    digests = st.session_state.setdefault('upload_digests', {})
+    if file.file_id not in digests:
+        hasher = hashlib.blake2b(digest_size=16)
+        file.seek(0)
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            hasher.update(block)
+        file.seek(0)
+        digests.clear() # Only the upload currently in the widget matters
+        digests[file.file_id] = f'{file.name.rsplit(".", 1)[-1]}-{hasher.hexdigest()}'
+    return digests[file.file_id]
+
+
+def available_memory():
+    '''Memory available to new allocations in bytes, or None where it cannot be read.'''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, AttributeError, OSError):
+        return None
+
+
+def infer_schema(sample):
+    '''Column dtypes for the full read, inferred from a sample parsed with the default pandas rules.'''
+    schema = {}
+    for column in sample.columns:
+        values = sample[column]
+        if pd.api.types.is_bool_dtype(values):
+            schema[column] = 'bool'
+        elif pd.api.types.is_integer_dtype(values):
+            schema[column] = 'int64'
+        elif pd.api.types.is_float_dtype(values):
+            schema[column] = 'float64'
+        else:
+            non_null = values.dropna()
+            low_cardinality = len(non_null) > 0 and non_null.nunique() <= CATEGORY_MAX_RATIO * len(non_null)
+            schema[column] = 'category' if low_cardinality else 'object'
+    return schema
+
+
+def _arrow_types(schema):
+    types = {'bool': pa.bool_(), 'int64': pa.int64(), 'float64': pa.float64(),
+             'category': pa.dictionary(pa.int32(), pa.string()), 'object': pa.string()}
+    return {column: types[dtype] for column, dtype in schema.items()}
+
+
+def _read_csv_arrow_at_once(file, on_preview, on_progress):
+    '''Parse the whole file with the multi-threaded Arrow reader, the schema is inferred from all the rows.'''
+    options = pa_csv.ConvertOptions(strings_can_be_null=True)
+    table = pa_csv.read_csv(file, convert_options=options)
+    text = [field.name for field in table.schema if pa.types.is_temporal(field.type)]
+    if text: # Arrow parses dates and times, pandas keeps them as text and so does the rest of the app
+        file.seek(0)
+        options = pa_csv.ConvertOptions(strings_can_be_null=True, include_columns=text, column_types=dict.fromkeys(text, pa.string()))
+        strings = pa_csv.read_csv(file, convert_options=options)
+        for column in text:
+            table = table.set_column(table.schema.get_field_index(column), column, strings[column])
+    for index, field in enumerate(table.schema):
+        column = table.column(index)
+        if pa.types.is_null(field.type): # Only empty values, float NaN like pandas
+            table = table.set_column(index, field.name, column.cast(pa.float64()))
+        elif pa.types.is_string(field.type):
+            non_null = len(column) - column.null_count
+            if non_null and pc.count_distinct(column).as_py() <= CATEGORY_MAX_RATIO * non_null:
+                table = table.set_column(index, field.name, column.dictionary_encode())
+    if on_preview:
+        on_preview(table.slice(0, 100).to_pandas())
+    if on_progress:
+        on_progress(1.0)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _read_csv_arrow(file, schema, size, on_preview, on_progress):
+    reader = pa_csv.open_csv(
+        file,
+        read_options=pa_csv.ReadOptions(block_size=BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(column_types=_arrow_types(schema), strings_can_be_null=True),
+    )
+    batches = []
+    for batch in reader:
+        if not batches and on_preview:
+            on_preview(batch.slice(0, 100).to_pandas())
+        batches.append(batch)
+        if on_progress:
+            on_progress(min(file.tell() / size, 1.0))
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    del batches
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _read_csv_chunked(file, schema, size, on_preview, on_progress):
+    dtypes = {column: ('object' if dtype == 'category' else dtype) for column, dtype in schema.items()}
+    chunks = []
+    for chunk in pd.read_csv(file, dtype=dtypes, chunksize=CHUNK_ROWS):
+        if not chunks and on_preview:
+            on_preview(chunk.head(100))
+        chunks.append(chunk)
+        if on_progress:
+            on_progress(min(file.tell() / size, 1.0))
+    df = pd.concat(chunks, ignore_index=True)
+    del chunks
+    for column, dtype in schema.items():
+        if dtype == 'category':
+            df[column] = df[column].astype('category')
+    return df
+
+
+def read_csv(file, on_preview=None, on_progress=None):
+    '''Parse a CSV, at once when it is small next to the available memory, otherwise streamed in blocks.
+
+    A streamed CSV uses a schema inferred from the first rows. `on_preview` receives the first rows
+    as soon as the first block is parsed and `on_progress` the fraction of the file read so far.
+    '''
+    file.seek(0, io.SEEK_END)
+    size = max(file.tell(), 1)
+    file.seek(0)
+    available = available_memory()
+    if pa is not None and available is not None and size <= IN_MEMORY_RATIO * available:
+        try:
+            return _read_csv_arrow_at_once(file, on_preview, on_progress)
+        except ValueError: # ArrowInvalid, e.g. rows with a different number of fields
+            file.seek(0)
+            return pd.read_csv(file)
+    schema = infer_schema(pd.read_csv(file, nrows=SAMPLE_ROWS))
+    file.seek(0)
+    try:
+        if pa is not None:
+            return _read_csv_arrow(file, schema, size, on_preview, on_progress)
+        return _read_csv_chunked(file, schema, size, on_preview, on_progress)
+    except ValueError: # The sample schema does not hold for the whole file (ArrowInvalid is a ValueError too)
+        file.seek(0)
+        return pd.read_csv(file)
+
+
+def parse_file(file, on_preview=None, on_progress=None):
+    file.seek(0)
+    if file.name.endswith('csv'):
+        return read_csv(file, on_preview, on_progress)
+    return pd.read_excel(file)
+
+
+def ingest_file(file, on_preview=None, on_progress=None):
+    '''Parse and dtype-optimize a file, returns the frame and the memory report of the optimization.'''
+    raw = parse_file(file, on_preview, on_progress)
+    df = optimize_dtypes(raw)
+    report = memory_report(raw, df)
+    del raw
+    return df, report
+
+
+def load_dataset(file, on_preview=None, on_progress=None):
+    '''Parse and dtype-optimize an uploaded file, reusing the cached result for bytes ingested before.
+
+    Returns the frame, its content digest and the before/after memory report of the optimization.
+    The returned frame may be shared with other sessions and must not be modified in place.
+    '''
+    digest = upload_digest(file)
+    cache = get_dataset_cache()
+    entry = cache.get(digest)
+    if entry is None:
+        entry = ingest_file(file, on_preview, on_progress)
+        cache.put(digest, entry, int(entry[0].memory_usage(deep=True).sum()))
+    df, report = entry
+    return df, digest, report
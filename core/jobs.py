@@ -0,0 +1,225 @@
+'''Background jobs for model training, shared by every session of the app.
+
+Each job runs in its own spawned process so a long fit never blocks the page script and can be
+cancelled by terminating that process, which first terminates the processes it started itself (e.g.
+a search pool). At most MAX_CONCURRENT_JOBS run at once, the others wait in a queue, and a job that
+spreads its work over processes uses at most WORKERS_PER_JOB of them. Temporary files a job reads (`cleanup`) are deleted by the scheduler once the job ends,
+however it ends. Job state (status, progress, message) and artifacts live on disk under JOBS_DIR, so a
+page can poll a job, and attach to its result again after a rerun or a browser reload. The state is
+updated under a file lock by the server and the job process alike, and once a job is finished,
+failed, cancelled or interrupted its state no longer changes.
+'''
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import streamlit as st
+
+try:
+    import fcntl
+except ImportError: # No file locks (Windows), only the threads of the server process are serialized
+    fcntl = None
+
+JOBS_DIR = os.path.join('.datalyze', 'jobs')
+MAX_CONCURRENT_JOBS = max(1, (os.cpu_count() or 1) // 2)
+WORKERS_PER_JOB = max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_JOBS) # So concurrent jobs do not oversubscribe the CPUs
+MAX_STORED_JOBS = 50
+ACTIVE = ('queued', 'running')
+FINAL = ('done', 'failed', 'cancelled', 'interrupted')
+_state_lock = threading.Lock()
+
+
+def _state_path(directory):
+    return os.path.join(directory, 'state.json')
+
+
+def read_state(directory):
+    with open(_state_path(directory)) as f:
+        return json.load(f)
+
+
+@contextmanager
+def _locked(directory):
+    '''Exclusive access to the state of a job, across the server and the job processes.'''
+    if fcntl is None:
+        with _state_lock:
+            yield
+        return
+    with open(os.path.join(directory, 'state.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _update_state(directory, **changes):
+    '''Merge `changes` into the job state, replacing the file atomically so readers never see a partial write.
+
+    A state in FINAL is left as it is, so e.g. a late progress report cannot undo a cancellation.
+    '''
+    path = _state_path(directory)
+    with _locked(directory):
+        state = read_state(directory) if os.path.exists(path) else {}
+        if state.get('status') in FINAL:
+            return state
+        state.update(changes, updated=time.time())
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(temp, path)
+    return state
+
+
+class Job:
+    '''Handle passed to the job function in the worker process.'''
+
+    def __init__(self, id, directory):
+        self.id = id
+        self.directory = directory
+
+    def progress(self, fraction, message='', **details):
+        '''Report progress, `details` are stored in the job state for the page to show while the job runs.'''
+        _update_state(self.directory, progress=float(fraction), message=message, **details)
+
+    def save_artifact(self, name, obj):
+        import joblib
+        joblib.dump(obj, os.path.join(self.directory, f'{name}.joblib'), compress=3)
+
+
+def _terminate(signum, frame):
+    '''SIGTERM handler of a job process: stop its own child processes, then unwind so `finally` blocks run.'''
+    for child in multiprocessing.active_children():
+        child.terminate()
+    raise SystemExit(128 + signum)
+
+
+def _run(fn, job, args, kwargs):
+    '''Worker process entry point: run the job function and store its return value as the `result` artifact.'''
+    signal.signal(signal.SIGTERM, _terminate)
+    _update_state(job.directory, status='running', started=time.time(), pid=os.getpid())
+    try:
+        result = fn(job, *args, **kwargs)
+        job.save_artifact('result', result)
+    except Exception as e:
+        _update_state(job.directory, status='failed', error=str(e), traceback=traceback.format_exc(), finished=time.time())
+    else:
+        _update_state(job.directory, status='done', progress=1.0, message='Finished', finished=time.time())
+
+
+class JobScheduler:
+    '''Queue of jobs run in separate processes, with at most `max_workers` at a time.'''
+
+    def __init__(self, root=JOBS_DIR, max_workers=MAX_CONCURRENT_JOBS):
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='datalyze-job')
+        self._context = multiprocessing.get_context('spawn')
+        self._futures = {}
+        self._processes = {}
+        self._cleanup = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def submit(self, fn, *args, kind, label, cleanup=(), **kwargs):
+        '''Queue `fn(job, *args, **kwargs)`, which must be importable from a module, and return the job id.
+
+        The files in `cleanup` are deleted when the job ends: finished, failed, cancelled or never started.
+        '''
+        self._prune()
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, self._directory(job_id))
+        os.makedirs(job.directory)
+        _update_state(job.directory, id=job.id, kind=kind, label=label, status='queued', progress=0.0, message='Waiting for a free worker',
+                      created=time.time())
+        with self._lock:
+            self._cleanup[job.id] = list(cleanup)
+            self._futures[job.id] = self._executor.submit(self._launch, fn, job, args, kwargs)
+        return job.id
+
+    def _remove_files(self, job_id):
+        with self._lock:
+            paths = self._cleanup.pop(job_id, ())
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _launch(self, fn, job, args, kwargs):
+        try:
+            self._run_process(fn, job, args, kwargs)
+        finally:
+            self._remove_files(job.id)
+
+    def _run_process(self, fn, job, args, kwargs):
+        process = self._context.Process(target=_run, args=(fn, job, args, kwargs), name=f'datalyze-job-{job.id}')
+        with self._lock:
+            if read_state(job.directory)['status'] == 'cancelled':
+                return
+            self._processes[job.id] = process
+            process.start()
+        process.join()
+        with self._lock:
+            self._processes.pop(job.id, None)
+        if read_state(job.directory)['status'] in ACTIVE: # Terminated or crashed before it could report
+            if os.path.exists(os.path.join(job.directory, 'cancel')):
+                _update_state(job.directory, status='cancelled', message='Cancelled', finished=time.time())
+            else:
+                _update_state(job.directory, status='failed', error=f'Worker exited with code {process.exitcode}', finished=time.time())
+
+    def status(self, job_id):
+        '''Current job state, or None if the job is unknown. Active jobs left over from a previous server run are reported as interrupted.'''
+        directory = self._directory(job_id)
+        if not os.path.exists(_state_path(directory)):
+            return None
+        state = read_state(directory)
+        if state['status'] in ACTIVE and job_id not in self._futures:
+            state = _update_state(directory, status='interrupted', message='The server restarted before the job finished')
+        return state
+
+    def cancel(self, job_id):
+        directory = self._directory(job_id)
+        open(os.path.join(directory, 'cancel'), 'w').close()
+        with self._lock:
+            future = self._futures.get(job_id)
+            never_started = future is not None and future.cancel()
+            if never_started or read_state(directory)['status'] == 'queued':
+                _update_state(directory, status='cancelled', message='Cancelled', finished=time.time())
+            process = self._processes.get(job_id)
+            if process is not None:
+                process.terminate()
+        if never_started: # _launch will not run to delete them
+            self._remove_files(job_id)
+
+    def load_artifact(self, job_id, name='result'):
+        import joblib
+        return joblib.load(os.path.join(self._directory(job_id), f'{name}.joblib'))
+
+    def jobs(self, kind=None):
+        '''States of the stored jobs, newest first.'''
+        states = [self.status(job_id) for job_id in os.listdir(self.root)]
+        states = [state for state in states if state is not None and (kind is None or state.get('kind') == kind)]
+        return sorted(states, key=lambda state: state['created'], reverse=True)
+
+    def _prune(self):
+        '''Delete the oldest finished jobs beyond MAX_STORED_JOBS.'''
+        finished = [state for state in self.jobs() if state['status'] not in ACTIVE]
+        for state in finished[MAX_STORED_JOBS:]:
+            shutil.rmtree(self._directory(state['id']), ignore_errors=True)
+            self._futures.pop(state['id'], None)
+
+
+@st.cache_resource
+def get_scheduler():
+    return JobScheduler()
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+
+def split_positions(n_rows, train_size, random_state):
+    '''Sorted row positions of the training and test sets.'''
+    from sklearn.model_selection import train_test_split
+    train_index, test_index = train_test_split(np.arange(n_rows), train_size=train_size, random_state=random_state)
+    return np.sort(train_index), np.sort(test_index)
+
+
+def make_split(version, features, target, train_size, random_state):
+    '''Train/test split of a dataset version kept as row positions, so it survives reruns cheaply.'''
+    train_index, test_index = split_positions(len(version.select([target])), train_size, random_state)
+    return {
+        'version': version,
+        'features': list(features),
+        'target': target,
+        'train_size': train_size,
+        'random_state': random_state,
+        'train_index': train_index,
+        'test_index': test_index,
+    }
+
+
+def split_context(split):
+    '''Identifies the data behind a split, used as cache key for trials and models.'''
+    return [split['version'].id, split['features'], split['target'], split['train_size'], split['random_state']]
+
+
+def to_model_input(df):
+    '''Feature matrix for scikit-learn, a CSR matrix when the features include sparse columns (dense ones first).'''
+    sparse = [column for column in df.columns if isinstance(df[column].dtype, pd.SparseDtype)]
+    if not sparse:
+        return df.to_numpy(dtype='float64', na_value=np.nan)
+    from scipy import sparse as sp
+    dense = [column for column in df.columns if column not in sparse]
+    blocks = [sp.csr_matrix(df[dense].to_numpy(dtype='float64', na_value=np.nan))] if dense else []
+    blocks.append(df[sparse].sparse.to_coo().astype('float64'))
+    return sp.hstack(blocks, format='csr')
+
+
+def split_arrays(split):
+    df = split['version'].select(list(dict.fromkeys(split['features'] + [split['target']])))
+    X = to_model_input(df[split['features']])
+    y = df[split['target']].to_numpy()
+    return X[split['train_index']], X[split['test_index']], y[split['train_index']], y[split['test_index']]
+
+
+CLASSIFICATION_METRICS = ['accuracy', 'balanced_accuracy', 'f1_macro']
+
+
+def fit_classifier(job, X_train, y_train, X_test, y_test, model, params, random_state=42):
+    '''Background job: fit one classifier on the training split and score it on both splits.'''
+    import time
+    from sklearn.metrics import get_scorer
+    from core.tuning import make_classifier
+    job.progress(0.05, f'Fitting {model} on {len(y_train)} rows')
+    start = time.perf_counter()
+    estimator = make_classifier(model, params, random_state).fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+    job.progress(0.9, 'Scoring')
+    job.save_artifact('model', estimator)
+    return {
+        'model': model,
+        'params': params,
+        'fit_time': fit_time,
+        'scores': {metric: {'Train': float(get_scorer(metric)(estimator, X_train, y_train)), 'Test': float(get_scorer(metric)(estimator, X_test, y_test))}
+                   for metric in CLASSIFICATION_METRICS},
+    }
@@ -0,0 +1,105 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+CATEGORY_MAX_RATIO = 0.5 # Max unique/non-null ratio for a text column to become a category
+CATEGORY_MIN_ROWS = 50 # Below this size categoricals cost more than they save
+
+
+def is_number(series):
+    '''Numeric feature of any width (int8..int64, float32/64, nullable), excluding booleans.'''
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def is_boolean(series):
+    return pd.api.types.is_bool_dtype(series)
+
+
+def upcast(series):
+    '''Widen a downcast numeric column back to 64 bits so arithmetic on it cannot overflow.'''
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype('Int64' if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) else 'int64')
+    if pd.api.types.is_float_dtype(series):
+        return series.astype('float64')
+    return series
+
+
+def optimize_series(series):
+    '''Return the most compact lossless representation of a column, or the column itself.'''
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return series
+    if pd.api.types.is_integer_dtype(dtype) and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(dtype) and dtype != np.float32:
+        values = series.to_numpy()
+        narrowed = values.astype(np.float32)
+        if np.array_equal(values, narrowed.astype(values.dtype), equal_nan=True):
+            return series.astype(np.float32)
+        return series
+    if dtype == object:
+        non_null = series.dropna()
+        if len(non_null) == 0:
+            return series
+        if non_null.map(type).eq(bool).all():
+            return series.astype('boolean' if len(non_null) < len(series) else 'bool')
+        if len(series) >= CATEGORY_MIN_ROWS and non_null.nunique() <= CATEGORY_MAX_RATIO * len(non_null):
+            return series.astype('category')
+    return series
+
+
+def optimize_dtypes(df, exclude=()):
+    '''Downcast numerics, turn low-cardinality text into categories and booleans into (nullable) bool.
+
+    Columns in `exclude` keep their dtype. Untouched columns are shared with the input frame.
+    '''
+    optimized = {}
+    for column in df.columns:
+        if column in exclude:
+            continue
+        series = optimize_series(df[column])
+        if series is not df[column]:
+            optimized[column] = series
+    if not optimized:
+        return df
+    df = df.copy(deep=False)
+    for column, series in optimized.items():
+        df[column] = series
+    return df
+
+
+def optimize_session_dataset(df):
+    '''Optimize a frame about to become `dataset_final`, keeping dtypes the user set explicitly.'''
+    return optimize_dtypes(df, exclude=st.session_state.get('pinned_dtypes', set()))
+
+
+def memory_report(before, after):
+    '''Per-column dtype and memory usage of a frame before and after optimization.'''
+    report = pd.DataFrame({
+        'Before': before.dtypes.astype(str),
+        'After': after.dtypes.reindex(before.columns).astype(str),
+        'Before (KB)': before.memory_usage(index=False, deep=True) / 1024,
+        'After (KB)': after.memory_usage(index=False, deep=True).reindex(before.columns) / 1024,
+    })
+    return report.round(1)
+
+
+def rss_bytes():
+    '''Current resident set size of the process, or its peak so far where /proc is not available.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def format_bytes(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024 or unit == 'GB':
+            return f'{nbytes:.1f} {unit}' if unit != 'B' else f'{nbytes} B'
+        nbytes /= 1024
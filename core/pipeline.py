@@ -0,0 +1,428 @@
+'''Recorded preprocessing steps that can be replayed outside Streamlit.
+
+A step is a JSON-serializable dict with an `op` key. Steps carry everything learned from the
+data when they were recorded (fill values, categories, scaler statistics), so replaying them
+on new rows never refits anything and gives the same result as the UI.
+
+Replay a pipeline exported from the sidebar over a large file in batches:
+
+    python -m core.pipeline pipeline.json input.csv output.csv --chunksize 100000
+
+The exported pipeline also holds the dtypes of the uploaded dataset after ingestion (narrowed
+numbers, categories, booleans). Every batch read from the file gets them first, so the steps see
+the same dtypes as in the UI.
+'''
+import argparse
+import json
+import operator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core import dedupe, encode, expressions, impute
+from core.optimize import is_number, upcast
+
+PIPELINE_FORMAT = 'datalyze-pipeline'
+PIPELINE_VERSION = 1
+CHUNK_ROWS = 100000
+
+ARITHMETIC_OPERATIONS = {
+    'Addition': operator.add,
+    'Subtraction': operator.sub,
+    'Multiplication': operator.mul,
+    'Division': operator.truediv,
+}
+SCALING_METHODS = {
+    'Min-Max Normalization': 'minmax',
+    'Z-Score Standardization': 'standard',
+    'Robust Scaling': 'robust',
+}
+
+
+def to_python(value):
+    '''Convert numpy/pandas scalars to plain Python values for JSON.'''
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def row_hashes(df):
+    '''64-bit hash per row that does not depend on how numbers or strings happen to be stored.'''
+    numeric = [column for column in df.columns if is_number(df[column])]
+    if numeric:
+        df = df.astype({column: 'float64' for column in numeric})
+    return pd.util.hash_pandas_object(df, index=False)
+
+
+# Step builders, they fit whatever the step needs on the current data
+def astype_step(df, columns, dtype):
+    step = {'op': 'astype', 'columns': list(columns), 'dtype': dtype}
+    if dtype == 'boolean':
+        step['mappings'] = {}
+        for column in columns:
+            unique_values = df[column].dropna().unique()
+            if len(unique_values) != 2:
+                raise ValueError(f'Feature \'{column}\' does not have exactly 2 unique values.')
+            step['mappings'][column] = [[to_python(unique_values[0]), False], [to_python(unique_values[1]), True]]
+    return step
+
+
+def fillna_step(df, strategy, data_type_option=None):
+    '''`strategy` is 'mean', 'median' or 'mode', `data_type_option` (an impute.COLUMN_KINDS key) selects the columns filled with the mode.'''
+    kind = data_type_option if strategy == 'mode' else 'Integer & Float'
+    values = impute.fill_values(df, strategy, impute.columns_with_nulls(df, kind))
+    return {'op': 'fillna', 'values': {column: to_python(value) for column, value in values.items()}}
+
+
+def fillna_group_step(df, by, strategy, data_type_option='Integer & Float'):
+    '''Fill nulls with the mean, median or mode of the row's group in column `by`.'''
+    kind = data_type_option if strategy == 'mode' else 'Integer & Float'
+    columns = [column for column in impute.columns_with_nulls(df, kind) if column != by]
+    values = impute.group_fill_values(df, by, strategy, columns)
+    for value in values.values():
+        value['groups'] = [[to_python(group), to_python(fill)] for group, fill in value['groups']]
+        value['default'] = to_python(value['default'])
+    return {'op': 'fillna_group', 'by': by, 'values': values}
+
+
+def impute_step(df, method):
+    '''Fit a KNN or iterative imputer on the numeric columns, stored in the step as base64 joblib.'''
+    columns = [column for column in df.columns if is_number(df[column]) and df[column].notna().any()]
+    model = impute.fit_model(df, method, columns)
+    return {'op': 'impute', 'method': method, 'columns': columns, 'model': impute.encode_model(model)}
+
+
+def one_hot_categories(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = list(series.cat.categories)
+    else:
+        categories = list(series.dropna().unique())
+        try:
+            categories = sorted(categories)
+        except TypeError: # Mixed types keep their order of appearance
+            pass
+    return [to_python(category) for category in categories]
+
+
+def one_hot_step(df, columns, drop_first=True, sparse=False):
+    step = {'op': 'one_hot', 'columns': list(columns), 'drop_first': drop_first,
+            'categories': {column: one_hot_categories(df[column]) for column in columns}}
+    if sparse:
+        step['sparse'] = True
+    return step
+
+
+def encode_step(df, encoding, columns, target=None, n_buckets=encode.HASH_BUCKETS, drop_first=True):
+    '''Fit one of the encode.ENCODINGS on `columns`, `target` is needed by target encoding only.'''
+    columns = list(columns)
+    if encoding in ('one_hot', 'one_hot_sparse'):
+        return one_hot_step(df, columns, drop_first, sparse=encoding == 'one_hot_sparse')
+    if encoding == 'ordinal':
+        return {'op': 'ordinal', 'columns': columns, 'categories': {column: one_hot_categories(df[column]) for column in columns}}
+    if encoding == 'target':
+        mappings = {}
+        for column in columns:
+            means, prior = encode.target_means(df[column], df[target])
+            mappings[column] = {'means': [[to_python(category), float(mean)] for category, mean in means.items()], 'default': float(prior)}
+        return {'op': 'target_encode', 'columns': columns, 'mappings': mappings}
+    if encoding == 'hash':
+        return {'op': 'hash', 'columns': columns, 'n_buckets': int(n_buckets)}
+    raise ValueError(f'Unknown encoding \'{encoding}\'.')
+
+
+def _scale_statistics(values, method, approximate):
+    if method == 'minmax':
+        center, scale = values.min(), values.max() - values.min()
+    elif method == 'standard':
+        center, scale = values.mean(), values.std(ddof=0)
+    elif approximate: # Quartiles of a uniform sample, their rank error is about 1/sqrt(SAMPLE_ROWS)
+        from core.eda import SAMPLE_ROWS
+        sample = values.iloc[np.random.default_rng(0).integers(0, len(values), SAMPLE_ROWS)]
+        q1, center, q3 = sample.quantile([0.25, 0.5, 0.75])
+        scale = q3 - q1
+    else:
+        q1, center, q3 = values.quantile([0.25, 0.5, 0.75])
+        scale = q3 - q1
+    return [to_python(center), to_python(scale) if scale != 0 else 1.0]
+
+
+def scale_step(df, method, columns, approximate=None):
+    '''`method` is 'minmax', 'standard' or 'robust', statistics match the scikit-learn scalers.
+
+    Robust scaling uses quartiles of a sample when `approximate` is True, by default on frames of
+    at least eda.APPROX_MIN_ROWS rows. Columns are fitted in parallel.
+    '''
+    if approximate is None:
+        from core.eda import APPROX_MIN_ROWS
+        approximate = len(df) >= APPROX_MIN_ROWS
+    columns = list(columns)
+    with ThreadPoolExecutor(max_workers=impute.MAX_WORKERS) as executor:
+        statistics = executor.map(lambda column: _scale_statistics(upcast(df[column]), method, approximate), columns)
+        return {'op': 'scale', 'method': method, 'statistics': dict(zip(columns, statistics))}
+
+
+# Step operations, `state` holds what a stateful step carries over between batches
+def _astype(df, columns, dtype, mappings=None, state=None):
+    for column in columns:
+        if dtype == 'boolean':
+            df[column] = df[column].map(dict((key, value) for key, value in mappings[column]))
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _drop_duplicates(df, subset=None, keep='first', state=None):
+    if state is None:
+        return df[~dedupe.duplicated(df, subset, keep)].reset_index(drop=True)
+    if keep != 'first':
+        raise ValueError(f'Removing duplicates with keep=\'{keep}\' needs all rows at once and cannot be replayed in batches.')
+    hashes = row_hashes(df if subset is None else df[subset])
+    seen = state.setdefault('seen', set())
+    keep = ~hashes.duplicated() & ~hashes.isin(seen)
+    seen.update(hashes[keep].tolist())
+    return df[keep.to_numpy()].reset_index(drop=True)
+
+
+def _dropna(df, subset=None, state=None):
+    return df.dropna(subset=subset).reset_index(drop=True)
+
+
+def _fillna(df, values, state=None):
+    return impute.fill(df, values)
+
+
+def _fillna_group(df, by, values, state=None):
+    return impute.fill_groups(df, by, values)
+
+
+def _impute(df, method, columns, model, state=None):
+    if state is None:
+        state = {}
+    if 'model' not in state: # Decoded once per replay, not once per batch
+        state['model'] = impute.decode_model(model)
+    return impute.transform_model(df, columns, state['model'])
+
+
+def _arithmetic(df, name, left, right, operation, state=None):
+    df[name] = ARITHMETIC_OPERATIONS[operation](upcast(df[left]), upcast(df[right]))
+    return df
+
+
+def _power(df, name, column, degree, state=None):
+    df[name] = upcast(df[column]) ** degree
+    return df
+
+
+def _expression(df, features, on_zero_division='nan', state=None):
+    for name, values in expressions.evaluate(df, features, on_zero_division).items():
+        df[name] = pd.Series(values, index=df.index)
+    return df
+
+
+def _one_hot(df, columns, categories, drop_first=True, sparse=False, state=None):
+    if sparse:
+        frames = []
+        for column in columns:
+            names = [f'{column}_{category}' for category in categories[column]][int(drop_first):]
+            positions = encode.codes(df[column], categories[column]).astype('int64') - int(drop_first)
+            frames.append(encode.sparse_indicators(positions, len(names), names, df.index))
+        return pd.concat([df.drop(columns=columns), *frames], axis=1)
+    for column in columns: # Fixed categories give every batch the same dummy columns
+        df[column] = pd.Categorical(df[column], categories=categories[column])
+    return pd.get_dummies(df, columns=columns, drop_first=drop_first)
+
+
+def _ordinal(df, columns, categories, state=None):
+    for column in columns:
+        df[column] = encode.codes(df[column], categories[column])
+    return df
+
+
+def _target_encode(df, columns, mappings, state=None):
+    for column in columns:
+        keys = pd.Series(df[column].to_numpy(dtype=object), index=df.index)
+        means = dict((category, mean) for category, mean in mappings[column]['means'])
+        df[column] = keys.map(means).astype('float64').fillna(mappings[column]['default'])
+    return df
+
+
+def _hash(df, columns, n_buckets, state=None):
+    frames = [encode.sparse_indicators((encode.hash_values(df[column]) % n_buckets).astype('int64'), n_buckets,
+                                       [f'{column}_hash_{bucket}' for bucket in range(n_buckets)], df.index) for column in columns]
+    return pd.concat([df.drop(columns=columns), *frames], axis=1)
+
+
+def _drop(df, columns, state=None):
+    return df.drop(columns=columns)
+
+
+def _rename(df, columns, state=None):
+    return df.rename(columns=columns)
+
+
+def _scale(df, method, statistics, state=None):
+    for column, (center, scale) in statistics.items():
+        values = df[column]
+        if values.dtype != 'float32': # float32 columns keep their dtype, everything else becomes float64
+            values = upcast(values).astype('float64')
+        df[column] = (values - center) / scale
+    return df
+
+
+OPERATIONS = {
+    'astype': _astype,
+    'drop_duplicates': _drop_duplicates,
+    'dropna': _dropna,
+    'fillna': _fillna,
+    'fillna_group': _fillna_group,
+    'impute': _impute,
+    'arithmetic': _arithmetic,
+    'power': _power,
+    'expression': _expression,
+    'one_hot': _one_hot,
+    'ordinal': _ordinal,
+    'target_encode': _target_encode,
+    'hash': _hash,
+    'drop': _drop,
+    'rename': _rename,
+    'scale': _scale,
+}
+
+
+def apply_step(df, step, state=None):
+    '''Apply one step to `df`, which may be modified in place. Pass a `state` dict when replaying in batches.'''
+    params = {key: value for key, value in step.items() if key != 'op'}
+    return OPERATIONS[step['op']](df, state=state, **params)
+
+
+def replay(steps, df, state=None):
+    for index, step in enumerate(steps):
+        df = apply_step(df, step, None if state is None else state.setdefault(index, {}))
+    return df
+
+
+def dtypes_of(df):
+    '''Column dtypes of `df` as strings, to store with the steps.'''
+    return {column: str(dtype) for column, dtype in df.dtypes.items()}
+
+
+def dumps(steps, dtypes=None):
+    '''Pipeline file of `steps`, with the `dtypes` (see dtypes_of) its input is cast to before replay.'''
+    pipeline = {'format': PIPELINE_FORMAT, 'version': PIPELINE_VERSION}
+    if dtypes:
+        pipeline['dtypes'] = dtypes
+    return json.dumps(dict(pipeline, steps=list(steps)), indent=2)
+
+
+def load(text):
+    '''Steps and input dtypes of a pipeline file, no dtypes for a file exported without them.'''
+    pipeline = json.loads(text)
+    if pipeline.get('format') != PIPELINE_FORMAT:
+        raise ValueError('Not a Datalyze pipeline file.')
+    for step in pipeline['steps']:
+        if step.get('op') not in OPERATIONS:
+            raise ValueError(f'Unknown pipeline step \'{step.get("op")}\'.')
+    return pipeline['steps'], pipeline.get('dtypes', {})
+
+
+def loads(text):
+    return load(text)[0]
+
+
+def cast(df, dtypes):
+    '''Give the columns of `df` the stored `dtypes`, where no value changes.
+
+    Like the dtype optimization at upload, a number is only narrowed when it fits, and a value that
+    does not fit the stored dtype (e.g. a missing value in an integer column) keeps the column as read.
+    '''
+    for column, dtype in dtypes.items():
+        if column not in df.columns or str(df[column].dtype) == dtype:
+            continue
+        series = df[column]
+        if dtype == 'bool' and series.isna().any():
+            dtype = 'boolean'
+        try:
+            converted = series.astype(dtype)
+        except (TypeError, ValueError):
+            continue
+        if is_number(series) and not converted.astype(series.dtype).equals(series):
+            continue
+        df[column] = converted
+    return df
+
+
+def read_batches(path, chunksize=CHUNK_ROWS, dtypes=None):
+    '''Frames of up to `chunksize` rows of a CSV/Parquet file, cast to `dtypes` when given.'''
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        batches = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize))
+    elif path.endswith('.xlsx'):
+        batches = iter([pd.read_excel(path)])
+    else:
+        batches = pd.read_csv(path, chunksize=chunksize)
+    for batch in batches:
+        yield cast(batch, dtypes) if dtypes else batch
+
+
+class BatchWriter:
+    '''Writes frames one after another to a CSV or Parquet file, with the schema of the first one.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.batches = 0
+        self._writer = None
+
+    def write(self, df):
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = self._writer.schema if self._writer is not None else None
+            table = pa.Table.from_pandas(encode.densify(df), schema=schema, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='a' if self.batches else 'w', header=not self.batches, index=False)
+        self.batches += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replay_file(steps, input_path, output_path, chunksize=CHUNK_ROWS, on_batch=None, dtypes=None):
+    '''Replay `steps` over a CSV/Parquet file batch by batch, writing CSV or Parquet. Returns the row count.'''
+    state, rows = {}, 0
+    with BatchWriter(output_path) as writer:
+        for index, batch in enumerate(read_batches(input_path, chunksize, dtypes)):
+            result = replay(steps, batch, state)
+            writer.write(result)
+            rows += len(result)
+            if on_batch:
+                on_batch(index, rows)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a Datalyze preprocessing pipeline over a file.')
+    parser.add_argument('pipeline', help='pipeline JSON exported from Datalyze')
+    parser.add_argument('input', help='input .csv or .parquet file')
+    parser.add_argument('output', help='output .csv or .parquet file')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS, help='rows per batch')
+    args = parser.parse_args(argv)
+    with open(args.pipeline) as f:
+        steps, dtypes = load(f.read())
+    rows = replay_file(steps, args.input, args.output, args.chunksize,
+                       on_batch=lambda index, rows: print(f'batch {index + 1}: {rows} rows written'), dtypes=dtypes)
+    print(f'Done, {rows} rows written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from core.dedupe import combine
+
+
+class DataProfile:
+    '''Data-quality statistics of one dataset version: duplicates, nulls and cardinality.
+
+    Everything is computed in vectorized passes. Duplicate rows are found from 64-bit row
+    fingerprints combined from per-column hashes. When a `previous` profile is given, columns
+    backed by the same memory as in the previous version (copy-on-write) reuse its per-column
+    results, so a step that touches a few columns only rehashes those columns.
+    '''
+
+    def __init__(self, df, buffers, previous=None):
+        self.num_rows, self.num_columns = df.shape
+        reusable = previous.column_stats_by_buffer() if previous is not None and previous.num_rows == len(df) else {}
+        self.null_counts, self.nunique, self.column_hashes, self._buffers = {}, {}, {}, {}
+        for column in df.columns:
+            key = buffers[column]
+            self._buffers[column] = key
+            if key in reusable:
+                self.null_counts[column], self.nunique[column], self.column_hashes[column] = reusable[key]
+                continue
+            series = df[column]
+            self.null_counts[column] = int(series.isna().sum())
+            self.nunique[column] = int(series.nunique())
+            self.column_hashes[column] = pd.util.hash_pandas_object(series, index=False).to_numpy()
+        self.null_counts = pd.Series(self.null_counts, index=df.columns, dtype='int64')
+        self.nunique = pd.Series(self.nunique, index=df.columns, dtype='int64')
+
+        # Row level results are cheap to rebuild from the per-column parts
+        fingerprints = combine([self.column_hashes[column] for column in df.columns], self.num_rows)
+        self.duplicated = pd.Series(fingerprints, index=df.index).duplicated().to_numpy()
+        null_columns = self.null_counts.index[self.null_counts > 0]
+        if len(null_columns):
+            self.rows_with_nulls = df[null_columns].isna().any(axis=1).to_numpy()
+        else:
+            self.rows_with_nulls = np.zeros(self.num_rows, dtype=bool)
+
+    @property
+    def num_duplicates(self):
+        return int(self.duplicated.sum())
+
+    @property
+    def num_rows_with_nulls(self):
+        return int(self.rows_with_nulls.sum())
+
+    @property
+    def total_missing(self):
+        return int(self.null_counts.sum())
+
+    def column_stats_by_buffer(self):
+        return {
+            key: (self.null_counts[column], self.nunique[column], self.column_hashes[column])
+            for column, key in self._buffers.items() if column in self.column_hashes
+        }
+
+    def release_hashes(self):
+        '''Drop the per-column hashes once a newer profile has been derived from this one.'''
+        self.column_hashes = {}
@@ -0,0 +1,265 @@
+'''Local registry of trained models, and batch scoring of files with them outside Streamlit.
+
+A registered model is the fitted estimator (with the scalers fitted along with it) saved by joblib,
+next to a JSON entry holding the pipeline steps that lead from the uploaded dataset to the
+training data, the features, the target and the test metrics. Models are kept in one directory per
+dataset schema (the uploaded column names and kinds), so a page lists the models that can score
+the dataset it works on. Small models are compressed. Large ones are saved uncompressed so every
+scoring worker memory-maps their arrays from the page cache instead of holding its own copy.
+
+Score a file too large for memory with a saved model, in batches spread over worker processes:
+
+    python -m core.registry list
+    python -m core.registry score MODEL_ID input.csv predictions.parquet --chunksize 100000 --workers 4
+
+The output holds the input columns (or the ones given with --keep) and a prediction column. The
+row filtering steps of the pipeline (duplicate and missing row removal) are skipped, so every input
+row is scored, rows with missing features get an empty prediction. The input only needs the
+uploaded columns the features are computed from, never the target: the plan is pruned like any
+other (see core.engine) so steps that only compute other columns are skipped.
+'''
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core import engine, incremental, modeling, pipeline
+from core.optimize import is_boolean, is_number
+
+REGISTRY_FORMAT = 'datalyze-model'
+REGISTRY_VERSION = 1
+REGISTRY_DIR = os.path.join('.datalyze', 'models')
+COMPRESS = 3
+MMAP_MIN_BYTES = 64 * 1024 * 1024 # Larger models are saved uncompressed and memory-mapped when scoring
+SCORE_WORKERS = os.cpu_count() or 1
+ROW_FILTERS = {'drop_duplicates', 'dropna'} # Steps skipped when scoring, every input row gets a prediction
+TASKS = ('classification', 'regression')
+KIND_DTYPES = {'boolean': 'bool', 'number': 'float64', 'text': 'object'}
+
+
+def column_kind(series):
+    '''Kind of a column as it comes out of any CSV reader, dates included as text.'''
+    if is_boolean(series):
+        return 'boolean'
+    if is_number(series):
+        return 'number'
+    return 'text'
+
+
+def input_schema(df):
+    return {column: column_kind(df[column]) for column in df.columns}
+
+
+def schema_key(schema):
+    '''Short hash of the column names and kinds of a dataset, the directory of its models.'''
+    return hashlib.blake2b(json.dumps(list(schema.items())).encode(), digest_size=8).hexdigest()
+
+
+def scoring_plan(entry):
+    '''(scan columns, required columns, steps) computing the features of `entry` from a file to score.
+
+    The target is only scanned when a kept step reads it, and is filled with missing values when the file lacks it.
+    '''
+    schema = pd.DataFrame({column: pd.Series(dtype=KIND_DTYPES[kind]) for column, kind in entry['schema'].items()})
+    steps = [step for step in entry['steps'] if step['op'] not in ROW_FILTERS]
+    scan, steps, _ = engine.optimize(schema, steps, entry['features'])
+    return scan, [column for column in scan if column != entry['target']], steps
+
+
+def prediction_column(entry):
+    return f"predicted_{entry['target']}"
+
+
+def predict(entry, estimator, df):
+    '''Predictions for the rows of `df`, already preprocessed, missing for the rows with a missing feature.'''
+    X = df[entry['features']]
+    complete = X.notna().all(axis=1).to_numpy()
+    if not complete.any():
+        return np.full(len(df), np.nan)
+    X = X[complete]
+    if entry['task'] == 'regression':
+        predictions = incremental.predict(estimator, X.to_numpy(dtype='float64', na_value=np.nan))
+    else:
+        predictions = estimator.predict(modeling.to_model_input(X))
+    if complete.all():
+        return predictions
+    return pd.Series(predictions, index=np.flatnonzero(complete)).reindex(np.arange(len(df))).to_numpy()
+
+
+class ModelRegistry:
+    '''Saved models under `root`, one directory per dataset schema and model.'''
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def _directory(self, model_id):
+        '''Directory of the model whose id is or starts with `model_id`.'''
+        matches = glob.glob(os.path.join(glob.escape(self.root), '*', glob.escape(model_id) + '*'))
+        if len(matches) != 1:
+            raise KeyError(f'No saved model with id \'{model_id}\'.' if not matches else f'Model id \'{model_id}\' is ambiguous.')
+        return matches[0]
+
+    def save(self, name, task, model, estimator, features, target, steps, schema, params=None, metrics=None):
+        '''Save the fitted `estimator` of `model` trained on the uploaded dataset of `schema` after `steps`, and return its entry.'''
+        if task not in TASKS:
+            raise ValueError(f'Unknown task \'{task}\'.')
+        import joblib
+        entry = {
+            'format': REGISTRY_FORMAT,
+            'version': REGISTRY_VERSION,
+            'id': uuid.uuid4().hex,
+            'name': name,
+            'task': task,
+            'model': model,
+            'params': params or {},
+            'features': list(features),
+            'target': target,
+            'steps': list(steps),
+            'schema': dict(schema),
+            'schema_key': schema_key(schema),
+            'metrics': metrics or {},
+            'created': time.time(),
+        }
+        entry['compressed'] = len(pickle.dumps(estimator, protocol=pickle.HIGHEST_PROTOCOL)) < MMAP_MIN_BYTES
+        directory = os.path.join(self.root, entry['schema_key'], entry['id'])
+        temp = f'{directory}.tmp'
+        os.makedirs(temp)
+        joblib.dump(estimator, os.path.join(temp, 'model.joblib'), compress=COMPRESS if entry['compressed'] else 0)
+        with open(os.path.join(temp, 'model.json'), 'w') as f:
+            json.dump(entry, f, indent=2, default=pipeline.to_python)
+        os.replace(temp, directory)
+        return entry
+
+    def entry(self, model_id):
+        with open(os.path.join(self._directory(model_id), 'model.json')) as f:
+            entry = json.load(f)
+        if entry.get('format') != REGISTRY_FORMAT:
+            raise ValueError('Not a Datalyze model.')
+        return entry
+
+    def load(self, model_id, mmap_mode=None):
+        '''The fitted estimator. `mmap_mode` memory-maps the arrays of a model saved uncompressed.'''
+        import joblib
+        directory = self._directory(model_id)
+        with open(os.path.join(directory, 'model.json')) as f:
+            compressed = json.load(f)['compressed']
+        return joblib.load(os.path.join(directory, 'model.joblib'), mmap_mode=None if compressed else mmap_mode)
+
+    def entries(self, schema=None, task=None):
+        '''Entries of the saved models, newest first, only those for the dataset `schema` and `task` when given.'''
+        pattern = os.path.join(glob.escape(self.root), schema_key(schema) if schema is not None else '*', '*', 'model.json')
+        entries = []
+        for path in glob.glob(pattern):
+            with open(path) as f:
+                entry = json.load(f)
+            if task is None or entry['task'] == task:
+                entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['created'], reverse=True)
+
+    def delete(self, model_id):
+        shutil.rmtree(self._directory(model_id))
+
+
+# Batch scoring
+_worker = {}
+
+
+def _init_worker(root, model_id):
+    '''Load the model once per scoring process.'''
+    registry = ModelRegistry(root)
+    entry = registry.entry(model_id)
+    _worker.update(
+        entry=entry,
+        estimator=registry.load(model_id, mmap_mode='r'),
+        steps=scoring_plan(entry)[2],
+        state={},
+    )
+
+
+def _score_batch(batch):
+    df = pipeline.replay(_worker['steps'], batch.reset_index(drop=True), _worker['state'])
+    return predict(_worker['entry'], _worker['estimator'], df)
+
+
+def _scored_batches(root, entry, input_path, chunksize, workers):
+    '''Yield (batch, predictions) in file order, with up to two batches per worker queued for scoring.'''
+    columns, required, _ = scoring_plan(entry)
+
+    def inputs():
+        for batch in pipeline.read_batches(input_path, chunksize):
+            missing = [column for column in required if column not in batch.columns]
+            if missing:
+                raise ValueError(f'The file is missing columns the features of the model are computed from: {missing}')
+            yield batch
+
+    if workers <= 1:
+        _init_worker(root, entry['id'])
+        for batch in inputs():
+            yield batch, _score_batch(batch.reindex(columns=columns))
+        return
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(root, entry['id'])) as executor:
+        pending = deque()
+        for batch in inputs():
+            pending.append((batch, executor.submit(_score_batch, batch.reindex(columns=columns))))
+            if len(pending) >= 2 * workers:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+def score_file(model_id, input_path, output_path, chunksize=pipeline.CHUNK_ROWS, workers=SCORE_WORKERS, keep=None,
+               root=REGISTRY_DIR, on_batch=None):
+    '''Score a CSV/Parquet file with a saved model batch by batch, writing CSV or Parquet. Returns the row count.'''
+    entry = ModelRegistry(root).entry(model_id)
+    rows = 0
+    with pipeline.BatchWriter(output_path) as writer:
+        for index, (batch, predictions) in enumerate(_scored_batches(root, entry, input_path, chunksize, workers)):
+            result = batch[keep] if keep is not None else batch
+            writer.write(result.assign(**{prediction_column(entry): predictions}))
+            rows += len(result)
+            if on_batch:
+                on_batch(index, rows)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the saved Datalyze models and score files with them.')
+    parser.add_argument('--root', default=REGISTRY_DIR, help='registry directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list the saved models')
+    score = commands.add_parser('score', help='score a file with a saved model')
+    score.add_argument('model', help='model id, or a unique prefix of it')
+    score.add_argument('input', help='input .csv or .parquet file with the columns of the uploaded dataset')
+    score.add_argument('output', help='output .csv or .parquet file')
+    score.add_argument('--chunksize', type=int, default=pipeline.CHUNK_ROWS, help='rows per batch')
+    score.add_argument('--workers', type=int, default=SCORE_WORKERS, help='scoring processes')
+    score.add_argument('--keep', nargs='*', help='input columns to copy to the output (default: all)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for entry in ModelRegistry(args.root).entries():
+            metrics = ', '.join(f'{metric}={value:.4f}' for metric, value in entry['metrics'].items())
+            print(f"{entry['id']}  {entry['task']:<14}  {entry['name']} ({entry['model']}, target {entry['target']})  {metrics}")
+        return
+    start = time.perf_counter()
+    rows = score_file(args.model, args.input, args.output, args.chunksize, args.workers, args.keep, args.root,
+                      on_batch=lambda index, rows: print(f'batch {index + 1}: {rows} rows scored'))
+    print(f'Done, {rows} rows scored in {time.perf_counter() - start:.1f}s and written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''Sampling mode: interactive work on a sample of the uploaded rows, replayed on all of them later.
+
+In sampling mode the dataset history starts from a sample, so previews, profiles and the steps
+fitted on the pages only touch those rows. The recorded pipeline steps carry what they learned
+from the sample (fill values, categories, scaler statistics), and a background job replays them
+as they are on the full dataset.
+'''
+import numpy as np
+import pandas as pd
+
+SAMPLE_ROWS = 100000
+METHODS = {
+    'Random sample': 'random',
+    'Stratified sample': 'stratified',
+    'First rows': 'head',
+}
+
+
+def _stratified_positions(labels, rows, rng):
+    '''Random positions in which every class (nulls included) keeps its share of the rows, and at least one row.'''
+    codes = pd.factorize(labels, use_na_sentinel=False)[0]
+    counts = np.bincount(codes)
+    quotas = np.minimum(np.maximum(np.round(counts * rows / len(labels)), 1), counts).astype('int64')
+    order = rng.permutation(len(labels))
+    shuffled = codes[order]
+    ranks = pd.Series(shuffled).groupby(shuffled).cumcount().to_numpy()
+    return order[ranks < quotas[shuffled]]
+
+
+def sample(df, method, rows, by=None, random_state=42):
+    '''`rows` rows of `df` in their original order, drawn at random, stratified on column `by` or taken from the start.'''
+    if rows >= len(df):
+        return df
+    if method == 'head':
+        return df.iloc[:rows].reset_index(drop=True)
+    rng = np.random.default_rng(random_state)
+    if method == 'random':
+        positions = rng.choice(len(df), rows, replace=False)
+    elif method == 'stratified':
+        positions = _stratified_positions(df[by], rows, rng)
+    else:
+        raise ValueError(f'Unknown sampling method \'{method}\'.')
+    return df.iloc[np.sort(positions)].reset_index(drop=True)
+
+
+def describe(settings):
+    methods = {method: label for label, method in METHODS.items()}
+    text = f"{methods[settings['method']].lower()} of {settings['rows']:,} rows"
+    return text + f" by {settings['by']}" if settings['method'] == 'stratified' else text
+
+
+def replay_job(job, df, steps):
+    '''Background job: replay the steps recorded on the sample on the full dataset, one step at a time.'''
+    from core import pipeline
+    for index, step in enumerate(steps):
+        job.progress(index / len(steps), f"Step {index + 1} of {len(steps)} ({step['op']}) on {len(df):,} rows")
+        df = pipeline.apply_step(df, step)
+    return {'df': df, 'steps': steps}
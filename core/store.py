@@ -0,0 +1,293 @@
+'''On-disk column store behind the dataset history.
+
+Every column of a dataset version is written once to an Arrow IPC file named after a hash of its
+content, so versions (and sessions) holding the same column share one file. Reading memory-maps the
+files: numeric columns stay backed by the page cache instead of the process heap, through a private
+copy-on-write mapping so pandas can still modify them in place. Session state only keeps the column
+keys. Materialized frames go to an LRU shared by every session and bounded by size, and sessions
+idle for too long are evicted, least recently used first, releasing the files only they referenced.
+Each server process keeps its files in its own directory under STORE_DIR, and only the directories
+of processes that no longer run are removed.
+'''
+import hashlib
+import mmap
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError: # Columns are pickled and loaded into memory instead of memory-mapped
+    pa = None
+
+STORE_DIR = os.path.join('.datalyze', 'store')
+FRAME_CACHE_BYTES = 1024 * 1024 * 1024 # Frames materialized from disk, shared by every session
+STORE_MAX_BYTES = 20 * 1024 * 1024 * 1024 # Disk budget, least recently used sessions are evicted above it
+SESSION_IDLE_SECONDS = 2 * 60 * 60
+COLLECT_INTERVAL_SECONDS = 60
+_COLUMN = 'values'
+
+
+def buffer_address(series):
+    '''Identify the memory behind a column, equal for columns shared through copy-on-write.'''
+    values = series.array
+    if isinstance(values, pd.Categorical):
+        values = values.codes
+    elif isinstance(values, pd.arrays.NumpyExtensionArray):
+        values = values.to_numpy()
+    if isinstance(values, np.ndarray):
+        return (values.__array_interface__['data'][0], values.dtype.str, len(values))
+    return id(values)
+
+
+def content_key(series):
+    '''Hash of the dtype and values of a column, the name of its file in the store.'''
+    hasher = hashlib.blake2b(str(series.dtype).encode(), digest_size=16)
+    try:
+        hasher.update(pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes())
+    except TypeError: # Unhashable values such as lists
+        hasher.update(pickle.dumps(series.to_numpy(), protocol=pickle.HIGHEST_PROTOCOL))
+    return hasher.hexdigest()
+
+
+def _process_alive(pid):
+    '''Whether the process `pid`, owner of the store directory named after it, still runs.'''
+    if os.name == 'nt': # os.kill(pid, 0) would send CTRL_C_EVENT there
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+        if handle:
+            ctypes.windll.kernel32.CloseHandle(handle)
+        return bool(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Runs under another user
+        return True
+    return True
+
+
+def _remove_stale(root):
+    '''Delete the store directories under `root` of processes that no longer run, and files of older layouts.'''
+    for name in os.listdir(root):
+        if not (name.isdigit() and int(name) != os.getpid() and _process_alive(int(name))):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def _writable(series, source, chunk):
+    '''Replace a read-only zero-copy column by a view of the same bytes in a copy-on-write mapping.'''
+    values = series.to_numpy()
+    if values.flags.writeable or series.dtype != values.dtype or chunk.type.bit_width != values.itemsize * 8:
+        return series # Already a copy, or not stored as plain values (e.g. bit-packed booleans)
+    address = chunk.buffers()[1].address + chunk.offset * values.itemsize
+    offset = address - source['base']
+    view = np.frombuffer(source['map'], dtype=values.dtype, count=len(values), offset=offset)
+    return pd.Series(view, index=series.index, name=series.name, copy=False)
+
+
+class ColumnStore:
+    '''Content-addressed column files plus an LRU of the frames materialized from them.'''
+
+    def __init__(self, root=STORE_DIR, frame_cache_bytes=FRAME_CACHE_BYTES, max_bytes=STORE_MAX_BYTES,
+                 idle_seconds=SESSION_IDLE_SECONDS):
+        self.root = os.path.join(root, str(os.getpid()))
+        self.frame_cache_bytes = frame_cache_bytes
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.cached_bytes = 0
+        self._frames = OrderedDict() # version id -> (frame, {buffer address: key}, bytes, session id)
+        self._sizes = {} # key -> bytes on disk
+        self._sessions = OrderedDict() # session id -> [last access, referenced keys], least recent first
+        self._evicted = set()
+        self._collected = time.time()
+        self._lock = threading.RLock()
+        # Files of a previous server run belong to sessions that no longer exist, other running servers keep theirs
+        os.makedirs(root, exist_ok=True)
+        _remove_stale(root)
+        os.makedirs(self.root)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _write_column(self, key, series):
+        if key in self._sizes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            if pa is None:
+                raise TypeError('pyarrow is not installed')
+            table = pa.Table.from_pandas(series.to_frame(_COLUMN), preserve_index=False)
+            with pa.OSFile(temporary, 'wb') as sink, pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            suffix = '.arrow'
+        except (TypeError, ValueError, NotImplementedError) + ((pa.ArrowException,) if pa is not None else ()):
+            # Sparse and mixed-type columns have no Arrow equivalent
+            with open(temporary, 'wb') as file:
+                pickle.dump(series.rename(_COLUMN), file, protocol=pickle.HIGHEST_PROTOCOL)
+            suffix = '.pkl'
+        os.replace(temporary, path + suffix)
+        self._sizes[key] = os.path.getsize(path + suffix)
+
+    def _read_column(self, key):
+        path = self._path(key)
+        if os.path.exists(f'{path}.pkl'):
+            with open(f'{path}.pkl', 'rb') as file:
+                return pickle.load(file)
+        with open(f'{path}.arrow', 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        buffer = pa.py_buffer(mapped)
+        table = pa_ipc.open_file(pa.BufferReader(buffer)).read_all()
+        series = table.to_pandas(split_blocks=True)[_COLUMN]
+        chunks = table.column(0).chunks
+        if len(chunks) == 1 and len(chunks[0].buffers()) == 2 and chunks[0].buffers()[1] is not None:
+            series = _writable(series, {'map': mapped, 'base': buffer.address}, chunks[0])
+        return series
+
+    def _cache(self, session_id, version_id, df, addresses):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if version_id in self._frames:
+            self.cached_bytes -= self._frames.pop(version_id)[2]
+        self._frames[version_id] = (df, addresses, nbytes, session_id)
+        self.cached_bytes += nbytes
+        while len(self._frames) > 1 and self.cached_bytes > self.frame_cache_bytes:
+            self.cached_bytes -= self._frames.popitem(last=False)[1][2]
+
+    def write(self, session_id, version_id, df, parent_id=None):
+        '''Store the columns and index of `df` and return their keys as ({column: key}, index handle).
+
+        Columns still sharing memory with the cached frame of `parent_id` reuse its keys unhashed.
+        '''
+        with self._lock:
+            parent = self._frames[parent_id][1] if parent_id in self._frames else {}
+            keys, addresses = {}, {}
+            for column in df.columns:
+                series = df[column]
+                address = buffer_address(series)
+                key = parent.get(address)
+                if key is None:
+                    key = content_key(series)
+                    self._write_column(key, series)
+                keys[column], addresses[address] = key, key
+            if isinstance(df.index, pd.RangeIndex):
+                index = ('range', df.index.start, df.index.stop, df.index.step, df.index.name)
+            else:
+                values = pd.Series(df.index, copy=False)
+                key = content_key(values)
+                self._write_column(key, values)
+                index = ('column', key, df.index.name)
+            session = self._sessions.setdefault(session_id, [time.time(), set()])
+            session[1].update(keys.values())
+            if index[0] == 'column':
+                session[1].add(index[1])
+            self._cache(session_id, version_id, df, addresses)
+            return keys, index
+
+    def read(self, session_id, version_id, keys, index, columns=None):
+        '''Frame of a stored version, memory-mapped from disk unless it is still cached.
+
+        With `columns`, only those columns are read and the partial frame is not cached.
+        '''
+        with self._lock:
+            if version_id in self._frames:
+                self._frames.move_to_end(version_id)
+                df = self._frames[version_id][0]
+                return df if columns is None else df[list(columns)]
+            if columns is not None:
+                return self._assemble({column: keys[column] for column in columns}, index)
+            df = self._assemble(keys, index)
+            self._cache(session_id, version_id, df, {buffer_address(df[column]): key for column, key in keys.items()})
+            return df
+
+    def _assemble(self, keys, index):
+        if index[0] == 'range':
+            labels = pd.RangeIndex(index[1], index[2], index[3], name=index[4])
+        else:
+            labels = pd.Index(self._read_column(index[1]), name=index[2])
+        return pd.DataFrame({column: self._read_column(key).array for column, key in keys.items()}, index=labels, copy=False)
+
+    def size(self, keys):
+        '''Bytes on disk of the distinct `keys`.'''
+        return sum(self._sizes.get(key, 0) for key in set(keys))
+
+    def disk_usage(self):
+        return sum(self._sizes.values())
+
+    def touch(self, session_id):
+        '''Record an access of the session. Returns False when its files were evicted in the meantime.'''
+        with self._lock:
+            if session_id in self._evicted:
+                self._evicted.discard(session_id)
+                return False
+            self._sessions.setdefault(session_id, [time.time(), set()])[0] = time.time()
+            self._sessions.move_to_end(session_id)
+            if time.time() - self._collected > COLLECT_INTERVAL_SECONDS:
+                self.collect()
+            return True
+
+    def retain(self, session_id, keys):
+        '''Set the keys still referenced by a session, e.g. after versions left its history.'''
+        with self._lock:
+            self._sessions.setdefault(session_id, [time.time(), set()])[1] = set(keys)
+            if self.disk_usage() > self.max_bytes:
+                self.collect()
+            else:
+                self._delete_unreferenced()
+
+    def release(self, session_id):
+        '''Forget a session that deleted its dataset, with its cached frames and the files only it referenced.'''
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._drop_frames(session_id)
+            self._delete_unreferenced()
+
+    def collect(self):
+        '''Evict sessions idle for too long, then the least recently used ones while the disk budget is exceeded.'''
+        with self._lock:
+            now = time.time()
+            self._collected = now
+            for session_id, (seen, _) in list(self._sessions.items()):
+                if now - seen > self.idle_seconds:
+                    self._evict(session_id)
+            while len(self._sessions) > 1 and self.disk_usage() > self.max_bytes:
+                self._evict(next(iter(self._sessions)))
+            self._delete_unreferenced()
+
+    def _evict(self, session_id):
+        del self._sessions[session_id]
+        self._evicted.add(session_id)
+        self._drop_frames(session_id)
+
+    def _drop_frames(self, session_id):
+        for version_id, (_, _, nbytes, owner) in list(self._frames.items()):
+            if owner == session_id:
+                del self._frames[version_id]
+                self.cached_bytes -= nbytes
+
+    def _delete_unreferenced(self):
+        referenced = set().union(*(keys for _, keys in self._sessions.values()))
+        for key in [key for key in self._sizes if key not in referenced]:
+            for suffix in ('.arrow', '.pkl'):
+                try:
+                    os.remove(self._path(key) + suffix)
+                except FileNotFoundError:
+                    pass
+            del self._sizes[key]
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+@st.cache_resource
+def get_store():
+    return ColumnStore()
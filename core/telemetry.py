@@ -0,0 +1,249 @@
+'''Opt-in tracing of script reruns and dataset operations, per session.
+
+When a session turns the performance panel on, every script run becomes a trace: a root span
+for the page with nested spans opened by the core modules (version checkout, commit and
+materialization, profiling, previews sent to the browser). Spans find the running trace through
+a context variable, so code that runs outside a traced rerun, in jobs or other sessions, only
+pays for one lookup. Finished traces are kept in the session for the sidebar panel and appended
+to TELEMETRY_FILE as OTLP/JSON, one export request per line, as written by the file exporter of
+the OpenTelemetry collector. A cProfile (or pyinstrument, when installed) profile of the rerun
+can be switched on as well.
+'''
+import contextvars
+import io
+import json
+import os
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from importlib.util import find_spec
+
+import streamlit as st
+
+from core.optimize import rss_bytes
+
+TELEMETRY_DIR = os.path.join('.datalyze', 'telemetry')
+TELEMETRY_FILE = os.path.join(TELEMETRY_DIR, 'spans.jsonl')
+TRACE_HISTORY = 50 # Reruns kept per session for the panel
+PROFILE_LINES = 40
+SERVICE_NAME = 'datalyze'
+PROFILERS = ['Off', 'cProfile'] + (['pyinstrument'] if find_spec('pyinstrument') is not None else [])
+
+_current = contextvars.ContextVar('datalyze_trace', default=None)
+
+
+class Span:
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        '''Seconds, up to now for a span that is still open.'''
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+
+class Trace:
+    '''Spans of one script run, the first one is the root.'''
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.counters = Counter()
+        self._open = []
+
+    @property
+    def root(self):
+        return self.spans[0]
+
+    def start(self, name, attributes):
+        span = Span(name, self._open[-1].span_id if self._open else None, attributes)
+        self.spans.append(span)
+        self._open.append(span)
+        return span
+
+    def finish(self, span, error=None):
+        span.end = time.time_ns()
+        if error is not None and not _is_control_flow(error):
+            span.error = f'{type(error).__name__}: {error}'
+        self._open.remove(span)
+
+
+def _is_control_flow(error):
+    # st.rerun() and st.stop() end a script run by raising, that is not a failure
+    return any(cls.__name__ == 'ScriptControlException' for cls in type(error).__mro__)
+
+
+def active():
+    return _current.get() is not None
+
+
+@contextmanager
+def span(name, **attributes):
+    '''Time the block as a child of the innermost open span, yields a dict for more attributes.'''
+    trace = _current.get()
+    if trace is None:
+        yield attributes
+        return
+    current = trace.start(name, attributes)
+    try:
+        yield current.attributes
+    except BaseException as error:
+        trace.finish(current, error)
+        raise
+    trace.finish(current)
+
+
+def count(name, value=1):
+    '''Add `value` to a counter reported on the root span of the running trace.'''
+    trace = _current.get()
+    if trace is not None:
+        trace.counters[name] += value
+
+
+def serialized_size(df):
+    '''Bytes of `df` as Arrow IPC, the format st.dataframe sends to the browser.'''
+    try:
+        import pyarrow as pa
+        sink = pa.BufferOutputStream()
+        table = pa.Table.from_pandas(df)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().size
+    except Exception: # Frames Arrow cannot convert are sent by Streamlit another way
+        return None
+
+
+def enabled():
+    return bool(st.session_state.get('telemetry_enabled'))
+
+
+def traces():
+    return st.session_state.setdefault('telemetry_traces', deque(maxlen=TRACE_HISTORY))
+
+
+@contextmanager
+def _profiler(name):
+    if name == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            st.session_state['telemetry_profile'] = profiler.output_text(unicode=False, color=False)
+    elif name == 'cProfile':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # Another profiler is already running in this thread
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            st.session_state['telemetry_profile'] = stream.getvalue()
+    else:
+        yield
+
+
+@contextmanager
+def rerun(page):
+    '''Trace one script run of `page` when the session turned telemetry on.'''
+    if not enabled():
+        yield
+        return
+    trace = Trace()
+    token = _current.set(trace)
+    root = trace.start('rerun', {'page': page})
+    try:
+        with _profiler(st.session_state.get('telemetry_profiler', 'Off')):
+            yield
+    except BaseException as error:
+        trace.finish(root, error)
+        raise
+    else:
+        trace.finish(root)
+    finally:
+        _current.reset(token)
+        root.attributes.update(trace.counters)
+        root.attributes['process.memory.rss'] = rss_bytes()
+        traces().append(trace)
+        export([trace])
+
+
+# OTLP/JSON encoding
+def _value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _attributes(attributes):
+    return [{'key': key, 'value': _value(value)} for key, value in attributes.items() if value is not None]
+
+
+def to_otlp(trace_list):
+    '''An OTLP ExportTraceServiceRequest holding the spans of the traces.'''
+    spans = []
+    for trace in trace_list:
+        for span in trace.spans:
+            encoded = {
+                'traceId': trace.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 1, # SPAN_KIND_INTERNAL
+                'startTimeUnixNano': str(span.start),
+                'endTimeUnixNano': str(span.end or span.start),
+                'attributes': _attributes(span.attributes),
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+            }
+            if span.parent_id:
+                encoded['parentSpanId'] = span.parent_id
+            spans.append(encoded)
+    return {'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': SERVICE_NAME})},
+        'scopeSpans': [{'scope': {'name': 'core.telemetry'}, 'spans': spans}],
+    }]}
+
+
+def dumps(trace_list):
+    return json.dumps(to_otlp(trace_list))
+
+
+def export(trace_list, path=TELEMETRY_FILE):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(dumps(trace_list) + '\n')
+    except OSError: # Telemetry never breaks the app
+        pass
+
+
+def spans_table(trace):
+    '''Rows for the panel: span name indented by depth, duration in ms and attributes.'''
+    depth = {None: -1}
+    rows = []
+    for span in trace.spans:
+        depth[span.span_id] = depth.get(span.parent_id, -1) + 1
+        rows.append({
+            'Span': '  ' * depth[span.span_id] + span.name,
+            'ms': round(span.duration * 1000, 1),
+            'Attributes': ', '.join(f'{key}={value}' for key, value in span.attributes.items()) + (f' ({span.error})' if span.error else ''),
+        })
+    return rows
@@ -0,0 +1,290 @@
+'''Cross-validated hyperparameter search for the Machine Learning Lab.
+
+A search runs as a background job (see core.jobs), so widget changes and reruns of the page
+never interrupt it. Folds run in a process pool over all cores. The training data is sent to
+each worker once (pool initializer) and every task only carries fold indices. Trials are
+reported as they finish and cached per dataset version, features, target and parameters: the
+page seeds each job with the cached trials of its data and keeps the new ones, so a later
+search never refits a trial that already completed.
+'''
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import streamlit as st
+
+from core import jobs
+
+MAX_WORKERS = os.cpu_count() or 1
+
+CLASSIFIERS = {
+    'Logistic Regression': {'C': [0.01, 0.1, 1.0, 10.0, 100.0]},
+    'K-Nearest Neighbors': {'n_neighbors': [3, 5, 7, 11, 15, 25], 'weights': ['uniform', 'distance']},
+    'Decision Tree': {'max_depth': [None, 3, 5, 8, 12, 20], 'min_samples_leaf': [1, 2, 5, 10, 20], 'criterion': ['gini', 'entropy']},
+    'Random Forest': {'n_estimators': [50, 100, 200], 'max_depth': [None, 5, 10, 20], 'min_samples_leaf': [1, 2, 5], 'max_features': ['sqrt', 'log2', None]},
+    'Gradient Boosting': {'learning_rate': [0.03, 0.1, 0.3], 'max_iter': [100, 200, 300], 'max_leaf_nodes': [15, 31, 63], 'l2_regularization': [0.0, 0.1, 1.0]},
+}
+SCORINGS = ['accuracy', 'balanced_accuracy', 'f1_macro', 'roc_auc_ovr']
+
+
+def make_classifier(name, params, random_state=42):
+    '''Build a classifier by registry name, importing scikit-learn only when needed.'''
+    if name == 'Logistic Regression':
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(max_iter=1000, **params)
+    if name == 'K-Nearest Neighbors':
+        from sklearn.neighbors import KNeighborsClassifier
+        return KNeighborsClassifier(**params)
+    if name == 'Decision Tree':
+        from sklearn.tree import DecisionTreeClassifier
+        return DecisionTreeClassifier(random_state=random_state, **params)
+    if name == 'Random Forest':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(random_state=random_state, n_jobs=1, **params)
+    if name == 'Gradient Boosting':
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import FunctionTransformer
+        # Needs dense input, sparse one-hot features are densified per fit
+        return make_pipeline(FunctionTransformer(_densify, accept_sparse=True), HistGradientBoostingClassifier(random_state=random_state, **params))
+    raise ValueError(f'Unknown classifier \'{name}\'.')
+
+
+MAX_DENSE_BYTES = 1 << 30
+
+
+def _densify(X):
+    if not hasattr(X, 'toarray'):
+        return X
+    if X.shape[0] * X.shape[1] * 8 > MAX_DENSE_BYTES:
+        raise ValueError('Too many sparse features to densify, use ordinal or target encoding for this model.')
+    return X.toarray()
+
+
+def sample_configurations(models, n_trials, random_state=42):
+    '''Random, distinct (model, params) pairs spread evenly over `models`.'''
+    rng = np.random.default_rng(random_state)
+    configurations, seen = [], set()
+    for attempt in range(n_trials * 20):
+        if len(configurations) == n_trials:
+            break
+        model = models[attempt % len(models)]
+        params = {name: values[rng.integers(len(values))] for name, values in CLASSIFIERS[model].items()}
+        key = (model, json.dumps(params, sort_keys=True))
+        if key not in seen:
+            seen.add(key)
+            configurations.append((model, params))
+    return configurations
+
+
+# Worker side, the training data is installed once per process
+_worker_data = {}
+
+
+def _init_worker(X, y):
+    _worker_data['X'], _worker_data['y'] = X, y
+
+
+def _fit_fold(model, params, train_index, test_index, scoring, random_state):
+    from sklearn.metrics import get_scorer
+    X, y = _worker_data['X'], _worker_data['y']
+    start = time.perf_counter()
+    estimator = make_classifier(model, params, random_state).fit(X[train_index], y[train_index])
+    fit_time = time.perf_counter() - start
+    return get_scorer(scoring)(estimator, X[test_index], y[test_index]), fit_time
+
+
+class TrialCache:
+    '''Finished trials keyed by everything that determines their score.'''
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, trial):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = trial
+
+    def entries(self, context):
+        '''The cached trials and test results of the data `context`, as a dict.'''
+        prefix = json.dumps([context], sort_keys=True, default=str)[:-1] + ','
+        with self._lock:
+            return {key: trial for key, trial in self._entries.items() if key.startswith(prefix)}
+
+    def update(self, entries):
+        for key, trial in entries.items():
+            self.put(key, trial)
+
+
+@st.cache_resource
+def get_trial_cache():
+    return TrialCache()
+
+
+def trial_key(context, model, params, n_samples, cv, scoring):
+    return json.dumps([context, model, params, n_samples, cv, scoring], sort_keys=True, default=str)
+
+
+def _folds(y, sample_index, cv, random_state):
+    from sklearn.model_selection import KFold, StratifiedKFold
+    _, class_counts = np.unique(y[sample_index], return_counts=True)
+    splitter = StratifiedKFold if class_counts.min() >= cv else KFold
+    folds = splitter(n_splits=cv, shuffle=True, random_state=random_state).split(sample_index, y[sample_index])
+    return [(sample_index[train], sample_index[test]) for train, test in folds]
+
+
+def search(X, y, context, models, strategy='Successive Halving', n_trials=20, cv=5, scoring='accuracy',
+           time_budget=None, patience=None, eta=3, random_state=42, max_workers=MAX_WORKERS, cache=None):
+    '''Run a random search or successive halving, yielding one trial dict per finished configuration.
+
+    `context` identifies the data (dataset version, features, target, split) for the trial cache.
+    Successive halving starts every configuration on a small subsample and keeps the best 1/eta on
+    eta times more rows each rung. `patience` stops a random search after that many trials without
+    improvement and `time_budget` (seconds) stops submitting work once exceeded. Trials are
+    cached in `cache`, the process-wide trial cache by default.
+    '''
+    cache = get_trial_cache() if cache is None else cache
+    configurations = sample_configurations(models, n_trials, random_state)
+    order = np.random.default_rng(random_state).permutation(len(y))
+    if strategy == 'Successive Halving':
+        rungs = max(1, math.floor(math.log(len(configurations), eta)) + 1) if configurations else 1
+        min_samples = max(len(y) // eta ** (rungs - 1), cv * len(np.unique(y)) * 2, min(len(y), 100))
+    else:
+        rungs, min_samples = 1, len(y)
+    deadline = time.monotonic() + time_budget if time_budget else None
+    best_score, trials_since_best = -np.inf, 0
+
+    executor = None
+    try:
+        for rung in range(rungs):
+            n_samples = min(len(y), min_samples * eta ** rung) if rung < rungs - 1 else len(y)
+            sample_index = np.sort(order[:n_samples])
+            folds = None
+            results, pending = [], {}
+            for model, params in configurations:
+                key = trial_key(context, model, params, n_samples, cv, scoring)
+                cached = cache.get(key)
+                if cached is not None:
+                    trial = dict(cached, rung=rung, cached=True)
+                    results.append(trial)
+                    yield trial
+                    continue
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                   initializer=_init_worker, initargs=(X, y))
+                if folds is None:
+                    folds = _folds(y, sample_index, cv, random_state)
+                futures = [executor.submit(_fit_fold, model, params, train, test, scoring, random_state) for train, test in folds]
+                pending[key] = (model, params, futures)
+
+            stopped = False
+            while pending and not stopped:
+                all_futures = [future for _, _, futures in pending.values() for future in futures]
+                timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+                done, _ = wait(all_futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done: # Time budget exhausted
+                    stopped = True
+                    break
+                for key in [key for key, (_, _, futures) in pending.items() if all(future.done() for future in futures)]:
+                    model, params, futures = pending.pop(key)
+                    try:
+                        scores, fit_times = zip(*[future.result() for future in futures])
+                    except Exception as e: # A model that cannot handle this data, the other configurations go on
+                        trial = {'model': model, 'params': params, 'n_samples': n_samples, 'score': float('nan'), 'std': float('nan'),
+                                 'fit_time': 0.0, 'rung': rung, 'cached': False, 'error': str(e)}
+                        yield trial
+                        continue
+                    trial = {'model': model, 'params': params, 'n_samples': n_samples, 'score': float(np.mean(scores)),
+                             'std': float(np.std(scores)), 'fit_time': float(np.sum(fit_times)), 'rung': rung, 'cached': False}
+                    cache.put(key, trial)
+                    results.append(trial)
+                    yield trial
+                    if trial['score'] > best_score:
+                        best_score, trials_since_best = trial['score'], 0
+                    else:
+                        trials_since_best += 1
+                    if strategy != 'Successive Halving' and patience and trials_since_best >= patience:
+                        stopped = True
+                        break
+            if stopped or (deadline is not None and time.monotonic() > deadline):
+                break
+            # Promote the best 1/eta configurations to the next rung
+            ranked = sorted(results, key=lambda trial: trial['score'], reverse=True) # Failed trials are never in `results`
+            configurations = [(trial['model'], trial['params']) for trial in ranked[:max(1, math.ceil(len(ranked) / eta))]]
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def evaluate(X_train, y_train, X_test, y_test, context, model, params, scoring='accuracy', random_state=42, cache=None):
+    '''Fit one configuration on the full training split and score it on the test split, cached like trials.'''
+    from sklearn.metrics import get_scorer
+    cache = get_trial_cache() if cache is None else cache
+    key = trial_key(context, model, params, 'test', None, scoring)
+    result = cache.get(key)
+    if result is None:
+        estimator = make_classifier(model, params, random_state).fit(X_train, y_train)
+        result = {'estimator': estimator, 'score': float(get_scorer(scoring)(estimator, X_test, y_test))}
+        cache.put(key, result)
+    return result['estimator'], result['score']
+
+
+def tune(job, X_train, y_train, X_test, y_test, context, models, strategy, n_trials, cv, scoring, time_budget=None, patience=None,
+         cached=None):
+    '''Background job: search, then refit the best configuration on the training split and score it on the test split.
+
+    `cached` seeds the trial cache of the job process, the new trials are returned under `cache`
+    for the page to keep. The refitted estimator is saved as the `model` artifact.
+    '''
+    cache = TrialCache()
+    cache.update(cached or {})
+    expected = n_trials * (1.5 if strategy == 'Successive Halving' else 1)
+    trials = []
+    job.progress(0.0, 'Starting the search', trials=trials)
+    trial_search = search(X_train, y_train, context, models, strategy, n_trials, cv, scoring, time_budget, patience,
+                          max_workers=jobs.WORKERS_PER_JOB, cache=cache)
+    for trial in trial_search:
+        trials.append(trial)
+        job.progress(min(len(trials) / expected, 1.0) * 0.95, f'{len(trials)} trials finished', trials=trials)
+    finished = [trial for trial in trials if 'error' not in trial]
+    best, test_score = None, None
+    if finished:
+        best = max(finished, key=lambda trial: (trial['n_samples'], trial['score']))
+        job.progress(0.95, f"Refitting {best['model']} on the training split", trials=trials)
+        estimator, test_score = evaluate(X_train, y_train, X_test, y_test, context, best['model'], best['params'], scoring, cache=cache)
+        job.save_artifact('model', estimator)
+    return {
+        'trials': trials,
+        'best': best,
+        'test_score': test_score,
+        'scoring': scoring,
+        'cache': {key: trial for key, trial in cache.entries(context).items() if 'estimator' not in trial},
+    }
+
+
+def trials_table(trials):
+    import pandas as pd
+    return pd.DataFrame([{
+        'Model': trial['model'],
+        'Parameters': json.dumps(trial['params']),
+        'Rows': trial['n_samples'],
+        'CV Score': trial['score'],
+        'Std': trial['std'],
+        'Fit Time (s)': trial['fit_time'],
+        'Cached': trial['cached'],
+        'Error': trial.get('error', ''),
+    } for trial in trials])
@@ -0,0 +1,270 @@
+import importlib
+import threading
+
+import pandas as pd
+import streamlit as st
+
+from core import encode, engine, history, jobs, pipeline, registry, sampling, telemetry
+from core.optimize import format_bytes, rss_bytes
+
+PAGE_STYLE = '''
+    <style>
+        .block-container {
+            max-width: 80%;
+            padding-top: 4.5rem;
+        }
+    </style>
+    '''
+# Imported by the pages on first use, they take over a second to load together
+PRELOAD_MODULES = ['sklearn.model_selection', 'sklearn.metrics', 'sklearn.linear_model', 'sklearn.ensemble',
+                   'sklearn.impute', 'scipy.sparse', 'altair']
+
+
+def page_style():
+    '''Layout shared by every page, injected by App.py on each rerun.'''
+    st.markdown(PAGE_STYLE, unsafe_allow_html=True)
+
+
+def _import_all(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+@st.cache_resource(show_spinner=False)
+def preload_modules():
+    '''Import PRELOAD_MODULES in a background thread, once per process, so the first model or chart does not wait for them.'''
+    thread = threading.Thread(target=_import_all, args=(PRELOAD_MODULES,), name='datalyze-preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def history_panel():
+    '''Undo/redo controls and the list of steps applied to the current dataset.'''
+    dataset_history = history.get_history()
+    if dataset_history is None:
+        return
+    st.subheader('Dataset History')
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button('Undo', key='history_undo', disabled=not dataset_history.can_undo(), use_container_width=True):
+            history.undo()
+            st.rerun()
+    with col2:
+        if st.button('Redo', key='history_redo', disabled=not dataset_history.can_redo(), use_container_width=True):
+            history.redo()
+            st.rerun()
+    for index, version in enumerate(dataset_history.versions):
+        step = f'{dataset_history.dropped + index + 1}. {version.label}'
+        if index == dataset_history.position:
+            st.markdown(f'**{step}** ⬅️')
+        elif index > dataset_history.position: # Undone steps that can still be redone
+            st.caption(f'~~{step}~~')
+        else:
+            st.markdown(step)
+    st.caption(f'{len(dataset_history.versions)} versions kept, '
+               f'{format_bytes(dataset_history.disk_usage())} of {format_bytes(dataset_history.max_bytes)} on disk')
+    if dataset_history.sampling is not None:
+        sampling_panel(dataset_history)
+    st.selectbox('Compute backend', list(engine.BACKENDS), key='compute_backend',
+                 help='Runs the recorded steps when their data is first needed. pandas is the reference implementation.')
+    exported = pipeline.dumps(dataset_history.current.steps, pipeline.dtypes_of(dataset_history.uploaded.schema))
+    st.download_button('Export Pipeline', exported, file_name='pipeline.json',
+                       mime='application/json', key='history_export', use_container_width=True,
+                       help='Replay on a full-size file with `python -m core.pipeline pipeline.json input.csv output.csv`')
+
+
+def sampling_panel(dataset_history):
+    '''Replay the steps applied to the sample on the full dataset in a background job, then switch to its result.'''
+    st.info(f'Sampling mode: working on a {sampling.describe(dataset_history.sampling)}.')
+    state = job_status('sampling_job')
+    if state is not None and state['status'] == 'done':
+        result = jobs.get_scheduler().load_artifact(state['id'])
+        detach_job('sampling_job')
+        if history.apply_to_full(result['df'], result['steps']):
+            st.toast(f"Applied {len(result['steps'])} steps to all {len(result['df']):,} rows")
+            st.rerun()
+        st.warning('The steps changed while the full dataset was processed, apply them again.')
+    elif state is None or state['status'] not in jobs.ACTIVE:
+        steps = list(dataset_history.current.steps)
+        if st.button('Apply to Full Dataset', key='sampling_apply', disabled=not steps, use_container_width=True,
+                     help='Replays the steps of the current dataset on every row in the background, then leaves sampling mode.'):
+            job_id = jobs.get_scheduler().submit(sampling.replay_job, dataset_history.uploaded.df, steps,
+                                                 kind='sampling', label=f'Apply {len(steps)} steps to the full dataset')
+            attach_job('sampling_job', job_id)
+            st.rerun()
+
+
+def telemetry_panel():
+    '''Opt-in timings, memory and profile of the last script runs of this session.'''
+    st.subheader('Performance')
+    st.toggle('Record performance', key='telemetry_enabled',
+              help=f'Times every rerun and dataset operation of this session, spans are also appended to `{telemetry.TELEMETRY_FILE}`.')
+    if not telemetry.enabled():
+        return
+    st.selectbox('Profiler', telemetry.PROFILERS, key='telemetry_profiler', help='Profiles the whole rerun, which makes it slower.')
+    traces = telemetry.traces()
+    if not traces:
+        st.caption('Timings appear after the next interaction.')
+        return
+    last = traces[-1]
+    col1, col2 = st.columns(2)
+    col1.metric('Last rerun', f'{last.root.duration * 1000:.0f} ms', help=last.root.attributes['page'])
+    col2.metric('Process memory', format_bytes(rss_bytes()))
+    st.dataframe(pd.DataFrame(telemetry.spans_table(last)), hide_index=True, use_container_width=True)
+    with st.expander(f'Last {len(traces)} reruns'):
+        st.dataframe(pd.DataFrame([{'Page': trace.root.attributes['page'], 'ms': round(trace.root.duration * 1000, 1),
+                                    'Spans': len(trace.spans) - 1} for trace in reversed(traces)]), hide_index=True, use_container_width=True)
+    if st.session_state.get('telemetry_profile') and st.session_state.get('telemetry_profiler', 'Off') != 'Off':
+        with st.expander('Profile of the last rerun'):
+            st.code(st.session_state['telemetry_profile'], language=None)
+    st.download_button('Export Spans', telemetry.dumps(traces), file_name='spans.json', mime='application/json',
+                       key='telemetry_export', use_container_width=True, help='OpenTelemetry (OTLP/JSON) traces of the reruns above.')
+
+
+PAGE_SIZES = [25, 50, 100, 500]
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def dataset_summary(version_id, _df):
+    '''Dtype table, shape and memory usage of a dataset version, computed once per version.'''
+    return pd.DataFrame(_df.dtypes.astype(str), columns=['Data Type']), _df.shape, int(_df.memory_usage(deep=True).sum())
+
+
+def paged_dataframe(df, key):
+    '''Render one page of rows so only that window is serialized to the browser.'''
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox('Rows per page', PAGE_SIZES, key=f'{key}_page_size')
+    num_pages = max((len(df) - 1) // page_size + 1, 1)
+    with col2:
+        page = st.number_input('Page', min_value=1, max_value=num_pages, value=1, step=1, key=f'{key}_page')
+    with col3:
+        st.write('')
+        st.caption(f'Rows {min((page - 1) * page_size + 1, len(df))}-{min(page * page_size, len(df))} of {len(df)}')
+    window = encode.densify(df.iloc[(page - 1) * page_size:page * page_size])
+    with telemetry.span('st.dataframe', key=key, rows=len(window), columns=len(window.columns)) as attributes:
+        if telemetry.active():
+            attributes['serialized_bytes'] = telemetry.serialized_size(window)
+        st.dataframe(window, use_container_width=True)
+
+
+def export_button(df, key, file_name='dataset.csv'):
+    '''Full-frame serialization only happens when the user explicitly asks for it.'''
+    if st.session_state.get(f'{key}_export_ready'):
+        st.download_button('Download CSV', df.to_csv(index=False), file_name=file_name, mime='text/csv', key=f'{key}_download',
+                           on_click=lambda: st.session_state.pop(f'{key}_export_ready', None))
+    elif st.button('Export CSV', key=f'{key}_export'):
+        st.session_state[f'{key}_export_ready'] = True
+        st.rerun()
+
+
+def display_dataset(df, version_id, key, title=None):
+    '''Paged preview of a dataset version with its dtype table next to it.'''
+    dtypes_df, shape, nbytes = dataset_summary(version_id, df)
+    if title:
+        st.markdown('---')
+        st.subheader(title)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        paged_dataframe(df, key)
+        st.write('Shape:', shape)
+        export_button(df, key)
+    with col2:
+        st.write(dtypes_df, use_container_width=True)
+        st.write(f'**Memory:** {format_bytes(nbytes)}')
+
+
+def display_current_dataset(key='current_dataset'):
+    version = history.get_history().current
+    display_dataset(version.df, version.id, key, 'Current Dataset')
+
+
+def _job_progress(job_id, on_progress=None):
+    state = jobs.get_scheduler().status(job_id)
+    if state is None or state['status'] not in jobs.ACTIVE: # Finished, render the result with the rest of the page
+        st.rerun()
+    st.progress(state['progress'], text=f"{state['label']}: {state['message']}")
+    if on_progress is not None:
+        on_progress(state)
+    if st.button('Cancel', key=f'cancel_{job_id}'):
+        jobs.get_scheduler().cancel(job_id)
+        st.rerun()
+
+
+def job_status(key, interval=1.0, on_progress=None):
+    '''Show the job attached under `key` and return its state, polling only this fragment while it runs.
+
+    The job id is kept in the query string as well as the session, so a browser reload attaches to the same job.
+    `on_progress(state)` is called on every poll to show details reported by the job.
+    '''
+    job_id = st.query_params.get(key) or st.session_state.get(key)
+    state = jobs.get_scheduler().status(job_id) if job_id else None
+    if state is None:
+        return None
+    st.query_params[key] = st.session_state[key] = job_id
+    if state['status'] in jobs.ACTIVE:
+        st.fragment(_job_progress, run_every=interval)(job_id, on_progress)
+    elif state['status'] == 'failed':
+        st.error(f"{state['label']} failed: {state['error']}")
+    elif state['status'] in ('cancelled', 'interrupted'):
+        st.warning(f"{state['label']}: {state['message']}")
+    return state
+
+
+def attach_job(key, job_id):
+    st.query_params[key] = st.session_state[key] = job_id
+
+
+def detach_job(key):
+    st.query_params.pop(key, None)
+    st.session_state.pop(key, None)
+
+
+def save_model_form(key, task, model, load_estimator, version, features, target, params=None, metrics=None):
+    '''Save a trained model to the registry, with the steps leading from the uploaded dataset to `version`, the data it was trained on.
+
+    `load_estimator()` returns the fitted estimator, it is only called when the model is saved.
+    '''
+    col1, col2 = st.columns([3, 1])
+    name = col1.text_input('**Model name**', f'{model} for {target}', key=f'{key}_model_name')
+    with col2:
+        st.write('')
+        st.write('')
+        save = st.button('Save Model', key=f'{key}_save_model', use_container_width=True)
+    if save:
+        schema = registry.input_schema(history.get_history().original.schema)
+        entry = registry.ModelRegistry().save(name, task, model, load_estimator(), features, target, version.steps, schema, params, metrics)
+        st.toast(f"Saved **{entry['name']}** to the model registry")
+
+
+def saved_models(task):
+    '''Saved models for datasets with the columns of the uploaded one, with the command scoring a file with them.'''
+    model_registry = registry.ModelRegistry()
+    entries = model_registry.entries(registry.input_schema(history.get_history().original.schema), task)
+    if not entries:
+        st.info('No model saved for this dataset yet.')
+        return
+    st.dataframe(pd.DataFrame([{
+        'Name': entry['name'],
+        'Model': entry['model'],
+        'Target': entry['target'],
+        'Features': len(entry['features']),
+        'Steps': len(entry['steps']),
+        **entry['metrics'],
+        'Saved': pd.Timestamp(entry['created'], unit='s').strftime('%Y-%m-%d %H:%M'),
+        'ID': entry['id'],
+    } for entry in entries]), use_container_width=True, hide_index=True)
+    names = {entry['id']: entry['name'] for entry in entries}
+    col1, col2 = st.columns([3, 1])
+    model_id = col1.selectbox('**Saved model**', list(names), format_func=names.get, key=f'{task}_saved_model')
+    with col2:
+        st.write('')
+        st.write('')
+        if st.button('Delete Model', key=f'{task}_delete_model', use_container_width=True):
+            model_registry.delete(model_id)
+            st.rerun()
+    st.write('Score a CSV or Parquet file with the columns of the uploaded dataset, in batches over several processes:')
+    st.code(f'python -m core.registry score {model_id} input.csv predictions.csv --workers {registry.SCORE_WORKERS}', language='bash')
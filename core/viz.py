@@ -0,0 +1,106 @@
+'''Server-side aggregation for the Data Visualization page.
+
+Charts never receive the full frame: histograms and 2D densities are binned, line charts
+are downsampled with Largest-Triangle-Three-Buckets and bar charts are grouped. Every
+aggregate is cached per dataset version and column combination.
+'''
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.optimize import is_number
+
+MAX_SCATTER_POINTS = 5000 # Above this, scatter plots switch to a binned density
+MAX_LINE_POINTS = 2000
+MAX_BAR_GROUPS = 30
+
+
+def _finite(values):
+    return values[np.isfinite(values)]
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def histogram(version_id, _df, column, bins):
+    values = _finite(_df[column].to_numpy(dtype='float64', na_value=np.nan))
+    counts, edges = np.histogram(values, bins=bins)
+    return pd.DataFrame({'start': edges[:-1], 'end': edges[1:], 'count': counts})
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def density_2d(version_id, _df, x, y, bins):
+    '''Counts of points per cell of a `bins` x `bins` grid, empty cells left out.'''
+    values = _df[[x, y]].astype('float64').to_numpy()
+    values = values[np.isfinite(values).all(axis=1)]
+    counts, x_edges, y_edges = np.histogram2d(values[:, 0], values[:, 1], bins=bins)
+    x_index, y_index = np.nonzero(counts)
+    return pd.DataFrame({
+        'x_start': x_edges[x_index], 'x_end': x_edges[x_index + 1],
+        'y_start': y_edges[y_index], 'y_end': y_edges[y_index + 1],
+        'count': counts[x_index, y_index].astype('int64'),
+    })
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def scatter_points(version_id, _df, x, y):
+    return _df[[x, y]].dropna()
+
+
+def lttb(x, y, threshold):
+    '''Largest-Triangle-Three-Buckets: keep the point of each bucket forming the largest triangle.'''
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def is_axis(series):
+    '''Whether a line chart can use the column as X: numerical or datetime.'''
+    return is_number(series) or pd.api.types.is_datetime64_any_dtype(series)
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def line_points(version_id, _df, x, y, threshold):
+    '''Points of `y` along a numeric or datetime `x` (the row position when None), downsampled to `threshold` with LTTB.'''
+    data = _df[[y]].copy() if x in (None, y) else _df[[x, y]].copy()
+    if x is None: # Plot against the row position
+        x = 'Row'
+        data[x] = np.arange(len(data))
+    elif not is_axis(data[x]):
+        raise ValueError(f"Feature '{x}' is neither numerical nor a date, it cannot be the X axis of a line chart.")
+    data = data.dropna().sort_values(x)
+    if pd.api.types.is_datetime64_any_dtype(data[x]):
+        x_numeric = data[x].astype('int64').to_numpy(dtype='float64')
+    else:
+        x_numeric = data[x].to_numpy(dtype='float64')
+    selected = lttb(x_numeric, data[y].to_numpy(dtype='float64'), threshold)
+    return data.iloc[selected][list(dict.fromkeys([x, y]))]
+
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def grouped_bars(version_id, _df, category, value, aggregation, max_groups=MAX_BAR_GROUPS):
+    '''Aggregate `value` per category (or count rows), keeping the largest groups and folding the rest into "Other".'''
+    grouped = _df.groupby(category, observed=True, dropna=False)
+    result = grouped.size() if value is None else grouped[value].agg(aggregation)
+    result = result.rename('value').reset_index()
+    result[category] = result[category].astype(str)
+    if len(result) > max_groups:
+        result = result.sort_values('value', ascending=False)
+        top, rest = result.iloc[:max_groups - 1], result.iloc[max_groups - 1:]
+        if value is None or aggregation in ['sum', 'count']:
+            other = rest['value'].sum()
+        else: # Recompute the aggregate over all folded groups
+            other = _df.loc[~_df[category].astype(str).isin(top[category]), value].agg(aggregation)
+        result = pd.concat([top, pd.DataFrame({category: ['Other'], 'value': [other]})], ignore_index=True)
+    return result
@@ -1,20 +1,84 @@
 import streamlit as st
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+import altair as alt
+import pandas as pd
+from core import eda, history
 
 # Page Header 
 st.title('EDA Automation')
-st.write('This is the EDA Automation page.')
+st.write('''
+         Get an automatic overview of your dataset: summary statistics, distributions, most frequent values and correlations for every feature.
+         Large features are profiled with fast approximate sketches, switch to **Exact** mode when you need exact numbers.
+         ''')
 
 if 'dataset_final' not in st.session_state: # Ensure that the dataset has been uploaded
     st.warning('No dataset found. Please upload a dataset on the Home page first.')
 else: # Main Code Start From Here
-    st.warning('This page is under development. Please check back later.')
\ No newline at end of file
+    version = history.get_history().current
+    df = version.df
+    profile = history.profile()
+
+    # Dataset Overview
+    st.subheader('Dataset Overview')
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric('Rows', f'{profile.num_rows:,}')
+    col2.metric('Features', profile.num_columns)
+    col3.metric('Missing Values', f'{profile.total_missing:,}')
+    col4.metric('Duplicate Rows', f'{profile.num_duplicates:,}')
+    mode = st.radio('**Computation Mode**', ['Auto', 'Exact', 'Approximate'], horizontal=True,
+                    help=f'Auto uses approximate distinct counts and quantiles for features with at least {eda.APPROX_MIN_ROWS:,} rows.').lower()
+    results = eda.get_eda_cache().get(version.id, mode)
+
+    # Column Summary, filled in as the features finish
+    st.subheader('Feature Summary')
+    summary_placeholder = st.empty()
+    if len(results['columns']) < len(df.columns):
+        progress_bar = st.progress(0.0, text='Profiling features...')
+        for column, summary in eda.profile_columns(df, mode, skip=set(results['columns'])):
+            results['columns'][column] = summary
+            summary_placeholder.dataframe(eda.summary_table(results['columns'], df.columns), use_container_width=True)
+            progress_bar.progress(len(results['columns']) / len(df.columns), text=f'Profiled {len(results["columns"])}/{len(df.columns)} features')
+        progress_bar.empty()
+    summary_placeholder.dataframe(eda.summary_table(results['columns'], df.columns), use_container_width=True)
+
+    # Feature Details
+    st.subheader('Feature Details')
+    column = st.selectbox('**Select a feature**', df.columns)
+    summary = results['columns'][column]
+    col1, col2 = st.columns([2, 1])
+    if summary.get('histogram') is not None:
+        counts, edges = summary['histogram']
+        histogram_df = pd.DataFrame({'start': edges[:-1], 'end': edges[1:], 'count': counts})
+        with col1:
+            st.altair_chart(alt.Chart(histogram_df).mark_bar().encode(
+                x=alt.X('start:Q', bin='binned', title=str(column)), x2='end:Q', y=alt.Y('count:Q', title='Count'),
+            ), use_container_width=True)
+        with col2:
+            quantiles_df = pd.DataFrame({'Value': summary['quantiles'].values()}, index=[f'{q:.0%}' for q in summary['quantiles']])
+            st.write(quantiles_df, use_container_width=True)
+    elif summary.get('top_values'):
+        top_df = pd.DataFrame(summary['top_values'], columns=['Value', 'Count'])
+        top_df['Value'] = top_df['Value'].astype(str)
+        with col1:
+            st.altair_chart(alt.Chart(top_df).mark_bar().encode(
+                x=alt.X('Count:Q'), y=alt.Y('Value:N', sort='-x', title=str(column)),
+            ), use_container_width=True)
+        with col2:
+            st.write(top_df, use_container_width=True)
+    if summary['approximate']:
+        st.caption('Distinct count and quantiles are approximate (HyperLogLog / t-digest).')
+
+    # Correlation Matrix
+    st.subheader('Correlation Matrix')
+    if results['correlation'] is None:
+        with st.spinner('Computing correlations...'):
+            results['correlation'] = eda.correlation_matrix(df, mode)
+    correlation = results['correlation']
+    if correlation.shape[1] < 2:
+        st.warning('At least two numerical features are needed for a correlation matrix.')
+    else:
+        correlation_df = correlation.rename_axis('Feature 1').reset_index().melt(id_vars='Feature 1', var_name='Feature 2', value_name='Correlation')
+        st.altair_chart(alt.Chart(correlation_df).mark_rect().encode(
+            x='Feature 1:N', y='Feature 2:N',
+            color=alt.Color('Correlation:Q', scale=alt.Scale(scheme='redblue', domain=[-1, 1], reverse=True)),
+            tooltip=['Feature 1', 'Feature 2', alt.Tooltip('Correlation:Q', format='.2f')],
+        ), use_container_width=True)
\ No newline at end of file
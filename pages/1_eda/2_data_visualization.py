@@ -1,20 +1,82 @@
 import streamlit as st
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+import altair as alt
+from core import history, viz
+from core.optimize import is_number
 
 # Page Header 
 st.title('Data Visualization')
-st.write('This is the Data Visualization page.')
+st.write('''
+         Explore your dataset visually with histograms, scatter plots, line charts and bar charts.
+         Large datasets are aggregated before plotting, so charts stay responsive no matter how many rows you have.
+         ''')
 
 if 'dataset_final' not in st.session_state: # Ensure that the dataset has been uploaded
     st.warning('No dataset found. Please upload a dataset on the Home page first.')
 else: # Main Code Start From Here
-    st.warning('This page is under development. Please check back later.')
\ No newline at end of file
+    version = history.get_history().current
+    df = version.df
+    numeric_features = [column for column in df.columns if is_number(df[column])]
+    categorical_features = [column for column in df.columns if column not in numeric_features]
+
+    chart_type = st.selectbox('**Select chart type**', ['Histogram', 'Scatter Plot', 'Line Chart', 'Bar Chart'])
+    if chart_type in ['Histogram', 'Scatter Plot', 'Line Chart'] and not numeric_features:
+        st.warning('No numerical features available for this chart type.')
+
+    # Histogram
+    elif chart_type == 'Histogram':
+        col1, col2 = st.columns(2)
+        feature = col1.selectbox('**Select a numerical feature**', numeric_features)
+        bins = col2.slider('**Number of bins**', min_value=5, max_value=200, value=30)
+        histogram_df = viz.histogram(version.id, df, feature, bins)
+        st.altair_chart(alt.Chart(histogram_df).mark_bar().encode(
+            x=alt.X('start:Q', bin='binned', title=str(feature)), x2='end:Q', y=alt.Y('count:Q', title='Count'),
+            tooltip=[alt.Tooltip('start:Q', title='From'), alt.Tooltip('end:Q', title='To'), alt.Tooltip('count:Q', title='Count')],
+        ), use_container_width=True)
+
+    # Scatter Plot
+    elif chart_type == 'Scatter Plot':
+        col1, col2, col3 = st.columns(3)
+        x = col1.selectbox('**Select X feature**', numeric_features)
+        y = col2.selectbox('**Select Y feature**', numeric_features, index=min(1, len(numeric_features) - 1))
+        if len(df) <= viz.MAX_SCATTER_POINTS:
+            points_df = viz.scatter_points(version.id, df, x, y)
+            st.altair_chart(alt.Chart(points_df).mark_circle(opacity=0.6).encode(
+                x=alt.X(field=str(x), type='quantitative', scale=alt.Scale(zero=False)), y=alt.Y(field=str(y), type='quantitative', scale=alt.Scale(zero=False)),
+            ), use_container_width=True)
+        else:
+            bins = col3.slider('**Grid size**', min_value=10, max_value=150, value=60)
+            density_df = viz.density_2d(version.id, df, x, y, bins)
+            st.altair_chart(alt.Chart(density_df).mark_rect().encode(
+                x=alt.X('x_start:Q', bin='binned', title=str(x)), x2='x_end:Q',
+                y=alt.Y('y_start:Q', bin='binned', title=str(y)), y2='y_end:Q',
+                color=alt.Color('count:Q', scale=alt.Scale(type='log', scheme='viridis'), title='Count'),
+                tooltip=[alt.Tooltip('count:Q', title='Count')],
+            ), use_container_width=True)
+            st.caption(f'{len(df):,} points are shown as a density grid.')
+
+    # Line Chart
+    elif chart_type == 'Line Chart':
+        col1, col2 = st.columns(2)
+        x = col1.selectbox('**Select X feature**', ['Row Order'] + [column for column in df.columns if viz.is_axis(df[column])],
+                           help='Numerical and date features, or the order of the rows.')
+        y = col2.selectbox('**Select Y feature**', numeric_features)
+        points_df = viz.line_points(version.id, df, None if x == 'Row Order' else x, y, viz.MAX_LINE_POINTS)
+        x_field = points_df.columns[0]
+        st.altair_chart(alt.Chart(points_df).mark_line().encode(
+            x=alt.X(field=str(x_field), type='temporal' if str(points_df[x_field].dtype).startswith('datetime') else 'quantitative'),
+            y=alt.Y(field=str(y), type='quantitative', scale=alt.Scale(zero=False)),
+        ), use_container_width=True)
+        if len(points_df) < len(df):
+            st.caption(f'{len(df):,} points downsampled to {len(points_df):,} with LTTB.')
+
+    # Bar Chart
+    elif chart_type == 'Bar Chart':
+        col1, col2, col3 = st.columns(3)
+        category = col1.selectbox('**Select a categorical feature**', categorical_features + numeric_features)
+        value = col2.selectbox('**Select value**', ['Count'] + numeric_features)
+        aggregation = col3.selectbox('**Select aggregation**', ['mean', 'sum', 'median', 'min', 'max'], disabled=value == 'Count')
+        bars_df = viz.grouped_bars(version.id, df, category, None if value == 'Count' else value, aggregation)
+        st.altair_chart(alt.Chart(bars_df).mark_bar().encode(
+            x=alt.X('value:Q', title='Count' if value == 'Count' else f'{aggregation} of {value}'),
+            y=alt.Y(field=str(category), type='nominal', sort='-x'),
+        ), use_container_width=True)
\ No newline at end of file
@@ -1,15 +1,7 @@
 import streamlit as st
-import pandas as pd
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+from core import dedupe, history, impute, pipeline
+from core.optimize import is_boolean, is_number
+from core.ui import display_current_dataset, paged_dataframe
 
 # Page Header 
 st.title('Data Cleaning')
@@ -21,20 +13,10 @@ st.write('''
 if 'dataset_final' not in st.session_state: # Ensure that the dataset has been uploaded
     st.warning('No dataset found. Please upload a dataset on the Home page first.')
 else: # Main Code Start From Here
-    df = st.session_state['dataset_final'].copy()
+    df = history.checkout()
+    profile = history.profile()
     tab1, tab2, tab3 = st.tabs(['Change Data Type', 'Remove Duplicate Data', 'Missing Value Handler'])
     
-    # Display Current Dataset Function
-    def display_current_dataset(df):
-        st.markdown('---')
-        st.subheader('Current Dataset')
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.dataframe(df, use_container_width=True)
-            st.write('Shape:', df.shape)
-        with col2:
-            st.write(pd.DataFrame(df.dtypes, columns=['Data Type']), use_container_width=True)
-    
     # Change Data Type
     with tab1:
         st.subheader('Change Data Type')
@@ -48,18 +30,12 @@ else: # Main Code Start From Here
             new_dtype = st.selectbox('**Select new data type**', options=['int64', 'float64', 'object', 'boolean'])
             if st.button('Change Data Type'):
                 success = True
+                steps = []
                 for column in features_to_change:
                     try:
-                        if new_dtype == 'boolean':
-                            unique_values = df[column].dropna().unique()
-                            if len(unique_values) != 2:
-                                raise ValueError(f'Feature \'{column}\' does not have exactly 2 unique values.')
-                        if new_dtype == 'boolean':
-                            unique_values = df[column].dropna().unique()
-                            mapping = {unique_values[0]: False, unique_values[1]: True}
-                            df[column] = df[column].map(mapping)
-                        else:
-                            df[column] = df[column].astype(new_dtype)
+                        step = pipeline.astype_step(df, [column], new_dtype)
+                        df = pipeline.apply_step(df, step)
+                        steps.append(step)
                     except Exception as e:
                         if 'could not convert string to float' in str(e):
                             st.error(f'Data type cannot be changed for feature \'{column}\'. It contains non-numeric characters.')
@@ -67,12 +43,11 @@ else: # Main Code Start From Here
                             st.error(f'Data type cannot be changed for feature \'{column}\'. Error: {e}')
                         success = False
                 if success:
-                    st.session_state['dataset_final'] = df
+                    st.session_state.setdefault('pinned_dtypes', set()).update(features_to_change) # Keep the chosen dtype as is
+                    history.commit(df, f"Change data type of {', '.join(features_to_change)} to {new_dtype}", steps)
                     st.rerun()
         else:
             st.warning('Please select features to change data type')
-            
-        display_current_dataset(df)
     
     # Remove Duplicate Data
     with tab2:
@@ -82,21 +57,56 @@ else: # Main Code Start From Here
                  The duplicate data will be displayed below, and you can choose to delete them.
                  ''')
         
-        duplicates = df[df.duplicated()]
-        num_duplicates = duplicates.shape[0]
-        percent_duplicates = (num_duplicates / df.shape[0]) * 100
-        st.write(f'**Number of duplicate data: {num_duplicates}/{df.shape[0]} ({percent_duplicates:.2f}%)**')
-        st.dataframe(duplicates, use_container_width=True)
-        if not duplicates.empty:
-            if st.button('Delete Duplicate Data'):
-                df = df.drop_duplicates()
-                df.reset_index(drop=True, inplace=True)
-                st.session_state['dataset_final'] = df
-                st.rerun()
+        mode = st.radio('**Detection**', ['Exact duplicates', 'Near-duplicate text'], horizontal=True,
+                        help='Near-duplicate text finds rows whose text differs only slightly, e.g. in case, spacing or a few characters.')
+        if mode == 'Exact duplicates':
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                key_columns = st.multiselect('**Compare rows on**', df.columns, help='Leave empty to compare all features.')
+            with col2:
+                keep = dedupe.KEEP_OPTIONS[st.selectbox('**Keep**', list(dedupe.KEEP_OPTIONS), help='Which copy of each duplicated row is kept.')]
+            result = dedupe.report(st.session_state['dataset_final'], df, tuple(key_columns) or None, keep, profile.column_hashes)
+            num_duplicates = result['num_duplicates']
+            percent_duplicates = (num_duplicates / df.shape[0]) * 100
+            st.write(f"**Number of duplicate data: {num_duplicates}/{df.shape[0]} ({percent_duplicates:.2f}%) in {result['num_groups']} groups**")
+            if num_duplicates:
+                st.caption(f"Rows of {result['preview']['Group'].nunique()} randomly chosen groups of duplicates")
+                paged_dataframe(result['preview'], 'duplicates')
+                if st.button('Delete Duplicate Data'):
+                    step = {'op': 'drop_duplicates'}
+                    if key_columns:
+                        step['subset'] = list(key_columns)
+                    if keep != 'first':
+                        step['keep'] = keep
+                    try:
+                        history.record('Remove duplicate data' + (f" on {', '.join(key_columns)}" if key_columns else ''), [step])
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        st.rerun()
+            else:
+                st.success('No duplicate data found')
         else:
-            st.success('No duplicate data found')
-            
-        display_current_dataset(df)
+            text_features = [column for column in df.columns if not is_number(df[column]) and not is_boolean(df[column])]
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                near_columns = st.multiselect('**Text features to compare**', text_features, text_features)
+            with col2:
+                threshold = st.slider('**Similarity**', min_value=0.5, max_value=0.95, value=dedupe.NEAR_THRESHOLD, step=0.05,
+                                      help='Minimum estimated Jaccard similarity of the character trigrams of two rows.')
+            settings = (st.session_state['dataset_final'], tuple(near_columns), threshold)
+            if st.button('Find Near Duplicates', disabled=not near_columns):
+                st.session_state['near_duplicates'] = settings
+            if st.session_state.get('near_duplicates') == settings:
+                with st.spinner('Comparing texts...'):
+                    result = dedupe.near_report(st.session_state['dataset_final'], df, tuple(near_columns), threshold)
+                st.write(f"**Number of near duplicate data: {result['num_duplicates']}/{df.shape[0]} in {result['num_groups']} groups**")
+                if result['num_duplicates']:
+                    st.caption(f"Rows of {result['preview']['Group'].nunique()} randomly chosen groups, the first row of each group is kept")
+                    paged_dataframe(result['preview'], 'near_duplicates')
+                    st.info('Near duplicates are reported for review. Correct the values, or remove exact duplicates on a subset of features.')
+                else:
+                    st.success('No near duplicates found')
     
     # Missing Value Handler
     with tab3:
@@ -106,34 +116,49 @@ else: # Main Code Start From Here
                 The missing data will be displayed below, and you can choose the solution method to handle them.
                 ''')
         
-        null_data = df[df.isnull().any(axis=1)]
-        num_null = null_data.shape[0]
+        null_data = df[profile.rows_with_nulls]
+        num_null = profile.num_rows_with_nulls
         percent_null = (num_null / df.shape[0]) * 100
-        missing_data = df.isnull().sum()
-        total_missing = missing_data.sum()
+        missing_data = profile.null_counts
+        total_missing = profile.total_missing
         percent_missing = (total_missing / df.size) * 100
         st.write(f'**Number of missing value: {total_missing}/{df.shape[0]} ({percent_missing:.2f}%)**')
-        st.dataframe(null_data, use_container_width=True)
+        paged_dataframe(null_data, 'null_data')
         if not null_data.empty:
-            solution_method = st.selectbox('**Select Solution Method**', ['Delete', 'Fill with Mean Value (integer & float data type)', 'Fill with Most Frequent Value'])
-            if solution_method == 'Fill with Most Frequent Value':
-                data_type_option = st.radio('**Select Data Type to Apply**', ['Integer & Float', 'Boolean', 'All of above'])
+            solution_method = st.selectbox('**Select Solution Method**', ['Delete', 'Fill with Mean Value (integer & float data type)', 'Fill with Median Value (integer & float data type)',
+                                                                         'Fill with Most Frequent Value', 'Fill with Group Statistic', 'KNN Imputation (integer & float data type)',
+                                                                         'Iterative Imputation (integer & float data type)'])
+            if solution_method == 'Fill with Group Statistic':
+                col1, col2 = st.columns(2)
+                group_by = col1.selectbox('**Group by**', [column for column in df.columns if profile.nunique[column] <= 1000],
+                                          help='Only features with at most 1000 unique values can be used as groups.')
+                group_strategy = col2.selectbox('**Statistic**', ['mean', 'median', 'mode'])
+            if solution_method == 'Fill with Most Frequent Value' or solution_method == 'Fill with Group Statistic' and group_strategy == 'mode':
+                data_type_option = st.radio('**Select Data Type to Apply**', list(impute.COLUMN_KINDS))
+            if solution_method.startswith(('KNN', 'Iterative')):
+                st.info('The imputer is fitted on a sample of the rows and only fills features with integer & float data type.')
             if st.button('Start Action'):
                 if solution_method == 'Delete':
-                    df = df.dropna()
+                    step = {'op': 'dropna'}
                 elif solution_method == 'Fill with Mean Value (integer & float data type)':
-                    df = df.apply(lambda x: x.fillna(x.mean()) if x.dtype in ['int64', 'float64'] else x, axis=0)
+                    step = pipeline.fillna_step(df, 'mean')
+                elif solution_method == 'Fill with Median Value (integer & float data type)':
+                    step = pipeline.fillna_step(df, 'median')
                 elif solution_method == 'Fill with Most Frequent Value':
-                    if data_type_option == 'Integer & Float':
-                        df = df.apply(lambda x: x.fillna(x.mode()[0]) if x.dtype in ['int64', 'float64'] else x, axis=0)
-                    elif data_type_option == 'Boolean':
-                        df = df.apply(lambda x: x.fillna(x.mode()[0]) if x.dtype == 'bool' else x, axis=0)
-                    elif data_type_option == 'All of above':
-                        df = df.apply(lambda x: x.fillna(x.mode()[0]) if x.dtype in ['int64', 'float64', 'bool'] else x, axis=0)
-                df.reset_index(drop=True, inplace=True)
-                st.session_state['dataset_final'] = df
-                st.rerun()
+                    step = pipeline.fillna_step(df, 'mode', data_type_option)
+                elif solution_method == 'Fill with Group Statistic':
+                    step = pipeline.fillna_group_step(df, group_by, group_strategy, data_type_option if group_strategy == 'mode' else 'Integer & Float')
+                else:
+                    with st.spinner('Fitting imputer...'):
+                        step = pipeline.impute_step(df, 'knn' if solution_method.startswith('KNN') else 'iterative')
+                try:
+                    history.record(f'Missing values: {solution_method}', [step])
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.rerun()
         else:
             st.success('No missing value found')
-            
-        display_current_dataset(df)
+
+    # Display Current Dataset
+    display_current_dataset()
\ No newline at end of file
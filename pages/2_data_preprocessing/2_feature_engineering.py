@@ -1,15 +1,8 @@
 import streamlit as st
 import pandas as pd
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+from core import encode, expressions, history, pipeline
+from core.optimize import format_bytes, is_boolean, is_number
+from core.ui import display_current_dataset
 
 # Page Header 
 st.title('Feature Engineering')
@@ -20,22 +13,11 @@ st.write('''
 
 if 'dataset_final' not in st.session_state: # Ensure that the dataset has been uploaded
     st.warning('No dataset found. Please upload a dataset on the Home page first.')
-elif st.session_state['dataset_final'].isnull().sum().sum() > 0: # Ensure that the dataset does not contain missing values
+elif history.profile().total_missing > 0: # Ensure that the dataset does not contain missing values
     st.warning('The dataset contains missing values. Please handle missing values on the Data Cleaning page first.')
 else: # Main Code Start From Here
-    df = st.session_state['dataset_final'].copy()
-    tab1, tab2, tab3, tab4 = st.tabs(['Add Feature', 'Remove Feature', 'Rename Feature', 'One-Hot Encoding'])
-    
-    # Display Current Dataset Function
-    def display_current_dataset(df):
-        st.markdown('---')
-        st.subheader('Current Dataset')
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.dataframe(df, use_container_width=True)
-            st.write('Shape:', df.shape)
-        with col2:
-            st.write(pd.DataFrame(df.dtypes, columns=['Data Type']), use_container_width=True)
+    df = history.checkout()
+    tab1, tab2, tab3, tab4 = st.tabs(['Add Feature', 'Remove Feature', 'Rename Feature', 'Categorical Encoding'])
                 
     # Add Feature
     with tab1:
@@ -45,8 +27,30 @@ else: # Main Code Start From Here
                  Select the type of operation to proceed.
                  ''')
         
-        operation_type = st.selectbox('**Select operation type**', ['None', 'Basic Mathematical Operation', 'Polynomial'])
-        if operation_type == 'Basic Mathematical Operation':
+        operation_type = st.selectbox('**Select operation type**', ['None', 'Formula', 'Basic Mathematical Operation', 'Polynomial'])
+        if operation_type == 'Formula':
+            formulas_text = st.text_area('**Enter one new feature per line**', placeholder='volume = x * y * z\nratio = carat * depth / table',
+                                         help=f"Use numerical features, numbers, + - * / // % ** and the functions {', '.join(expressions.FUNCTIONS)}. "
+                                              'Quote feature names with spaces in backticks, and later lines can use the features defined above them.')
+            zero_division = st.radio('**Result of a division by zero (or another invalid operation)**', list(expressions.ZERO_DIVISION), horizontal=True)
+            if st.button('Add Features'):
+                try:
+                    formulas = expressions.parse(formulas_text)
+                    if not formulas:
+                        raise ValueError('Please enter at least one formula.')
+                    expressions.validate(df, formulas)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    step = {'op': 'expression', 'features': formulas, 'on_zero_division': expressions.ZERO_DIVISION[zero_division]}
+                    names = ', '.join(f"'{name}'" for name, _ in formulas)
+                    try:
+                        history.record(f'Add features {names}', [step])
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        st.rerun()
+        elif operation_type == 'Basic Mathematical Operation':
             new_feature_name = st.text_input('**Enter the name for the new feature**')
             features = st.multiselect('**Select two numerical features**', df.columns)
             if len(features) == 2:
@@ -58,19 +62,14 @@ else: # Main Code Start From Here
                         if not new_feature_name:
                             st.error('Please enter a name for the new feature.')
                         else:
-                            new_feature = None
-                            if operation == 'Addition':
-                                new_feature = df[features[0]] + df[features[1]]
-                            elif operation == 'Subtraction':
-                                new_feature = df[features[0]] - df[features[1]]
-                            elif operation == 'Multiplication':
-                                new_feature = df[features[0]] * df[features[1]]
-                            elif operation == 'Division':
-                                new_feature = df[features[0]] / df[features[1]]
-                            df[new_feature_name] = new_feature
-                            st.success(f"New feature '{new_feature_name}' added to the dataset")
-                            st.session_state['dataset_final'] = df
-                            st.rerun()
+                            step = {'op': 'arithmetic', 'name': new_feature_name, 'left': features[0], 'right': features[1], 'operation': operation}
+                            try:
+                                history.record(f"Add feature '{new_feature_name}'", [step])
+                            except ValueError as e:
+                                st.error(str(e))
+                            else:
+                                st.success(f"New feature '{new_feature_name}' added to the dataset")
+                                st.rerun()
             elif len(features) > 2:
                 st.error('Please select only two features.')
             else:
@@ -87,16 +86,17 @@ else: # Main Code Start From Here
                         if not new_feature_name:
                             st.error('Please enter a name for the new feature.')
                         else:
-                            new_feature = df[feature] ** degree
-                            df[new_feature_name] = new_feature
-                            st.success(f"New feature '{new_feature_name}' added to the dataset")
-                            st.session_state['dataset_final'] = df
-                            st.rerun()
+                            step = {'op': 'power', 'name': new_feature_name, 'column': feature, 'degree': int(degree)}
+                            try:
+                                history.record(f"Add feature '{new_feature_name}'", [step])
+                            except ValueError as e:
+                                st.error(str(e))
+                            else:
+                                st.success(f"New feature '{new_feature_name}' added to the dataset")
+                                st.rerun()
         else:
             st.warning('Please select an operation type to add a new feature')
             
-        display_current_dataset(df)
-            
     # Remove Feature
     with tab2:
         st.subheader('Remove Feature')
@@ -110,12 +110,14 @@ else: # Main Code Start From Here
             if not features_to_remove:
                 st.warning('Please select features to remove')
             else:
-                df.drop(columns=features_to_remove, inplace=True)
-                st.success('Selected features removed from the dataset')
-                st.session_state['dataset_final'] = df
-                st.rerun()
-                
-        display_current_dataset(df)
+                step = {'op': 'drop', 'columns': features_to_remove}
+                try:
+                    history.record(f"Remove {', '.join(features_to_remove)}", [step])
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success('Selected features removed from the dataset')
+                    st.rerun()
             
     # Rename Feature
     with tab3:
@@ -132,34 +134,63 @@ else: # Main Code Start From Here
                 st.warning('Please select a feature to rename')
             elif not new_feature_name:
                 st.warning('Please enter a new name for the feature')
+            elif new_feature_name in df.columns:
+                st.warning(f"A feature named '{new_feature_name}' already exists, please enter another name")
             else:
-                df.rename(columns={feature_to_rename: new_feature_name}, inplace=True)
-                st.success(f"Feature '{feature_to_rename}' renamed to '{new_feature_name}'")
-                st.session_state['dataset_final'] = df
-                st.rerun()
-                
-        display_current_dataset(df)
+                step = {'op': 'rename', 'columns': {feature_to_rename: new_feature_name}}
+                try:
+                    history.record(f"Rename '{feature_to_rename}' to '{new_feature_name}'", [step])
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success(f"Feature '{feature_to_rename}' renamed to '{new_feature_name}'")
+                    st.rerun()
     
-    # One-Hot Encoding
+    # Categorical Encoding
     with tab4:
-        st.subheader('One-Hot Encoding')
+        st.subheader('Categorical Encoding')
         st.write('''
-                 This section allows you to convert categorical features to numerical features using one-hot encoding.
-                 Select categorical features to encode and click the 'One-Hot Encode' button to convert the features.
+                 This section allows you to convert categorical features to numerical features.
+                 One-hot encoding creates a column per category, sparse one-hot columns only store the ones and are much smaller.
+                 For features with many categories, ordinal codes, target encoding and feature hashing keep the number of columns small.
                  ''')
-        
-        categorical_features = df.select_dtypes(include=['number', 'object']).loc[:, df.nunique() <= 10].loc[:, df.nunique() > 2]
-        categorical_features = categorical_features.loc[:, ~categorical_features.apply(pd.api.types.is_bool_dtype)].columns
+
+        nunique = history.profile().nunique
+        categorical_features = encode.candidate_columns(df, nunique)
         if len(categorical_features) == 0:
-            st.warning('No categorical features available for one-hot encoding. Ensure there are features with unique values between 3 and 10.')
+            st.warning('No categorical features available for encoding.')
         else:
-            features_to_encode = st.multiselect('**Select categorical features to encode**', categorical_features)
-            if st.button('One-Hot Encode'):
+            features_to_encode = st.multiselect('**Select categorical features to encode**', categorical_features,
+                                                format_func=lambda column: f'{column} ({nunique[column]} unique values)')
+            encoding_label = st.selectbox('**Select encoding**', list(encode.ENCODINGS))
+            encoding = encode.ENCODINGS[encoding_label]
+            col1, col2 = st.columns(2)
+            target_options = [column for column in df.columns if (is_number(df[column]) or is_boolean(df[column])) and column not in features_to_encode]
+            target = col1.selectbox('**Target for target encoding**', target_options, disabled=not target_options,
+                                    help='Each category is replaced by the mean of this feature in its rows, shrunk towards the overall mean for rare categories.')
+            n_buckets = col2.number_input('**Hash buckets**', min_value=2, max_value=4096, value=encode.HASH_BUCKETS,
+                                          help='Feature hashing maps every value to one of this many columns.')
+            drop_first = st.checkbox('Drop the first category of one-hot encoded features', value=True)
+            if features_to_encode:
+                # Memory/time comparison of every encoding before applying one
+                with st.spinner('Comparing encodings...'):
+                    comparison = encode.compare_encodings(history.get_history().current.id, df, tuple(features_to_encode), target, n_buckets, drop_first)
+                comparison['Memory'] = comparison['Memory (bytes)'].map(format_bytes)
+                st.write('**Estimated result of each encoding**')
+                st.dataframe(comparison[['Encoding', 'Columns', 'Memory', 'Time (s)']].set_index('Encoding'), use_container_width=True)
+            if st.button('Encode'):
                 if not features_to_encode:
                     st.warning('Please select categorical features to encode')
+                elif encoding == 'target' and target is None:
+                    st.warning('Target encoding needs a numerical or boolean target feature')
                 else:
-                    df = pd.get_dummies(df, columns=features_to_encode, drop_first=True)
-                    st.session_state['dataset_final'] = df
-                    st.rerun()
-                    
-        display_current_dataset(df)
\ No newline at end of file
+                    step = pipeline.encode_step(df, encoding, features_to_encode, target, n_buckets, drop_first)
+                    try:
+                        history.record(f"{encoding_label} encode {', '.join(features_to_encode)}", [step])
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        st.rerun()
+
+    # Display Current Dataset
+    display_current_dataset()
\ No newline at end of file
@@ -1,18 +1,8 @@
 import streamlit as st
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import RobustScaler
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+from core import encode, history, pipeline
+from core.optimize import is_number
+from core.ui import display_current_dataset
 
 # Page Header 
 st.title('Data Normalization')
@@ -23,38 +13,67 @@ st.write('''
 
 if 'dataset_final' not in st.session_state: # Ensure that the dataset has been uploaded
     st.warning('No dataset found. Please upload a dataset on the Home page first.')
-elif st.session_state['dataset_final'].isnull().sum().sum() > 0: # Ensure that the dataset does not contain missing values
+elif history.profile().total_missing > 0: # Ensure that the dataset does not contain missing values
     st.warning('The dataset contains missing values. Please handle missing values on the Data Cleaning page first.')
 else: # Main Code Start From Here
-    df = st.session_state['dataset_final'].copy()
-    
-    # Display Current Dataset Function
-    def display_current_dataset(df):
-        st.markdown('---')
-        st.subheader('Current Dataset')
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.dataframe(df, use_container_width=True)
-            st.write('Shape:', df.shape)
-        with col2:
-            st.write(pd.DataFrame(df.dtypes, columns=['Data Type']), use_container_width=True)
+    df = history.checkout()
     
     st.subheader('Select Normalization Method')
     normalization_method = st.selectbox('**Select normalization method**', ['Min-Max Normalization', 'Z-Score Standardization', 'Robust Scaling'], label_visibility='collapsed')
+    nunique = history.profile().nunique
+    numeric_features = [column for column in df.columns if is_number(df[column]) and not encode.is_sparse(df[column])]
+    features_to_scale = st.multiselect('**Select features to normalize**', numeric_features, [column for column in numeric_features if nunique[column] > 2],
+                                       help='Binary features, such as one-hot encoded columns, are not selected by default.')
     if st.button('Normalize Data'):
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        df_numeric = df[numeric_cols].copy()
-        if normalization_method == 'Min-Max Normalization':
-            scaler = MinMaxScaler()
-            df_numeric[numeric_cols] = scaler.fit_transform(df_numeric[numeric_cols])
-        elif normalization_method == 'Z-Score Standardization':
-            scaler = StandardScaler()
-            df_numeric[numeric_cols] = scaler.fit_transform(df_numeric[numeric_cols])
-        elif normalization_method == 'Robust Scaling':
-            scaler = RobustScaler()
-            df_numeric[numeric_cols] = scaler.fit_transform(df_numeric[numeric_cols])
-        df.update(df_numeric)
-        st.session_state['dataset_final'] = df
-        st.rerun()
+        if not features_to_scale:
+            st.warning('Please select features to normalize')
+        else:
+            step = pipeline.scale_step(df, pipeline.SCALING_METHODS[normalization_method], features_to_scale)
+            try:
+                history.record(normalization_method, [step])
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.rerun()
+
+    # Fitted Scalers
+    st.subheader('Fitted Scalers')
+    st.write('''
+             The parameters learned by every normalization are kept, so the same transformation can be applied to test or production data.
+             Download them, or apply a scaler saved from another dataset without fitting it again.
+             ''')
+    scale_steps = [step for step in history.get_history().current.steps if step['op'] == 'scale']
+    if scale_steps:
+        methods = {method: label for label, method in pipeline.SCALING_METHODS.items()}
+        for index, step in enumerate(scale_steps, start=1):
+            with st.expander(f"{index}. {methods[step['method']]} of {len(step['statistics'])} features"):
+                st.dataframe(pd.DataFrame(step['statistics'], index=['Center', 'Scale']).T, use_container_width=True)
+        st.download_button('Download Scaler', pipeline.dumps(scale_steps), file_name='scaler.json', mime='application/json',
+                           help='Apply it with `python -m core.pipeline scaler.json input.csv output.csv`, or upload it below.')
+    else:
+        st.info('No normalization has been applied to the current dataset yet.')
+    scaler_file = st.file_uploader('**Apply a saved scaler**', type=['json'])
+    if scaler_file:
+        try:
+            steps = pipeline.loads(scaler_file.getvalue().decode('utf-8'))
+            missing = [column for step in steps for column in step.get('statistics', {}) if column not in df.columns]
+            if any(step['op'] != 'scale' for step in steps):
+                raise ValueError('The file contains steps other than normalization.')
+            if missing:
+                raise ValueError(f"Features not found in the dataset: {', '.join(missing)}")
+            not_numeric = [column for step in steps for column in step['statistics'] if not is_number(df[column])]
+            if not_numeric:
+                raise ValueError(f"Features that are not numerical in the dataset: {', '.join(not_numeric)}")
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            if st.button('Apply Scaler'):
+                try:
+                    history.record('Apply saved scaler', steps)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.rerun()
             
-    display_current_dataset(df)
\ No newline at end of file
+    # Display Current Dataset
+    display_current_dataset()
\ No newline at end of file
@@ -1,16 +1,7 @@
 import streamlit as st
 import pandas as pd
-from sklearn.model_selection import train_test_split
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+from core import history, jobs, modeling, tuning
+from core.ui import attach_job, detach_job, display_dataset, job_status, save_model_form, saved_models
 
 # Page Header 
 st.title('Classification Model')
@@ -33,16 +24,9 @@ else: # Main Code Start From Here
     # Data Preparation
     # 1. Select Dataset
     dataset_choice = st.selectbox('**Select Dataset**', ['Current Dataset', 'Raw Dataset'])
-    if dataset_choice == 'Current Dataset':
-        selected_df = st.session_state['dataset_final'].copy()
-    else:
-        selected_df = st.session_state['dataset'].copy()
-    col1, col2 = st.columns([3, 1])
-    with col1:
-        st.dataframe(selected_df, use_container_width=True)
-        st.write('Dataset Shape:', selected_df.shape)
-    with col2:
-        st.write(pd.DataFrame(selected_df.dtypes, columns=['Data Type']), use_container_width=True)
+    selected_version = history.get_history().current if dataset_choice == 'Current Dataset' else history.get_history().original
+    selected_df = selected_version.df
+    display_dataset(selected_df, selected_version.id, 'selected_dataset')
         
     col1, col2 = st.columns(2)
     with col1:
@@ -58,18 +42,24 @@ else: # Main Code Start From Here
     # Apply Changes Button
     st.write('')
     if st.button('Apply Changes', use_container_width=True):
-        processed_df = selected_df.copy()
-        X = processed_df[features]
-        y = processed_df[target]
-        if X.select_dtypes(include=['object', 'datetime']).shape[1] > 0 or y.dtype in ['object', 'datetime']:
+        X = selected_df[features]
+        y = selected_df[target]
+        if X.select_dtypes(include=['object', 'category', 'datetime']).shape[1] > 0 or y.dtype in ['object', 'category', 'datetime']:
             st.error('Selected features contain non-numeric data types. Please select only numeric features.')
         elif X.isnull().sum().sum() > 0 or y.isnull().sum() > 0:
             st.error('Selected features contain missing values. Please handle missing values first.')
         else:
-            X_train, X_test, y_train, y_test = train_test_split(X, y, train_size=train_size, random_state=random_state)
+            st.session_state['classification_split'] = modeling.make_split(selected_version, features, target, train_size, random_state)
+            detach_job('tuning_job')
             st.success('Data has been split successfully!')
-            st.write('Training Set Shape:', X_train.shape, y_train.shape)
-            st.write('Test Set Shape:', X_test.shape, y_test.shape)
+    # Keep showing the applied split across reruns
+    split = st.session_state.get('classification_split')
+    if split is not None:
+        st.write('Training Set Shape:', (len(split['train_index']), len(split['features'])), (len(split['train_index']),))
+        st.write('Test Set Shape:', (len(split['test_index']), len(split['features'])), (len(split['test_index']),))
+        if split['version'] is not selected_version or split['features'] != list(features) or split['target'] != target \
+                or split['train_size'] != train_size or split['random_state'] != random_state:
+            st.info('The settings above differ from the applied split. Click **Apply Changes** to use them.')
     st.write('')
 
     # Model Selection
@@ -82,7 +72,90 @@ else: # Main Code Start From Here
     tab1, tab2 = st.tabs(['Manual', 'Hyperparameter Tuning'])
      
     with tab1:
-         st.warning('This section is under development. Please check back later.')
+        if split is None:
+            st.warning('Please apply the data preparation settings above first.')
+        else:
+            st.write('''
+                     Choose a model and its hyperparameters. Training runs in the background, so you can keep using the app
+                     and come back to the result later, even after reloading the page.
+                     ''')
+            model = st.selectbox('**Select model**', list(tuning.CLASSIFIERS))
+            params = {}
+            columns = st.columns(len(tuning.CLASSIFIERS[model]))
+            for column, (name, values) in zip(columns, tuning.CLASSIFIERS[model].items()):
+                with column:
+                    params[name] = st.selectbox(f'**{name}**', values, index=len(values) // 2, format_func=str, key=f'manual_{model}_{name}')
+            if st.button('Train Model', use_container_width=True):
+                X_train, X_test, y_train, y_test = modeling.split_arrays(split)
+                job_id = jobs.get_scheduler().submit(modeling.fit_classifier, X_train, y_train, X_test, y_test, model, params, random_state,
+                                                     kind='classification', label=f'Train {model}')
+                attach_job('classification_job', job_id)
+            state = job_status('classification_job')
+            if state is not None and state['status'] == 'done':
+                result = jobs.get_scheduler().load_artifact(state['id'])
+                st.success(f"**{result['model']}** trained in {result['fit_time']:.2f}s with {result['params']}")
+                st.dataframe(pd.DataFrame(result['scores']).T, use_container_width=True)
+                save_model_form('manual', 'classification', result['model'], lambda: jobs.get_scheduler().load_artifact(state['id'], 'model'),
+                                split['version'], split['features'], split['target'], result['params'],
+                                {metric: scores['Test'] for metric, scores in result['scores'].items()})
 
     with tab2:
-        st.warning('This section is under development. Please check back later.')
\ No newline at end of file
+        if split is None:
+            st.warning('Please apply the data preparation settings above first.')
+        else:
+            st.write('''
+                     Search over several models and hyperparameters with cross-validation on the training set.
+                     Successive halving tries every candidate on a small sample first and only gives more data to the best ones.
+                     ''')
+            col1, col2 = st.columns(2)
+            with col1:
+                models = st.multiselect('**Select models**', list(tuning.CLASSIFIERS), default=['Logistic Regression', 'Random Forest', 'Gradient Boosting'])
+                strategy = st.selectbox('**Search strategy**', ['Successive Halving', 'Random Search'])
+                scoring = st.selectbox('**Scoring metric**', tuning.SCORINGS)
+            with col2:
+                n_trials = st.number_input('**Number of candidates**', min_value=1, max_value=200, value=20)
+                cv = st.number_input('**Cross-validation folds**', min_value=2, max_value=10, value=5)
+                time_budget = st.number_input('**Time budget (seconds, 0 = unlimited)**', min_value=0, value=120, step=30)
+                patience = st.number_input('**Early stopping patience (trials, 0 = off)**', min_value=0, value=0,
+                                           disabled=strategy != 'Random Search', help='Stop a random search after this many trials without improvement.')
+            if st.button('Start Tuning', use_container_width=True):
+                if not models:
+                    st.warning('Please select at least one model')
+                else:
+                    X_train, X_test, y_train, y_test = modeling.split_arrays(split)
+                    context = modeling.split_context(split)
+                    cached = tuning.get_trial_cache().entries(context)
+                    job_id = jobs.get_scheduler().submit(tuning.tune, X_train, y_train, X_test, y_test, context, models, strategy, n_trials, cv,
+                                                         scoring, time_budget or None, patience or None, cached,
+                                                         kind='tuning', label=f"Tune {', '.join(models)}")
+                    attach_job('tuning_job', job_id)
+
+            def show_trials(state):
+                if state.get('trials'):
+                    st.dataframe(tuning.trials_table(state['trials']).sort_values('CV Score', ascending=False), use_container_width=True)
+
+            tuning_state = job_status('tuning_job', on_progress=show_trials)
+            if tuning_state is not None and tuning_state['status'] == 'done':
+                results = jobs.get_scheduler().load_artifact(tuning_state['id'])
+                tuning.get_trial_cache().update(results['cache'])
+                for error in sorted({trial['error'] for trial in results['trials'] if 'error' in trial}):
+                    st.warning(f'Some trials failed: {error}')
+                best = results['best']
+                if best is None:
+                    st.warning('No trial finished within the time budget.')
+                else:
+                    st.success(f"Best model: **{best['model']}** with {best['params']}")
+                    col1, col2 = st.columns(2)
+                    col1.metric(f"CV {results['scoring']}", f"{best['score']:.4f}")
+                    col2.metric(f"Test {results['scoring']}", f"{results['test_score']:.4f}")
+                    st.dataframe(tuning.trials_table(results['trials']).sort_values(['Rows', 'CV Score'], ascending=False), use_container_width=True)
+                    save_model_form('tuned', 'classification', best['model'], lambda: jobs.get_scheduler().load_artifact(tuning_state['id'], 'model'),
+                                    split['version'], split['features'], split['target'], best['params'], {results['scoring']: results['test_score']})
+
+    # Saved Models
+    st.subheader('Saved Models')
+    st.write('''
+             Models saved from this page for datasets with the same columns, together with the preprocessing steps of the data they were trained on.
+             Use them to score new files of any size outside the app.
+             ''')
+    saved_models('classification')
\ No newline at end of file
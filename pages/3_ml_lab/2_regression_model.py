@@ -1,22 +1,141 @@
 import streamlit as st
-
-# Page Style
-st.markdown('''
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    ''', unsafe_allow_html=True)
+import pandas as pd
+from core import history, incremental, jobs
+from core.optimize import format_bytes
+from core.ui import attach_job, detach_job, display_dataset, job_status, save_model_form, saved_models
 
 # Page Header 
 st.title('Regression Model')
-st.write('This is the Regression Model page.')
+st.write('''
+         Welcome to the Regression Model Builder! Train regression models that predict continuous values from your data.
+         Models learn incrementally from batches read from disk, so even datasets larger than memory can be used for training.
+         ''')
 
 if 'dataset' not in st.session_state: # Ensure that the dataset has been uploaded
     st.warning('No dataset found. Please upload a dataset on the Home page first.')
 elif st.session_state['problem_type'] == 'Classification' or st.session_state['problem_type'] == 'None': # Ensure that the problem type is Regression
     st.warning('This page is for **Regression** only. Please select a **Regression** problem type on the Home page.')
 else: # Main Code Start From Here
-    st.warning('This page is under development. Please check back later.')
\ No newline at end of file
+    st.subheader('Data Preparation')
+    st.write('''
+             Prepare your dataset for regression by selecting the relevant features and target variable.
+             Rows are split between training and holdout sets while they are streamed, so nothing has to be loaded at once.
+             ''')
+
+    # Data Preparation
+    # 1. Select Dataset
+    dataset_choice = st.selectbox('**Select Dataset**', ['Current Dataset', 'Raw Dataset'])
+    selected_version = history.get_history().current if dataset_choice == 'Current Dataset' else history.get_history().original
+    selected_df = selected_version.df
+    display_dataset(selected_df, selected_version.id, 'selected_dataset')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        # 2. Select Features
+        target = st.selectbox('**Select target (Y variable)**', selected_df.columns)
+        features = st.multiselect('**Select Dependent features (X variables)**', selected_df.columns, [column for column in selected_df.columns if column != target])
+    with col2:
+        # 3. Data Splitting
+        train_size = st.slider('**Train Size**', min_value=0.1, max_value=0.9, step=0.05, value=0.8)
+        test_size = st.slider('**Test Size**', min_value=0.1, max_value=0.9, value=1-train_size, disabled=True)
+        random_state = st.number_input('**Random State**', min_value=0, max_value=100, value=42)
+
+    # Training Data Source
+    source_choice = st.radio('**Training data**', ['Selected dataset', 'File on disk'], horizontal=True,
+                             help='A file on disk is streamed batch by batch and the steps of the selected dataset are replayed on every batch.')
+    if source_choice == 'File on disk':
+        source_name = st.selectbox('**File with the same columns as the uploaded dataset**', incremental.data_files(),
+                                   help=f'CSV and Parquet files placed in {incremental.DATA_DIR} on the server.')
+    st.write('')
+
+    # Model Training
+    st.subheader('Model Training')
+    st.write('''
+            Select an incremental model and configure its hyperparameters. Each epoch streams the whole training set once.
+            Compare with an in-memory fit of the same model to see the accuracy and memory trade-off.
+            ''')
+    model = st.selectbox('**Select model**', list(incremental.REGRESSORS))
+    params = {}
+    columns = st.columns(len(incremental.REGRESSORS[model]))
+    for column, (name, values) in zip(columns, incremental.REGRESSORS[model].items()):
+        with column:
+            params[name] = st.selectbox(f'**{name}**', values, index=len(values) // 2, format_func=str, key=f'regression_{model}_{name}')
+    col1, col2, col3 = st.columns(3)
+    epochs = col1.number_input('**Epochs**', min_value=1, max_value=100, value=5)
+    chunksize = col2.number_input('**Batch size (rows)**', min_value=1000, max_value=1000000, value=incremental.BATCH_ROWS, step=1000)
+    with col3:
+        st.write('')
+        compare = st.checkbox('Compare with in-memory fit', value=True)
+
+    if st.button('Train Model', use_container_width=True):
+        X = selected_df[features]
+        y = selected_df[target]
+        if not features:
+            st.error('Please select at least one feature.')
+        elif X.select_dtypes(include=['object', 'category', 'datetime']).shape[1] > 0 or y.dtype in ['object', 'category', 'datetime', 'bool']:
+            st.error('Selected features contain non-numeric data types. Please select only numeric features.')
+        elif X.isnull().sum().sum() > 0 or y.isnull().sum() > 0:
+            st.error('Selected features contain missing values. Please handle missing values first.')
+        elif source_choice == 'File on disk' and not source_name:
+            st.error(f'No file to train on. Place CSV or Parquet files in {incremental.DATA_DIR} on the server first.')
+        else:
+            if source_choice == 'File on disk':
+                try:
+                    source_path = incremental.data_path(source_name)
+                    incremental.check_source(source_path, selected_version.steps, list(features), target)
+                except ValueError as e:
+                    st.error(str(e))
+                    st.stop()
+                sources, steps, spilled = [source_path] * 2, selected_version.steps, False
+            else: # One temporary copy per job, deleted by the scheduler when the job ends
+                sources, steps, spilled = incremental.spill(selected_version, 2 if compare else 1), (), True
+            args = (steps, list(features), target, model, params, train_size, random_state, epochs, chunksize)
+            scheduler = jobs.get_scheduler()
+            st.session_state['regression_training'] = {'version': selected_version, 'features': list(features), 'target': target}
+            attach_job('regression_job', scheduler.submit(incremental.train_streaming, sources[0], *args, kind='regression', label=f'Stream {model}',
+                                                                  cleanup=sources[:1] if spilled else ()))
+            if compare:
+                attach_job('regression_baseline_job', scheduler.submit(incremental.train_in_memory, sources[1], *args, kind='regression',
+                                                                       label=f'Fit {model} in memory', cleanup=sources[1:] if spilled else ()))
+            else:
+                detach_job('regression_baseline_job')
+
+    def show_epochs(state):
+        if state.get('epochs'):
+            st.line_chart(pd.DataFrame(state['epochs']).set_index('Epoch')[['Train RMSE', 'Holdout RMSE']])
+
+    # Results
+    results, states = {}, {}
+    for key, on_progress in [('regression_job', show_epochs), ('regression_baseline_job', None)]:
+        states[key] = job_status(key, on_progress=on_progress)
+        if states[key] is not None and states[key]['status'] == 'done':
+            results[key] = jobs.get_scheduler().load_artifact(states[key]['id'])
+    if results:
+        streaming = results.get('regression_job')
+        if streaming is not None:
+            st.success(f"**{streaming['model']}** trained on {streaming['rows']} rows with {streaming['params']}")
+            if streaming['epochs']:
+                st.write('**Metrics per epoch**')
+                epochs_df = pd.DataFrame(streaming['epochs']).set_index('Epoch')
+                st.line_chart(epochs_df[['Train RMSE', 'Holdout RMSE']])
+                st.dataframe(epochs_df, use_container_width=True)
+        st.write('**Holdout metrics**')
+        st.dataframe(pd.DataFrame([{
+            'Mode': result['mode'],
+            **result['metrics'],
+            'Fit Time (s)': result['fit_time'],
+            'Peak Memory': format_bytes(result['peak_memory']),
+        } for result in results.values()]).set_index('Mode'), use_container_width=True)
+        training = st.session_state.get('regression_training')
+        if training is not None and streaming is not None:
+            save_model_form('regression', 'regression', streaming['model'],
+                            lambda: jobs.get_scheduler().load_artifact(states['regression_job']['id'], 'model'),
+                            training['version'], training['features'], training['target'], streaming['params'], streaming['metrics'])
+
+    # Saved Models
+    st.subheader('Saved Models')
+    st.write('''
+             Models saved from this page for datasets with the same columns, together with the preprocessing steps of the data they were trained on.
+             Use them to score new files of any size outside the app.
+             ''')
+    saved_models('regression')
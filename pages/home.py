@@ -1,15 +1,7 @@
 import streamlit as st
-import pandas as pd
-
-# Page Style
-st.markdown("""
-    <style>
-        .block-container {
-            max-width: 80%;
-            padding-top: 4.5rem;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+from core import history, ingest, sampling
+from core.optimize import format_bytes
+from core.ui import dataset_summary, display_current_dataset, paged_dataframe
 
 # Page Header 
 st.title('Welcome to Datalyze!')
@@ -22,34 +14,58 @@ st.write('-----')
 # Main Code Start From Here
 # Upload Dataset
 st.subheader('Upload Dataset')
+if st.session_state.pop('dataset_expired', False):
+    st.info('Your dataset was released after a long time without activity, please upload it again.')
 file = st.file_uploader('label', type=['csv', 'xlsx'], label_visibility='collapsed')
 col1, col2 = st.columns([3, 1])
 with col1:
     if file:
-        df = pd.read_csv(file) if file.name.endswith('csv') else pd.read_excel(file)
-        st.dataframe(df)
+        # Only ingest when the upload changed, so reruns keep the work done on the other pages
+        if st.session_state.get('dataset_digest') != ingest.upload_digest(file) or 'dataset' not in st.session_state:
+            progress_bar = st.progress(0.0, text='Loading dataset...')
+            preview = st.empty()
+            df, digest, report = ingest.load_dataset(
+                file,
+                on_preview=lambda head: preview.dataframe(head),
+                on_progress=lambda fraction: progress_bar.progress(fraction, text=f'Loading dataset... {fraction:.0%}'),
+            )
+            progress_bar.empty()
+            preview.empty()
+            history.start(df)
+            st.session_state['dataset_digest'] = digest
+            st.session_state['memory_report'] = report
+            st.session_state['pinned_dtypes'] = set()
+        df = history.get_history().uploaded.df
+        paged_dataframe(df, 'raw_dataset')
         st.write('Shape:', df.shape)
-        st.session_state['dataset'] = df
-        st.session_state['dataset_final'] = df
         # Delete Dataset Button
         if st.button('Delete Dataset'):
-            del st.session_state['dataset']
-            del st.session_state['dataset_final']
+            history.clear()
+            del st.session_state['dataset_digest']
+            del st.session_state['memory_report']
             st.rerun()
     elif 'dataset' in st.session_state:
-        df = st.session_state['dataset']
-        st.dataframe(df)
+        df = history.get_history().uploaded.df
+        paged_dataframe(df, 'raw_dataset')
         st.write('Raw Dataset Shape:', df.shape)
         # Delete Dataset Button
         if st.button('Delete Dataset'):
-            del st.session_state['dataset']
-            del st.session_state['dataset_final']
+            history.clear()
+            st.session_state.pop('dataset_digest', None)
+            st.session_state.pop('memory_report', None)
             st.rerun()
 with col2:
     if 'dataset' in st.session_state:
-        df = st.session_state['dataset']
-        dtypes_df = pd.DataFrame(df.dtypes, columns=['Data Type'])
+        original = history.get_history().uploaded
+        dtypes_df = dataset_summary(original.id, original.df)[0]
         st.write(dtypes_df, use_container_width=True)
+        # Memory Report
+        if 'memory_report' in st.session_state:
+            report = st.session_state['memory_report']
+            before, after = report['Before (KB)'].sum() * 1024, report['After (KB)'].sum() * 1024
+            st.write(f'**Memory:** {format_bytes(before)} → {format_bytes(after)} ({(after - before) / max(before, 1):.0%})')
+            with st.expander('Memory Report'):
+                st.dataframe(report, use_container_width=True)
 
 # Select Problem Type
 st.subheader('Select Problem Type')
@@ -69,14 +85,38 @@ if 'problem_type' in st.session_state:
     else:
         st.warning('Please select a problem type to use **Machine Learning Lab** section')
         
+# Sampling Mode
+if 'dataset' in st.session_state:
+    st.subheader('Sampling Mode')
+    st.write('''
+             Work on a sample of the rows to keep every page responsive on large datasets. The steps you apply are fitted on the sample
+             and can be applied to the full dataset from the sidebar at any time, in the background.
+             ''')
+    dataset_history = history.get_history()
+    settings = dataset_history.sampling or {}
+    uploaded = dataset_history.uploaded.df
+    modes = ['Full dataset'] + list(sampling.METHODS)
+    current_mode = next((label for label, method in sampling.METHODS.items() if method == settings.get('method')), 'Full dataset')
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        mode = st.selectbox('**Mode**', modes, index=modes.index(current_mode))
+    with col2:
+        rows = st.number_input('**Rows in the sample**', min_value=1, max_value=len(uploaded), value=settings.get('rows', min(sampling.SAMPLE_ROWS, len(uploaded))),
+                               step=1000, disabled=mode == 'Full dataset')
+    with col3:
+        columns = list(uploaded.columns)
+        by = st.selectbox('**Stratify by**', columns, index=columns.index(settings['by']) if settings.get('by') in columns else len(columns) - 1,
+                          disabled=mode != 'Stratified sample', help='Usually the target, so every class keeps its share of the rows.')
+    new_settings = {'method': sampling.METHODS[mode], 'rows': int(rows)} if mode != 'Full dataset' else None
+    if new_settings is not None and new_settings['method'] == 'stratified':
+        new_settings['by'] = by
+    if new_settings != dataset_history.sampling:
+        if len(dataset_history.versions) > 1 or dataset_history.dropped:
+            st.warning('Changing the mode starts over from the uploaded dataset, the steps applied so far are discarded.')
+        if st.button('Apply Sampling Mode'):
+            history.start(uploaded, sampling_settings=new_settings)
+            st.rerun()
+
 # Display Current Dataset
-st.markdown('---')
-st.subheader('Current Dataset')
-col1, col2 = st.columns([3, 1])
-with col1:
-    df_current = st.session_state['dataset_final']
-    dtypes_df_current = pd.DataFrame(df_current.dtypes, columns=['Data Type'])
-    st.dataframe(df_current, use_container_width=True)
-    st.write('Shape:', df_current.shape)
-with col2:
-    st.write(dtypes_df_current, use_container_width=True)
+if 'dataset_final' in st.session_state:
+    display_current_dataset()